@@ -1,24 +1,77 @@
-import tkinter as tk
-from tkinter import filedialog, colorchooser, messagebox, ttk, scrolledtext
-from PIL import Image, ImageTk, ImageDraw, ImageFont, ImageOps
+import time
+_STARTUP_T0 = time.perf_counter()  # 起動時間の計測 (--profile-startup) の基準
+
+from PIL import Image
 import sys
 import os
 import traceback
-import copy
 import json
 import base64
 import io
-import math
-import numpy as np
+import struct
+import zipfile
+import hashlib
+import threading
+import queue
+import tempfile
+import importlib
+import importlib.util
 import shutil
 import glob
-import subprocess
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+
+class StartupProfile:
+    """起動にかかった時間の記録。--profile-startup を付けて起動したときだけ表示する"""
+
+    def __init__(self, enabled):
+        self.enabled = enabled
+        self.events = []   # (種類, 秒, 項目)。種類は "at" (起動からの経過) か "took" (所要時間)
+
+    def record(self, label, seconds):
+        """label にかかった時間を記録"""
+        self.events.append(("took", seconds, label))
+
+    def mark(self, label):
+        """起動開始からの経過時間を記録"""
+        self.events.append(("at", time.perf_counter() - _STARTUP_T0, label))
+
+    def report(self):
+        if not self.enabled: return
+        print("--- startup profile (秒) ---")
+        for kind, sec, label in self.events: print(f"{kind:>4} {sec:8.3f}  {label}")
+
+STARTUP_PROFILE = StartupProfile("--profile-startup" in sys.argv)
+
+class _LazyModule:
+    """最初に属性を参照したときに import するモジュールの代理。起動直後の画面表示に要らない重いモジュール用"""
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            t = time.perf_counter()
+            self._module = importlib.import_module(self._name)
+            STARTUP_PROFILE.record(f"import {self._name}", time.perf_counter() - t)
+        return getattr(self._module, attr)
+
+np = _LazyModule("numpy")
+skia = _LazyModule("skia")
 
-# ★ Skiaのインポートチェック
+# tkinter は GUI を使うときだけ必要 (render サブコマンドはなくても動く)
 try:
-    import skia
+    import tkinter as tk
+    from tkinter import filedialog, colorchooser, messagebox, ttk, scrolledtext
+    ImageTk = _LazyModule("PIL.ImageTk")
 except ImportError:
-    messagebox.showerror("エラー", "skia-python がインストールされていません。\npip install skia-python numpy を実行してください。")
+    tk = filedialog = colorchooser = messagebox = ttk = scrolledtext = ImageTk = None
+
+# ★ Skiaのインポートチェック (読み込み自体は最初に使うときまで遅らせる)
+if importlib.util.find_spec("skia") is None or importlib.util.find_spec("numpy") is None:
+    if messagebox: messagebox.showerror("エラー", "skia-python がインストールされていません。\npip install skia-python numpy を実行してください。")
+    else: print("skia-python がインストールされていません。pip install skia-python numpy を実行してください。", file=sys.stderr)
     sys.exit(1)
 
 # =========================================================
@@ -51,19 +104,29 @@ def get_base_dir():
 
 BASE_DIR = get_base_dir()
 FONTS_DIR = os.path.join(BASE_DIR, "fonts")
+AUTOSAVE_DIR = os.path.join(BASE_DIR, "autosave")
+LIBRARY_DIR = os.path.join(BASE_DIR, "library")
 
 # システムフォント
+# 名前 -> (パス, コレクション (.ttc) 内のフォント番号)
 SYSTEM_FONTS = {
-    "メイリオ": "C:/Windows/Fonts/meiryo.ttc",
-    "游ゴシック": "C:/Windows/Fonts/YuGothB.ttc",
-    "MS ゴシック": "C:/Windows/Fonts/msgothic.ttc",
-    "MS Pゴシック": "C:/Windows/Fonts/msgothic.ttc",
-    "MS 明朝": "C:/Windows/Fonts/msmincho.ttc",
-    "Arial": "arial.ttf"
+    "メイリオ": ("C:/Windows/Fonts/meiryo.ttc", 0),
+    "游ゴシック": ("C:/Windows/Fonts/YuGothB.ttc", 0),
+    "MS ゴシック": ("C:/Windows/Fonts/msgothic.ttc", 0),
+    "MS Pゴシック": ("C:/Windows/Fonts/msgothic.ttc", 1),
+    "MS 明朝": ("C:/Windows/Fonts/msmincho.ttc", 0),
+    "Arial": ("arial.ttf", 0)
 }
 
 # 実行時に動的に構築するフォントリスト
 FONT_MAP = SYSTEM_FONTS.copy()
+FONT_EXTENSIONS = {'.ttf', '.ttc', '.otf'}
+
+# フォント索引 (ファイルごとのフォント情報を起動をまたいで覚えておく)
+FONT_INDEX_PATH = os.path.join(BASE_DIR, "font_index.json")
+FONT_RECENT_MAX = 8   # 起動時に先読みする最近使ったフォントの数
+# 収録文字を調べておく範囲 (CJK の記号・かな / 漢字 / 全角英数)
+CJK_COVERAGE_RANGES = ((0x3000, 0x30FF), (0x4E00, 0x9FFF), (0xFF00, 0xFFEF))
 
 # 縦書き用 文字置換マップ
 VERTICAL_CHAR_MAP = {
@@ -82,6 +145,89 @@ ROTATE_CHARS = {'…', '‥', 'ー', '-', ':', ';', '＝', '='}
 SMALL_KANA = {'っ', 'ゃ', 'ゅ', 'ょ', 'ぁ', 'ぃ', 'ぅ', 'ぇ', 'ぉ', 
               'ッ', 'ャ', 'ュ', 'ョ', 'ァ', 'ィ', 'ゥ', 'ェ', 'ォ'}
 
+# 縦書き時の文字ごとの扱い: 文字 -> (描画する文字, 90度回転するか, 小書き補正するか)
+# VERTICAL_CHAR_MAP / ROTATE_CHARS / SMALL_KANA から事前に作っておく
+VERTICAL_CHAR_RULES = {}
+for _c in set(VERTICAL_CHAR_MAP) | ROTATE_CHARS | SMALL_KANA:
+    _rot = _c in ROTATE_CHARS
+    VERTICAL_CHAR_RULES[_c] = (_c if _rot else VERTICAL_CHAR_MAP.get(_c, _c), _rot, _c in SMALL_KANA)
+del _c, _rot
+
+# 描画キャッシュのメモリ上限
+TEXT_CACHE_MAX_BYTES = 128 * 1024 * 1024
+IMAGE_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+# プレビューのキャンバス背景色 (Skia の色)
+CANVAS_BG_COLOR = 0xFF333333
+COLOR_TRANSPARENT = 0x00000000  # skia.ColorTRANSPARENT と同じ値
+
+# 再描画の最短間隔 (秒)。これより短い間隔の描画要求は1回にまとめる
+RENDER_FRAME_BUDGET = 1 / 60
+
+# プレビューはこの大きさ (px) のタイルに分け、見えている部分だけを描いてキャッシュする
+TILE_SIZE = 256
+TILE_CACHE_MAX_BYTES = 96 * 1024 * 1024
+# 拡大表示で、描いた画像がこれより大きくなるアイテムは丸ごと画像にせず、タイルにかかる部分だけを直接描く
+TILE_ITEM_CLIP_BYTES = 16 * 1024 * 1024
+# ホイール1段の拡大率と、拡大表示の上限 (画像の 1px を画面の何 px まで拡大するか)
+VIEW_ZOOM_STEP = 1.25
+VIEW_MAX_SCALE = 4.0
+
+# 当たり判定の索引のマス目の大きさ (画像座標の px)。クリック位置から HIT_ALPHA_RADIUS px 以内に
+# 不透明度 HIT_ALPHA_MIN 以上の画素があるアイテムだけを選ぶ (透明な部分はクリックが下に抜ける)
+HIT_GRID_CELL = 256
+HIT_ALPHA_MIN = 32
+HIT_ALPHA_RADIUS = 3
+
+# 原寸の書き出しは、この高さ (px) の帯ごとに合成する。アイテムの描画は EXPORT_THREADS 本のスレッドで並べて行う
+EXPORT_BAND_HEIGHT = 1024
+EXPORT_THREADS = min(8, os.cpu_count() or 1)
+
+# 書き出しプロファイル。1回の合成から、有効なプロファイルごとに1ファイルずつ書き出す。
+# max_size は長辺の上限 (0 なら原寸)、quality は JPEG/WebP、compress_level は PNG の設定。
+# mode が RGB / L のときは白地に重ねて透明をなくす。ファイル名は「保存先の名前 + suffix + 拡張子」
+EXPORT_FORMATS = {"PNG": ".png", "JPEG": ".jpg", "WEBP": ".webp"}
+EXPORT_MODES = ("RGBA", "RGB", "L")
+DEFAULT_EXPORT_PROFILES = [
+    {"name": "印刷用", "enabled": True, "format": "PNG", "max_size": 0, "quality": 95, "compress_level": 6, "mode": "RGBA", "suffix": ""},
+    {"name": "Web用", "enabled": False, "format": "WEBP", "max_size": 1600, "quality": 85, "compress_level": 6, "mode": "RGB", "suffix": "_web"},
+    {"name": "サムネイル", "enabled": False, "format": "JPEG", "max_size": 320, "quality": 80, "compress_level": 6, "mode": "RGB", "suffix": "_thumb"},
+]
+
+# 編集履歴 (元に戻す) が使うメモリの上限と、連続した操作を1手にまとめる間隔 (秒)
+HISTORY_MAX_BYTES = 64 * 1024 * 1024
+HISTORY_MERGE_WINDOW = 1.0
+
+# プロジェクトファイル (.zmm) の形式。zip の中に manifest.json と画像・消しゴムのデータを入れる
+# (バージョン 2 から、素材は共有ライブラリの内容ハッシュだけで参照できる)
+PROJECT_FORMAT = "zmm-archive"
+PROJECT_FORMAT_VERSION = 2
+# True なら素材は LIBRARY_DIR に1つだけ置き、プロジェクトには内容ハッシュだけを書く。
+# 別の PC に渡すプロジェクトを作るときは False にすると、これまで通り素材を埋め込む
+SHARE_ASSET_LIBRARY = True
+PROJECT_MANIFEST = "manifest.json"
+PROJECT_STROKES = "strokes.bin"
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+# 自動保存ジャーナルをスナップショットに圧縮するまでの操作数
+JOURNAL_COMPACT_OPS = 500
+
+# 素材一覧のサムネイルの大きさと、作ったサムネイルを内容ハッシュの名前で置いておくフォルダ
+ASSET_THUMB_SIZE = 140
+THUMB_CACHE_DIR = os.path.join(BASE_DIR, "cache", "thumbs")
+# 素材一覧の1行の高さ (px)。一覧は見えている行の部品だけを作る
+ASSET_ROW_HEIGHT = ASSET_THUMB_SIZE + 40
+
+# チャプター (複数ページ) でデコードしたまま持っておくページの合計サイズと、先読みする前後のページ数
+# 600dpi のページは背景と消しゴムレイヤーで 1 枚 400MB 程度になる
+PAGE_CACHE_MAX_BYTES = 1536 * 1024 * 1024
+PAGE_PREFETCH_RADIUS = 1
+
+# 背景の縮小画像の列 (1/2, 1/4, ...) をどこまで作るか (短い辺の長さ)。
+# KEEP_FULL_RES_BACKGROUND を False にすると、縮小画像の列ができた背景は原寸を持たず、使うたびに読み直す (省メモリ)
+PYRAMID_MIN_SIZE = 256
+KEEP_FULL_RES_BACKGROUND = True
+
 ALIGN_H_OPTIONS = ["左寄せ (Left)", "中央 (Center)", "右寄せ (Right)"]
 ALIGN_V_OPTIONS = ["上寄せ (Top)", "中央 (Middle)", "下寄せ (Bottom)"]
 
@@ -94,29 +240,2118 @@ except AttributeError:
     RESAMPLE_BICUBIC = Image.BICUBIC
     RESAMPLE_BILINEAR = Image.BILINEAR
 
+def skia_color(hex_color):
+    """'#rrggbb' を不透明な Skia の色 (0xAARRGGBB) に変換"""
+    return int(hex_color.replace("#", "0xFF"), 16)
+
+def pil_to_skia(img):
+    """PIL画像を Skia の画像に変換 (ピクセルはコピーされる)"""
+    arr = np.asarray(img.convert("RGBA") if img.mode != "RGBA" else img)
+    return skia.Image.fromarray(arr, colorType=skia.kRGBA_8888_ColorType, alphaType=skia.kUnpremul_AlphaType)
+
+def skia_to_pil(img):
+    """Skia の画像を PIL の RGBA 画像に変換"""
+    return Image.fromarray(img.toarray(colorType=skia.kRGBA_8888_ColorType, alphaType=skia.kUnpremul_AlphaType), "RGBA")
+
+def _rotation(w, h, angle_deg):
+    """w x h の画像を中心基準で反時計回りに回す変換と、回した後の範囲 (整数に丸めたもの)"""
+    matrix = skia.Matrix(); matrix.setRotate(-angle_deg, w / 2, h / 2)
+    return matrix, matrix.mapRect(skia.Rect.MakeWH(w, h)).roundOut()
+
+def rotate_skia_image(img, angle_deg):
+    """PIL の rotate(expand=True) と同じく中心基準で反時計回りに回し、はみ出さない大きさの画像を返す"""
+    matrix, dev = _rotation(img.width(), img.height(), angle_deg)
+    surface = skia.Surface(dev.width(), dev.height())
+    with surface as canvas:
+        canvas.translate(-dev.left(), -dev.top()); canvas.concat(matrix)
+        canvas.drawImage(img, 0, 0, skia.SamplingOptions(skia.CubicResampler.Mitchell()))
+    return surface.makeImageSnapshot()
+
+
+class SkiaCompositor:
+    """
+    背景・消しゴム・配置画像・テキストを重ねる1枚の Skia ラスタサーフェス。
+    サーフェスは NumPy 配列 (RGBA, 乗算済みアルファ) を直接包んでおり、同じ大きさなら使い回す。
+    """
+
+    def __init__(self):
+        self.buffer = None
+        self.surface = None
+
+    def begin(self, width, height, clear_color=COLOR_TRANSPARENT):
+        """width x height のキャンバスを clear_color で塗りつぶして返す"""
+        if self.buffer is None or self.buffer.shape[:2] != (height, width):
+            self.buffer = np.zeros((height, width, 4), np.uint8)
+            self.surface = skia.Surface(self.buffer, colorType=skia.kRGBA_8888_ColorType, alphaType=skia.kPremul_AlphaType)
+        canvas = self.surface.getCanvas()
+        canvas.clear(clear_color)
+        return canvas
+
+    def to_pil(self, opaque=False):
+        """
+        合成結果を PIL 画像として渡す。
+        opaque=True (全面不透明) のときはバッファをコピーせずに共有するので、次の begin() までに使い切ること。
+        そうでなければ乗算済みアルファを戻しながら新しい画像にする。
+        """
+        h, w = self.buffer.shape[:2]
+        if opaque: return Image.frombuffer("RGBA", (w, h), self.buffer, "raw", "RGBA", 0, 1)
+        return Image.frombuffer("RGBA", (w, h), self.buffer, "raw", "RGBa", 0, 1)
+
+class StrokeStore:
+    """
+    消しゴムの点を列ごとの NumPy 配列で持つ入れ物。
+    x, y, 太さは float32、色はパレットの番号 (uint16) で持ち、線ごとの開始位置を runs に記録する。
+    点は末尾への追加と、末尾からの切り詰め (元に戻す) しかしない。
+    """
+    MAGIC = b"ZSTK"
+    VERSION = 1
+
+    def __init__(self, capacity=1024):
+        self.count = 0
+        self._capacity = capacity
+        self.palette = []       # 色番号 -> '#rrggbb'
+        self._color_ids = {}    # '#rrggbb' -> 色番号
+        self.runs = []          # 各線の開始位置 (昇順)
+        self._arrays = None     # "x" / "y" / "size" / "color" -> 配列 (_ensure_arrays で確保する)
+
+    def _ensure_arrays(self):
+        # 配列は最初に使うときに確保する (空のページを作るだけなら numpy を読み込まない)
+        if self._arrays is None:
+            cap = self._capacity
+            self._arrays = {"x": np.empty(cap, np.float32), "y": np.empty(cap, np.float32),
+                            "size": np.empty(cap, np.float32), "color": np.empty(cap, np.uint16)}
+        return self._arrays
+
+    @property
+    def x(self): return self._ensure_arrays()["x"]
+
+    @property
+    def y(self): return self._ensure_arrays()["y"]
+
+    @property
+    def size(self): return self._ensure_arrays()["size"]
+
+    @property
+    def color(self): return self._ensure_arrays()["color"]
+
+    def __len__(self):
+        return self.count
+
+    def __bool__(self):
+        return self.count > 0
+
+    def _color_id(self, color):
+        cid = self._color_ids.get(color)
+        if cid is None:
+            cid = len(self.palette)
+            self.palette.append(color); self._color_ids[color] = cid
+        return cid
+
+    def _reserve(self, n):
+        cap = len(self.x)
+        if n <= cap: return
+        new_cap = max(n, cap * 2)
+        arrays = self._arrays
+        for name, old in arrays.items():
+            arr = np.empty(new_cap, old.dtype); arr[:self.count] = old[:self.count]
+            arrays[name] = arr
+
+    def begin_run(self):
+        """新しい線を始める"""
+        if not self.runs or self.runs[-1] != self.count: self.runs.append(self.count)
+
+    def append(self, x, y, size, color):
+        i = self.count
+        self._reserve(i + 1)
+        if not self.runs: self.runs.append(0)
+        self.x[i] = x; self.y[i] = y; self.size[i] = size; self.color[i] = self._color_id(color)
+        self.count = i + 1
+
+    def truncate(self, n):
+        """先頭 n 点だけを残す (元に戻す用)"""
+        n = max(0, min(n, self.count))
+        self.count = n
+        while self.runs and self.runs[-1] >= n: self.runs.pop()
+
+    def copy(self):
+        st = StrokeStore(max(1, self.count))
+        st.count = self.count
+        st.x[:self.count] = self.x[:self.count]; st.y[:self.count] = self.y[:self.count]
+        st.size[:self.count] = self.size[:self.count]; st.color[:self.count] = self.color[:self.count]
+        st.palette = list(self.palette); st._color_ids = dict(self._color_ids); st.runs = list(self.runs)
+        return st
+
+    def slice(self, start, end=None):
+        """start から end までの点を、線の区切りごと新しい入れ物に写す"""
+        end = self.count if end is None else min(end, self.count)
+        n = max(0, end - start)
+        st = StrokeStore(max(1, n))
+        st.x[:n] = self.x[start:end]; st.y[:n] = self.y[start:end]; st.size[:n] = self.size[start:end]
+        st.palette = list(self.palette); st._color_ids = dict(self._color_ids)
+        st.color[:n] = self.color[start:end]
+        st.runs = [r - start for r in self.runs if start <= r < end]
+        if n and (not st.runs or st.runs[0] != 0): st.runs.insert(0, 0)
+        st.count = n
+        return st
+
+    def extend(self, other):
+        """other の点を線の区切りを保ったまま末尾に足す (やり直し用)"""
+        base = self.count
+        n = other.count
+        if not n: return
+        self._reserve(base + n)
+        self.x[base:base + n] = other.x[:n]; self.y[base:base + n] = other.y[:n]; self.size[base:base + n] = other.size[:n]
+        remap = np.array([self._color_id(c) for c in other.palette] or [0], np.uint16)
+        self.color[base:base + n] = remap[other.color[:n]]
+        for r in other.runs:
+            if not self.runs or self.runs[-1] != base + r: self.runs.append(base + r)
+        self.count = base + n
+
+    def bounds(self, start=0, end=None):
+        """start から end までの点が描く範囲 (x0, y0, x1, y1)。点がなければ None"""
+        end = self.count if end is None else min(end, self.count)
+        if end <= start: return None
+        x = self.x[start:end]; y = self.y[start:end]; r = self.size[start:end] / 2 + 1
+        return float((x - r).min()), float((y - r).min()), float((x + r).max()), float((y + r).max())
+
+    @property
+    def nbytes(self):
+        """点データが使っているおおよそのバイト数"""
+        return self.count * 14 + len(self.runs) * 8 + sum(len(c) for c in self.palette)
+
+    def scaled(self, sc):
+        """sc 倍した (x, y, 太さ) の配列をまとめて返す"""
+        n = self.count
+        return self.x[:n] * sc, self.y[:n] * sc, self.size[:n] * sc
+
+    def iter_runs(self):
+        """各線の (開始, 終了) を返す"""
+        starts = self.runs
+        for i, start in enumerate(starts):
+            end = starts[i + 1] if i + 1 < len(starts) else self.count
+            if start < end: yield start, end
+
+    def dab(self, i):
+        """i 番目の点 (x, y, 太さ, 色)。負の番号は末尾から数える"""
+        if i < 0: i += self.count
+        return (float(self.x[i]), float(self.y[i]), float(self.size[i]), self.palette[self.color[i]])
+
+    def __iter__(self):
+        """(x, y, 太さ, 色) を1点ずつ返す"""
+        pal = self.palette
+        for i in range(self.count):
+            yield (float(self.x[i]), float(self.y[i]), float(self.size[i]), pal[self.color[i]])
+
+    def to_bytes(self):
+        n = self.count
+        pal = "\n".join(self.palette).encode("utf-8")
+        runs = np.asarray(self.runs, np.uint32)
+        header = self.MAGIC + struct.pack("<HIII", self.VERSION, n, len(runs), len(pal))
+        return b"".join([header, pal,
+                         self.x[:n].astype("<f4").tobytes(), self.y[:n].astype("<f4").tobytes(),
+                         self.size[:n].astype("<f4").tobytes(), self.color[:n].astype("<u2").tobytes(),
+                         runs.astype("<u4").tobytes()])
+
+    @classmethod
+    def from_bytes(cls, data):
+        if data[:4] != cls.MAGIC: raise ValueError("stroke data: bad magic")
+        version, n, nruns, npal = struct.unpack_from("<HIII", data, 4)
+        if version != cls.VERSION: raise ValueError(f"stroke data: unsupported version {version}")
+        pos = 4 + struct.calcsize("<HIII")
+        st = cls(max(1, n))
+        pal = data[pos:pos + npal].decode("utf-8"); pos += npal
+        st.palette = pal.split("\n") if pal else []
+        st._color_ids = {c: i for i, c in enumerate(st.palette)}
+        for name, dt, size in (("x", "<f4", 4), ("y", "<f4", 4), ("size", "<f4", 4), ("color", "<u2", 2)):
+            getattr(st, name)[:n] = np.frombuffer(data, dt, n, pos); pos += n * size
+        st.runs = np.frombuffer(data, "<u4", nruns, pos).astype(int).tolist()
+        st.count = n
+        return st
+
+    @classmethod
+    def from_legacy(cls, strokes, runs=None):
+        """旧形式 ([x, y, 太さ, 色] のリスト) から作る。runs が無ければ点ごとに別の線とみなす"""
+        st = cls(max(1, len(strokes)))
+        starts = set(range(len(strokes)) if runs is None else runs)
+        for i, (x, y, sz, c) in enumerate(strokes):
+            if i in starts: st.begin_run()
+            st.append(x, y, sz, c)
+        return st
+
+class StrokeLayer:
+    """
+    消しゴムの跡を画像と同じ解像度で保持するラスタレイヤー。
+    新しい点は同じ線の直前の点と丸端の線分でつないで描き足すので、速く動かしても途切れず、
+    描き足すコストは新しい部分の長さだけに比例する。
+    プレビュー用の縮小版は、前回から描き変わった範囲だけをこのレイヤーから縮小し直す。
+    """
+
+    def __init__(self, width, height):
+        self.width, self.height = width, height
+        self.buffer = np.zeros((height, width, 4), np.uint8)
+        self.surface = skia.Surface(self.buffer, colorType=skia.kRGBA_8888_ColorType, alphaType=skia.kPremul_AlphaType)
+        self.empty = True
+        self._paint = skia.Paint(AntiAlias=True, StrokeCap=skia.Paint.kRound_Cap)
+        self._last = None            # 同じ線の直前の点 (x, y, size, color)
+        self._preview = None         # 縮小版のサーフェス
+        self._preview_size = None
+        self._dirty = None           # 縮小版に未反映の範囲 (画像座標の skia.IRect)
+
+    def begin_run(self):
+        """新しい線を始める (直前の点とはつながない)"""
+        self._last = None
+
+    def add_dab(self, x, y, size, color):
+        """点を1つ描き足す。同じ線の直前の点とは線分でつなぐ"""
+        paint = self._paint
+        paint.setColor(skia_color(color))
+        canvas = self.surface.getCanvas()
+        last = self._last
+        if last is not None and last[2] == size and last[3] == color:
+            paint.setStyle(skia.Paint.kStroke_Style); paint.setStrokeWidth(size)
+            canvas.drawLine(last[0], last[1], x, y, paint)
+            x0, y0, x1, y1 = min(last[0], x), min(last[1], y), max(last[0], x), max(last[1], y)
+        else:
+            paint.setStyle(skia.Paint.kFill_Style)
+            canvas.drawCircle(x, y, size / 2, paint)
+            x0, y0, x1, y1 = x, y, x, y
+        self._last = (x, y, size, color)
+        self.empty = False
+        r = size / 2 + 1
+        rect = skia.Rect.MakeLTRB(x0 - r, y0 - r, x1 + r, y1 + r).roundOut()
+        if self._dirty is None: self._dirty = rect
+        else: self._dirty.join(rect)
+
+    def replay(self, store, scale=1.0):
+        """StrokeStore から描き直す。描き足したときと同じ結果になるよう、同じ手順で点をつなぐ"""
+        self.surface.getCanvas().clear(skia.ColorTRANSPARENT)
+        self.empty = True
+        if store:
+            xs, ys, sizes = store.scaled(scale)
+            colors = store.color[:len(store)]; palette = store.palette
+            for start, end in store.iter_runs():
+                self.begin_run()
+                for i in range(start, end):
+                    self.add_dab(float(xs[i]), float(ys[i]), float(sizes[i]), palette[colors[i]])
+        self._last = None; self._preview = None; self._dirty = None
+
+    @property
+    def nbytes(self):
+        n = self.buffer.nbytes
+        if self._preview is not None: n += self._preview_size[0] * self._preview_size[1] * 4
+        return n
+
+    def image(self):
+        """画像解像度のレイヤー"""
+        return self.surface.makeImageSnapshot()
+
+    def draw_region(self, canvas, sc, rect):
+        """sc 倍のページ座標で rect (x0, y0, x1, y1) の範囲だけを canvas に描く (拡大表示のタイル用)"""
+        x0, y0, x1, y1 = rect
+        src = skia.Rect.MakeLTRB(x0 / sc, y0 / sc, x1 / sc, y1 / sc).roundOut()
+        if self.empty or not src.intersect(skia.IRect.MakeWH(self.width, self.height)): return
+        sub = self.surface.makeImageSnapshot(src)
+        canvas.drawImageRect(sub, skia.Rect.MakeWH(src.width(), src.height()),
+                             skia.Rect.MakeLTRB(src.left() * sc, src.top() * sc, src.right() * sc, src.bottom() * sc),
+                             skia.SamplingOptions(skia.FilterMode.kLinear, skia.MipmapMode.kNone))
+
+    def preview_image(self, size):
+        """size に縮小したレイヤー。描き足された範囲だけを縮小し直す"""
+        w, h = size
+        if self._preview is None or self._preview_size != size:
+            self._preview = skia.Surface(w, h)
+            self._preview_size = size
+            self._dirty = skia.IRect.MakeWH(self.width, self.height) if not self.empty else None
+            self._preview.getCanvas().clear(skia.ColorTRANSPARENT)
+
+        if self._dirty is not None:
+            d = self._dirty; self._dirty = None
+            sx = w / self.width; sy = h / self.height
+            # 縮小先の整数ピクセル範囲を決め、それを覆う元画像の範囲を切り出して縮小する
+            dst = skia.Rect.MakeLTRB(d.left() * sx, d.top() * sy, d.right() * sx, d.bottom() * sy).roundOut()
+            if not dst.intersect(skia.IRect.MakeWH(w, h)): return self._preview.makeImageSnapshot()
+            src = skia.Rect.MakeLTRB(dst.left() / sx, dst.top() / sy, dst.right() / sx, dst.bottom() / sy).roundOut()
+            if src.intersect(skia.IRect.MakeWH(self.width, self.height)):
+                sub = self.surface.makeImageSnapshot(src).withDefaultMipmaps()
+                canvas = self._preview.getCanvas()
+                canvas.save()
+                canvas.clipRect(skia.Rect.Make(dst))
+                canvas.clear(skia.ColorTRANSPARENT)
+                canvas.drawImageRect(sub, skia.Rect.MakeWH(src.width(), src.height()),
+                                     skia.Rect.MakeLTRB(src.left() * sx, src.top() * sy, src.right() * sx, src.bottom() * sy),
+                                     skia.SamplingOptions(skia.FilterMode.kLinear, skia.MipmapMode.kLinear))
+                canvas.restore()
+        return self._preview.makeImageSnapshot()
+
+def _font_face_count(path):
+    """フォントファイルに入っているフォントの数 (.ttc ならヘッダーから読む)"""
+    with open(path, "rb") as f: head = f.read(12)
+    if head[:4] == b"ttcf": return struct.unpack(">I", head[8:12])[0]
+    return 1
+
+def probe_font_faces(path):
+    """フォントファイルを開いて、中の各フォントの情報 (番号・ファミリー名・スタイル・CJK の収録文字) を調べる"""
+    codepoints = [c for lo, hi in CJK_COVERAGE_RANGES for c in range(lo, hi + 1)]
+    faces = []
+    for i in range(_font_face_count(path)):
+        tf = skia.Typeface.MakeFromFile(path, i)
+        if tf is None: continue
+        names = dict((lang, name) for name, lang in tf.getFamilyNames())
+        ja = next((n for lang, n in names.items() if lang.startswith("ja")), None)
+        covered = np.asarray(tf.unicharsToGlyphs(codepoints), np.uint32) != 0
+        faces.append({
+            "index": i, "family": tf.getFamilyName(), "name": ja or tf.getFamilyName(),
+            "weight": tf.fontStyle().weight(), "italic": tf.isItalic(),
+            "coverage": base64.b64encode(np.packbits(covered).tobytes()).decode("ascii"),
+        })
+    return faces
+
+class FontIndex:
+    """
+    フォントファイルの索引 (font_index.json)。パス・更新時刻・サイズが前回と同じファイルは開かずに、
+    覚えておいた情報 (ファミリー名・スタイル・.ttc 内の番号・CJK の収録文字) を使う。
+    最近使ったフォントも覚えておき、起動時に先読みする。
+    """
+    VERSION = 1
+
+    def __init__(self, path):
+        self.path = path
+        self.files = {}     # パス -> {"mtime", "size", "faces": [...]}
+        self.recent = []    # 最近使ったフォント名 (新しい順)
+        self.dirty = False
+        self.loaded = False
+        self._coverage = {} # (パス, 番号) -> 収録文字のビット列
+
+    def load(self):
+        self.loaded = True
+        try:
+            with open(self.path, encoding="utf-8") as f: d = json.load(f)
+            if d.get("version") != self.VERSION: return
+            self.files = d.get("files", {}); self.recent = d.get("recent", [])
+        except (OSError, ValueError):
+            pass
+
+    def save(self):
+        if not self.dirty: return
+        data = json.dumps({"version": self.VERSION, "files": self.files, "recent": self.recent}, ensure_ascii=False)
+        try:
+            atomic_write_file(self.path, lambda f: f.write(data.encode("utf-8")))
+            self.dirty = False
+        except OSError as e:
+            print(f"Font index save failed: {e}")
+
+    def faces(self, path):
+        """path の中のフォント情報。ファイルが変わっていなければ索引から返す"""
+        try: st = os.stat(path)
+        except OSError: return []
+        e = self.files.get(path)
+        if e and e["mtime"] == st.st_mtime_ns and e["size"] == st.st_size: return e["faces"]
+        try: faces = probe_font_faces(path)
+        except Exception as ex:
+            print(f"Font probe failed {path}: {ex}"); faces = []
+        self.files[path] = {"mtime": st.st_mtime_ns, "size": st.st_size, "faces": faces}
+        self._coverage = {k: v for k, v in self._coverage.items() if k[0] != path}
+        self.dirty = True
+        return faces
+
+    def prune(self, paths):
+        """paths 以外のファイルの情報を捨てる"""
+        for p in [p for p in self.files if p not in paths]:
+            del self.files[p]; self.dirty = True
+
+    def touch(self, font_key):
+        """font_key を最近使ったフォントの先頭にする"""
+        if self.recent[:1] == [font_key]: return
+        self.recent = ([font_key] + [k for k in self.recent if k != font_key])[:FONT_RECENT_MAX]
+        self.dirty = True
+
+    def missing_chars(self, path, index, text):
+        """text のうち、このフォントに字形が無い文字 (CJK の範囲のみ判定)"""
+        key = (path, index)
+        bits = self._coverage.get(key)
+        if bits is None:
+            face = next((f for f in self.files.get(path, {}).get("faces", []) if f["index"] == index), None)
+            if face is None: return ""
+            bits = self._coverage[key] = base64.b64decode(face["coverage"])
+        missing = []
+        for ch in set(text):
+            cp = ord(ch); offset = 0
+            for lo, hi in CJK_COVERAGE_RANGES:
+                if lo <= cp <= hi:
+                    o = offset + cp - lo
+                    if not (bits[o >> 3] >> (7 - (o & 7))) & 1: missing.append(ch)
+                    break
+                offset += hi - lo + 1
+        return "".join(sorted(missing))
+
+FONT_INDEX = FontIndex(FONT_INDEX_PATH)
+
+def scan_font_map(index=None):
+    """
+    システムフォントに、ローカルのfontsフォルダのフォントを加えた 名前 -> (パス, .ttc 内の番号) の対応。
+    index (FontIndex) を渡すと、変わっていないファイルは開かずに索引の情報を使い、.ttc の2番目以降のフォントも並べる。
+    """
+    font_map = SYSTEM_FONTS.copy()
+    seen = set()
+    if index is not None:
+        for path, _ in SYSTEM_FONTS.values():
+            if os.path.exists(path) and path not in seen: seen.add(path); index.faces(path)
+    if os.path.exists(FONTS_DIR):
+        for entry in sorted(os.scandir(FONTS_DIR), key=lambda e: e.name):
+            if os.path.splitext(entry.name)[1].lower() not in FONT_EXTENSIONS: continue
+            seen.add(entry.path)
+            faces = (index.faces(entry.path) if index is not None else None) or [{"index": 0}]
+            for face in faces:
+                i = face["index"]
+                # 先頭のフォントはこれまでどおりファイル名で呼ぶ (保存済みのプロジェクトとの互換)
+                font_map[entry.name if i == 0 else f"{entry.name} #{i} {face.get('name', '')}".rstrip()] = (entry.path, i)
+    if index is not None: index.prune(seen)
+    return font_map
+
+def make_typeface(font_key, font_map):
+    """font_key のフォントを開く。見つからなければ名前で探し、最後はメイリオ・既定のフォントにする"""
+    path, face_index = font_map.get(font_key, (None, 0))
+    typeface = None
+    if path and os.path.exists(path):
+        try: typeface = skia.Typeface.MakeFromFile(path, face_index)
+        except: pass
+    
+    if not typeface:
+        try: typeface = skia.Typeface.MakeFromName(font_key, skia.FontStyle.Normal())
+        except: pass
+        
+    if not typeface:
+        try: typeface = skia.Typeface.MakeFromName("Meiryo", skia.FontStyle.Normal())
+        except: pass
+        if not typeface: typeface = skia.Typeface.MakeDefault()
+    return typeface
+
+# =========================================================
+#  描画キャッシュ
+# =========================================================
+
+class RenderCache:
+    """
+    描画済みビットマップ (skia.Image) のLRUキャッシュ。
+    保持しているピクセル数からメモリ使用量を見積もり、上限を超えたら古いものから捨てる。
+    """
+    MISSING = object()  # get() でキーが見つからなかったことを表す印
+    _NONE = object()    # 描画結果が None だったことを表す印
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+
+    @staticmethod
+    def _nbytes(img):
+        if img is None: return 0
+        return img.width() * img.height() * 4
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def get(self, key, default=None):
+        """キャッシュから取り出す。なければ default を返す"""
+        entry = self._items.get(key, self.MISSING)
+        if entry is self.MISSING:
+            self.misses += 1
+            return default
+        self._items.move_to_end(key)
+        self.hits += 1
+        return None if entry is self._NONE else entry
+
+    def put(self, key, img):
+        self.discard(key)
+        nbytes = self._nbytes(img)
+        if nbytes > self.max_bytes: return
+        self._items[key] = self._NONE if img is None else img
+        self.current_bytes += nbytes
+        while self.current_bytes > self.max_bytes and self._items:
+            _, old = self._items.popitem(last=False)
+            if old is not self._NONE: self.current_bytes -= self._nbytes(old)
+
+    def discard(self, key):
+        old = self._items.pop(key, None)
+        if old is not None and old is not self._NONE:
+            self.current_bytes -= self._nbytes(old)
+
+    def discard_where(self, predicate):
+        """predicate(key) が真になるエントリをまとめて破棄"""
+        for key in [k for k in self._items if predicate(k)]:
+            self.discard(key)
+
+    def clear(self):
+        self._items.clear()
+        self.current_bytes = 0
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._items), "bytes": self.current_bytes, "max_bytes": self.max_bytes,
+            "hits": self.hits, "misses": self.misses, "hit_rate": (self.hits / total) if total else 0.0
+        }
+
+class HitGrid:
+    """
+    アイテムの範囲 (画像座標) をマス目に登録しておく当たり判定の索引。
+    点を含みうるアイテムを全部を調べずに取り出せ、範囲が変わったアイテムだけを登録し直せる。
+    """
+
+    def __init__(self, cell=HIT_GRID_CELL):
+        self.cell = cell
+        self._cells = {}   # (列, 行) -> キーの集合
+        self._bounds = {}  # キー -> (x0, y0, x1, y1)
+
+    def __len__(self):
+        return len(self._bounds)
+
+    def __contains__(self, key):
+        return key in self._bounds
+
+    def _cell_keys(self, b):
+        c = self.cell
+        return [(cx, cy) for cx in range(int(b[0] // c), int(b[2] // c) + 1) for cy in range(int(b[1] // c), int(b[3] // c) + 1)]
+
+    def update(self, key, bounds):
+        if self._bounds.get(key) == bounds: return
+        self.remove(key)
+        self._bounds[key] = bounds
+        for ck in self._cell_keys(bounds): self._cells.setdefault(ck, set()).add(key)
+
+    def remove(self, key):
+        b = self._bounds.pop(key, None)
+        if b is None: return
+        for ck in self._cell_keys(b):
+            keys = self._cells.get(ck)
+            if keys is None: continue
+            keys.discard(key)
+            if not keys: del self._cells[ck]
+
+    def query(self, x, y):
+        """(x, y) を範囲に含むキー"""
+        keys = self._cells.get((int(x // self.cell), int(y // self.cell)), ())
+        return [k for k in keys if self._bounds[k][0] <= x < self._bounds[k][2] and self._bounds[k][1] <= y < self._bounds[k][3]]
+
+    def keys(self):
+        return list(self._bounds)
+
+    def clear(self):
+        self._cells.clear(); self._bounds.clear()
+
+# =========================================================
+#  テキストレイアウト (グリフ列の構築)
+# =========================================================
+
+class TextLayout:
+    """
+    レイアウト済みテキスト。blob はレイアウト原点 (0, 0) 基準で配置済み。
+    bounds はグリフの輪郭から求めた塗りの範囲 (縁取りは含まない)。インクが無ければ None
+    """
+    __slots__ = ("blob", "bounds", "glyph_count")
+
+    def __init__(self, blob, bounds, glyph_count):
+        self.blob = blob
+        self.bounds = bounds
+        self.glyph_count = glyph_count
+
+
+class TextLayoutEngine:
+    """
+    テキストオブジェクトを位置決め済みのグリフIDの並び (skia.TextBlob) に変換する。
+    フォントのメトリクスとグリフ送り幅は (Typeface, サイズ) ごとにキャッシュするので、
+    描画時は縁取りと塗りの2回 drawTextBlob するだけで済む。
+    """
+
+    def __init__(self):
+        self._fonts = {}  # (typeface ID, size) -> [skia.Font, 縦中心オフセット, {glyph: 送り幅}, {glyph: 輪郭の矩形}]
+
+    def clear(self):
+        self._fonts.clear()
+
+    def _font_entry(self, typeface, size):
+        key = (typeface.uniqueID(), size)
+        entry = self._fonts.get(key)
+        if entry is None:
+            font = skia.Font(typeface, size)
+            metrics = font.getMetrics()
+            entry = [font, (metrics.fAscent + metrics.fDescent) / 2, {}, {}]
+            self._fonts[key] = entry
+        return entry
+
+    @staticmethod
+    def _advances(entry, glyphs):
+        """グリフの送り幅。未計測のグリフだけまとめて getWidths する"""
+        cache = entry[2]
+        missing = list({g for g in glyphs if g not in cache})
+        if missing:
+            for g, w in zip(missing, entry[0].getWidths(missing)): cache[g] = w
+        return [cache[g] for g in glyphs]
+
+    @staticmethod
+    def _glyph_bounds(entry, glyphs):
+        """グリフ原点基準の輪郭矩形 (l, t, r, b)。空白など輪郭の無いグリフは None"""
+        cache = entry[3]
+        missing = list({g for g in glyphs if g not in cache})
+        if missing:
+            for g, r in zip(missing, entry[0].getBounds(missing)):
+                cache[g] = None if r.isEmpty() else (r.left(), r.top(), r.right(), r.bottom())
+        return [cache[g] for g in glyphs]
+
+    def layout(self, obj, typeface):
+        text = obj['text']
+        size = obj['size']
+        outline_width = obj.get('outline_width', 0)
+        vertical = obj['vertical']
+        ls_px = size * (obj.get('line_spacing', 20) / 100.0)
+        cs_px = size * (obj.get('char_spacing', 0) / 100.0)
+
+        entry = self._font_entry(typeface, size)
+        font, v_center = entry[0], entry[1]
+
+        if vertical:
+            text = text.replace("...", "…").replace("。。。", "…")
+        lines = text.split('\n')
+
+        glyphs = []; positions = []       # 通常の配置
+        rot_glyphs = []; xforms = []      # 90度回転して配置 (縦書きの長音・三点リーダ等)
+        ink = []                          # 配置後の各グリフの輪郭矩形
+
+        if vertical:
+            content_w = len(lines) * (size + ls_px)
+            small_dx = size * 0.12
+            cursor_x = content_w - (size / 2)
+            for line in lines:
+                rules = [VERTICAL_CHAR_RULES.get(ch, (ch, False, False)) for ch in line]
+                line_glyphs = font.textToGlyphs("".join(r[0] for r in rules)) if line else []
+                advances = self._advances(entry, line_glyphs)
+                g_bounds = self._glyph_bounds(entry, line_glyphs)
+                cursor_y = size / 2
+                for (d_char, need_rotate, is_small), g, char_w, gb in zip(rules, line_glyphs, advances, g_bounds):
+                    draw_x = -(char_w / 2)
+                    draw_y = -v_center
+                    if is_small:
+                        draw_x += small_dx
+                        draw_y -= small_dx
+                    if need_rotate:
+                        # (cursor_x, cursor_y) を中心に90度回転してから (draw_x, draw_y) に置くのと同じ変換
+                        tx = cursor_x - draw_y; ty = cursor_y + draw_x
+                        rot_glyphs.append(g)
+                        xforms.append(skia.RSXform(0, 1, tx, ty))
+                        if gb: ink.append((tx - gb[3], ty + gb[0], tx - gb[1], ty + gb[2]))
+                    else:
+                        px = cursor_x + draw_x; py = cursor_y + draw_y
+                        glyphs.append(g)
+                        positions.append(skia.Point(px, py))
+                        if gb: ink.append((px + gb[0], py + gb[1], px + gb[2], py + gb[3]))
+                    cursor_y += size + cs_px
+                cursor_x -= (size + ls_px)
+        else:
+            cursor_y = size / 2
+            for line in lines:
+                line_glyphs = font.textToGlyphs(line) if line else []
+                advances = self._advances(entry, line_glyphs)
+                g_bounds = self._glyph_bounds(entry, line_glyphs)
+                cursor_x = size / 2
+                for g, char_w, gb in zip(line_glyphs, advances, g_bounds):
+                    px = cursor_x - (char_w / 2); py = cursor_y - v_center
+                    glyphs.append(g)
+                    positions.append(skia.Point(px, py))
+                    if gb: ink.append((px + gb[0], py + gb[1], px + gb[2], py + gb[3]))
+                    cursor_x += char_w + cs_px + (outline_width / 2)
+                cursor_y += size + ls_px
+
+        blob = None
+        if glyphs or rot_glyphs:
+            builder = skia.TextBlobBuilder()
+            if glyphs: builder.allocRunPos(font, glyphs, positions)
+            if rot_glyphs: builder.allocRunRSXform(font, rot_glyphs, xforms)
+            blob = builder.make()
+        bounds = None
+        if ink:
+            bounds = skia.Rect.MakeLTRB(min(r[0] for r in ink), min(r[1] for r in ink), max(r[2] for r in ink), max(r[3] for r in ink))
+        return TextLayout(blob, bounds, len(glyphs) + len(rot_glyphs))
+
+# =========================================================
+#  編集履歴 (元に戻す / やり直し)
+# =========================================================
+
+def _approx_nbytes(value):
+    """履歴の容量見積もり用のおおよそのバイト数"""
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(_approx_nbytes(k) + _approx_nbytes(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(_approx_nbytes(v) for v in value)
+    return sys.getsizeof(value)
+
+def _item_list(app, kind):
+    return app.text_objects if kind == 'text' else app.placed_images
+
+class EditCommand(ABC):
+    """
+    元に戻す/やり直しの1手。ページ全体の写しではなく、変わった部分だけを持つ。
+    apply() でやり直し、revert() で元に戻す。どちらも操作の直後の状態から呼ばれる前提。
+    """
+    merge_window = None  # None なら区切られるまで何度でもまとめる
+    touches_strokes = False
+
+    def __init__(self):
+        self.time = time.monotonic()
+
+    @abstractmethod
+    def apply(self, app):
+        """やり直す (操作をもう一度行う)"""
+
+    @abstractmethod
+    def revert(self, app):
+        """元に戻す"""
+
+    @abstractmethod
+    def to_record(self, app, forward=True):
+        """ジャーナルに書く操作 (dict)。forward=False なら元に戻したときの操作"""
+
+    def merge(self, other):
+        """other を自分にまとめられれば取り込んで True を返す"""
+        return False
+
+    @property
+    def nbytes(self):
+        return sys.getsizeof(self)
+
+class AddItemCommand(EditCommand):
+    """テキスト/画像の配置"""
+    def __init__(self, kind, index, obj):
+        super().__init__(); self.kind = kind; self.index = index; self.obj = obj
+
+    def apply(self, app): _item_list(app, self.kind).insert(self.index, self.obj)
+    def revert(self, app): del _item_list(app, self.kind)[self.index]
+
+    def to_record(self, app, forward=True):
+        if forward: return {"op": "add", "kind": self.kind, "index": self.index, "obj": self.obj}
+        return {"op": "delete", "kind": self.kind, "index": self.index}
+
+    @property
+    def nbytes(self): return sys.getsizeof(self) + _approx_nbytes(self.obj)
+
+class DeleteItemCommand(AddItemCommand):
+    """テキスト/画像の削除"""
+    def apply(self, app): AddItemCommand.revert(self, app)
+    def revert(self, app): AddItemCommand.apply(self, app)
+    def to_record(self, app, forward=True): return AddItemCommand.to_record(self, app, not forward)
+
+class MoveItemCommand(EditCommand):
+    """ドラッグでの移動。1回のドラッグ中の移動は1手にまとめる"""
+    def __init__(self, kind, index, old_pos, new_pos):
+        super().__init__(); self.kind = kind; self.index = index; self.old_pos = old_pos; self.new_pos = new_pos
+
+    def _set(self, app, pos):
+        obj = _item_list(app, self.kind)[self.index]; obj['x'], obj['y'] = pos
+
+    def apply(self, app): self._set(app, self.new_pos)
+    def revert(self, app): self._set(app, self.old_pos)
+
+    def to_record(self, app, forward=True):
+        return {"op": "move", "kind": self.kind, "index": self.index, "pos": list(self.new_pos if forward else self.old_pos)}
+
+    def merge(self, other):
+        if type(other) is not MoveItemCommand or (other.kind, other.index) != (self.kind, self.index): return False
+        self.new_pos = other.new_pos; self.time = other.time
+        return True
+
+class PropertyCommand(EditCommand):
+    """テキスト/画像の属性変更。同じ項目をスライダーで続けて動かした分は1手にまとめる"""
+    merge_window = HISTORY_MERGE_WINDOW
+    ABSENT = object()  # 変更前にその項目が無かったことを表す印
+
+    def __init__(self, kind, index, before, after):
+        super().__init__(); self.kind = kind; self.index = index; self.before = before; self.after = after
+
+    def apply(self, app): _item_list(app, self.kind)[self.index].update(self.after)
+    def revert(self, app):
+        obj = _item_list(app, self.kind)[self.index]
+        for k, v in self.before.items():
+            if v is self.ABSENT: obj.pop(k, None)
+            else: obj[k] = v
+
+    def to_record(self, app, forward=True):
+        values = self.after if forward else self.before
+        return {"op": "props", "kind": self.kind, "index": self.index,
+                "set": {k: v for k, v in values.items() if v is not self.ABSENT},
+                "unset": [k for k, v in values.items() if v is self.ABSENT]}
+
+    def merge(self, other):
+        if type(other) is not PropertyCommand or (other.kind, other.index) != (self.kind, self.index): return False
+        if not other.after.keys() <= self.after.keys(): return False
+        self.after = {**self.after, **other.after}; self.time = other.time
+        return True
+
+    @classmethod
+    def diff(cls, kind, index, obj, values):
+        """obj に values を当てたときの変更を表すコマンドを返す。変更が無ければ None"""
+        changed = {k: v for k, v in values.items() if obj.get(k, cls.ABSENT) != v}
+        if not changed: return None
+        return cls(kind, index, {k: obj.get(k, cls.ABSENT) for k in changed}, changed)
+
+    @property
+    def nbytes(self): return sys.getsizeof(self) + _approx_nbytes(self.before) + _approx_nbytes(self.after)
+
+class StrokeCommand(EditCommand):
+    """
+    消しゴムの1ストローク。点は StrokeStore の末尾に追加されるので、範囲 [start, end) だけを覚える。
+    元に戻したときだけ、やり直し用にその範囲の点を写し取って持つ。
+    """
+    touches_strokes = True
+
+    def __init__(self, start, end):
+        super().__init__(); self.start = start; self.end = end; self.removed = None
+
+    def apply(self, app):
+        if self.removed is not None: app.strokes.extend(self.removed); self.removed = None
+
+    def revert(self, app):
+        self.removed = app.strokes.slice(self.start, self.end); app.strokes.truncate(self.start)
+
+    def to_record(self, app, forward=True):
+        if not forward: return {"op": "truncate", "count": self.start}
+        data = app.strokes.slice(self.start, self.end).to_bytes()
+        return {"op": "strokes", "start": self.start, "data": base64.b64encode(data).decode("ascii")}
+
+    @property
+    def nbytes(self): return sys.getsizeof(self) + (self.removed.nbytes if self.removed is not None else 0)
+
+class EditHistory:
+    """
+    コマンド方式の編集履歴。手数ではなく、各コマンドが持つデータ量の合計 (max_bytes) で古いものから捨てる。
+    record() は操作を済ませた後に呼ぶ。直前のコマンドが区切られていなければ、まとめられるものはまとめる。
+    listener(cmd, forward) があれば、操作・元に戻す・やり直しのたびに呼ぶ (自動保存ジャーナル用)。
+    まとめた操作 (ドラッグ中の移動など) は、まとめ終わったとき (区切り・次の手・元に戻す) に1回だけ呼ぶ。
+    """
+
+    def __init__(self, max_bytes=HISTORY_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.undo_stack = []
+        self.redo_stack = []
+        self._sealed = True
+        self._merged = None   # まとめた後、まだ listener に知らせていないコマンド
+        self.listener = None
+
+    def __bool__(self):
+        return bool(self.undo_stack)
+
+    def clear(self):
+        self.undo_stack.clear(); self.redo_stack.clear(); self._sealed = True; self._merged = None
+
+    def seal(self):
+        """次の操作を直前の手とまとめないようにする (ドラッグ終了・選択の切り替えなど)"""
+        self._sealed = True; self._flush()
+
+    def _flush(self):
+        cmd = self._merged; self._merged = None
+        if cmd is not None and self.listener: self.listener(cmd, True)
+
+    def record(self, cmd):
+        self.redo_stack.clear()
+        top = self.undo_stack[-1] if self.undo_stack else None
+        if top is not None and not self._sealed:
+            win = top.merge_window
+            if (win is None or cmd.time - top.time <= win) and top.merge(cmd):
+                self._merged = top
+                return
+        self._flush()
+        self.undo_stack.append(cmd); self._sealed = False
+        if self.listener: self.listener(cmd, True)
+        self._trim()
+
+    @property
+    def nbytes(self):
+        return sum(c.nbytes for c in self.undo_stack) + sum(c.nbytes for c in self.redo_stack)
+
+    def _trim(self):
+        total = self.nbytes
+        while total > self.max_bytes and len(self.undo_stack) > 1:
+            total -= self.undo_stack.pop(0).nbytes
+        # 戻しきった状態で溢れる分は、いちばん先のやり直しから捨てる
+        while total > self.max_bytes and len(self.redo_stack) > 1:
+            total -= self.redo_stack.pop(0).nbytes
+
+    def undo(self, app):
+        """1手戻して、戻したコマンドを返す (無ければ None)"""
+        if not self.undo_stack: return None
+        self._flush()
+        cmd = self.undo_stack.pop(); cmd.revert(app); self.redo_stack.append(cmd); self._sealed = True
+        if self.listener: self.listener(cmd, False)
+        self._trim()
+        return cmd
+
+    def redo(self, app):
+        if not self.redo_stack: return None
+        self._flush()
+        cmd = self.redo_stack.pop(); cmd.apply(app); self.undo_stack.append(cmd); self._sealed = True
+        if self.listener: self.listener(cmd, True)
+        return cmd
+
+# =========================================================
+#  プロジェクトファイル
+# =========================================================
+
+def encode_png(img):
+    # 600dpi のページでも待たされないよう、圧縮率より速さを優先する
+    b = io.BytesIO(); img.save(b, format="PNG", compress_level=1); return b.getvalue()
+
+def make_asset_thumbnail(img):
+    tw = ASSET_THUMB_SIZE; th = min(int(tw * img.height / img.width), ASSET_THUMB_SIZE)
+    return img.resize((tw, th), RESAMPLE_LANCZOS)
+
+def load_asset_thumbnail(entry):
+    """素材のサムネイル。THUMB_CACHE_DIR に無ければ作って置いておく (原寸のデコード結果は素材に残さない)"""
+    path = os.path.join(THUMB_CACHE_DIR, entry.digest + ".png")
+    try:
+        with Image.open(path) as img: return img.convert("RGBA")
+    except (OSError, ValueError): pass
+    thumb = make_asset_thumbnail(entry.decode_reduced((ASSET_THUMB_SIZE, ASSET_THUMB_SIZE)))
+    try:
+        os.makedirs(THUMB_CACHE_DIR, exist_ok=True)
+        data = encode_png(thumb); atomic_write_file(path, lambda f: f.write(data))
+    except OSError: traceback.print_exc()
+    return thumb
+
+def _read_zip_member(path, name):
+    with zipfile.ZipFile(path) as zf: return zf.read(name)
+
+class ImagePyramid:
+    """
+    画像を 1/2 ずつ縮小していった画像の列。プレビュー用の縮小は、表示サイズ以上で一番小さい段から行う。
+    原寸の画像自体は持たない。
+    """
+
+    def __init__(self, img, min_size=PYRAMID_MIN_SIZE):
+        self.size = img.size
+        self.levels = []  # 1/2, 1/4, ... の PIL 画像
+        level = img
+        while min(level.size) // 2 >= min_size:
+            level = level.reduce(2); self.levels.append(level)
+
+    @property
+    def nbytes(self):
+        return sum(l.width * l.height * 4 for l in self.levels)
+
+    def source_for(self, size):
+        """size に縮小するときの元にする段。どの段も小さすぎるときは None (原寸から縮小する)"""
+        best = None
+        for level in self.levels:
+            if level.width < size[0] or level.height < size[1]: break
+            best = level
+        return best
+
+class LazyImage:
+    """
+    必要になるまでデコードしない画像。プロジェクトから読んだ素材は、初めて使われたときに zip から読んでデコードする。
+    読み直せるもの (loader があるもの) はデコード結果を unload() で捨てられる。保存するときは元のデータをそのまま使う。
+    """
+
+    def __init__(self, digest, size, loader=None, image=None, encoded=None):
+        self._digest = digest
+        self.size = tuple(size)
+        self._loader = loader   # エンコード済みデータ (PNG など) を返す関数
+        self._image = image
+        self._encoded = encoded
+        self.pyramid = None     # 背景だけが作る縮小画像の列 (ImagePyramid)
+
+    # 内容ハッシュ (digest) はどれもエンコード済みデータのバイト列の sha256。素材ライブラリのファイル名にもなる
+    @classmethod
+    def from_bytes(cls, data, image=None):
+        """エンコード済みのデータ (旧形式のプロジェクトに埋め込まれていたものなど) から作る"""
+        if image is None:
+            with Image.open(io.BytesIO(data)) as img: size = img.size
+        else: size = image.size
+        return cls(hashlib.sha256(data).hexdigest(), size, loader=lambda: data, image=image)
+
+    @classmethod
+    def from_file(cls, path):
+        """画像ファイルを必要になるまで読まない LazyImage。内容ハッシュはファイルのバイト列から求める"""
+        with Image.open(path) as img: size = img.size
+        def load():
+            with open(path, "rb") as f: return f.read()
+        return cls(None, size, loader=load)
+
+    @property
+    def digest(self):
+        if self._digest is None: self._digest = hashlib.sha256(self._raw()).hexdigest()
+        return self._digest
+
+    @property
+    def width(self): return self.size[0]
+
+    @property
+    def height(self): return self.size[1]
+
+    @property
+    def loaded(self):
+        return self._image is not None
+
+    @property
+    def nbytes(self):
+        """デコード済みの画素 (と縮小画像の列) が使っているメモリ"""
+        n = self.size[0] * self.size[1] * 4 if self._image is not None else 0
+        return n + (self.pyramid.nbytes if self.pyramid is not None else 0)
+
+    def _raw(self):
+        return self._encoded if self._encoded is not None else self._loader()
+
+    @property
+    def image(self):
+        img = self._image  # 別スレッドの unload() と競合しても None を返さないよう、一度だけ読む
+        if img is None:
+            img = Image.open(io.BytesIO(self._raw())).convert("RGBA")
+            if KEEP_FULL_RES_BACKGROUND or self.pyramid is None or self._loader is None: self._image = img
+        return img
+
+    def decode_reduced(self, size):
+        """size 程度に縮めて使う画像。デコード結果は持たず、JPEG は縮小しながらデコードする"""
+        img = self._image
+        if img is not None: return img
+        src = Image.open(io.BytesIO(self._raw())); src.draft("RGB", size)
+        return src.convert("RGBA")
+
+    def build_pyramid(self):
+        """縮小画像の列を作る。省メモリ設定なら、読み直せる原寸の画像はここで手放す"""
+        if self.pyramid is None: self.pyramid = ImagePyramid(self.image)
+        if not KEEP_FULL_RES_BACKGROUND and self._loader is not None: self._image = None
+        return self.pyramid
+
+    def resized(self, size):
+        """size に縮小した画像。縮小画像の列があれば、原寸ではなく一番近い段から縮小する"""
+        src = self.pyramid.source_for(size) if self.pyramid is not None else None
+        return (src if src is not None else self.image).resize(size, RESAMPLE_BILINEAR)
+
+    def encoded(self):
+        """PNG データ。loader から読めるものは覚えておかず、保存のたびに読み直す"""
+        if self._encoded is not None: return self._encoded
+        if self._loader is None:
+            self._encoded = encode_png(self._image); return self._encoded
+        data = self._loader()
+        if not data.startswith(PNG_SIGNATURE):
+            data = encode_png(self._image if self._image is not None else Image.open(io.BytesIO(data)).convert("RGBA"))
+        return data
+
+    def source_bytes(self):
+        """元のエンコード済みデータ (読み込んだファイルのまま。デコードした画像しかなければ PNG にする)"""
+        if self._encoded is not None or self._loader is not None: return self._raw()
+        return self.encoded()
+
+    def unload(self):
+        """デコード結果を捨てる。読み直せない画像 (loader の無いもの) は捨てずに False を返す"""
+        if self._loader is None: return False
+        self._image = None; self._encoded = None; self.pyramid = None
+        return True
+
+_UMASK = os.umask(0); os.umask(_UMASK)  # 新しく作るファイルのパーミッション用 (umask は読むにも書き換えが要るので起動時に1回だけ)
+
+def _file_mode(path):
+    """置き換えたファイルに付けるパーミッション。既にあればそのファイルと同じ、無ければ通常どおり umask に従う"""
+    try: return os.stat(path).st_mode & 0o7777
+    except OSError: return 0o666 & ~_UMASK
+
+def atomic_write_file(path, write, check=None):
+    """
+    path と同じフォルダの一時ファイルに write(f) で書き込み、書き終えてから置き換える。
+    途中で失敗・中止しても元のファイルは壊れない。check は置き換える直前に呼ばれ、例外で中止できる
+    """
+    fd, tmp = tempfile.mkstemp(prefix=".~", suffix=".tmp", dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        with os.fdopen(fd, "wb") as f:
+            write(f); f.flush(); os.fsync(f.fileno())
+        if check: check()
+        os.chmod(tmp, _file_mode(path))  # mkstemp の一時ファイルは所有者だけが読める 0600 なので
+        os.replace(tmp, path)
+    except BaseException:
+        try: os.remove(tmp)
+        except OSError: pass
+        raise
+
+class AssetLibrary:
+    """
+    プロジェクトをまたいで共有する素材置き場。内容ハッシュの名前で、元のファイルのバイト列を再エンコードせずに置く。
+    同じ素材は1つしか置かず、セッションの間は1つの LazyImage を共有するので、何ページ・何プロジェクトで使ってもデコードは1回で済む。
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._entries = {}  # 内容ハッシュ -> LazyImage
+        self._lock = threading.Lock()
+
+    def path(self, digest):
+        return os.path.join(self.directory, digest[:2], digest)
+
+    def __contains__(self, digest):
+        return digest in self._entries or os.path.exists(self.path(digest))
+
+    def entry(self, digest, size=None):
+        """ライブラリにある素材の LazyImage (無ければ None)"""
+        with self._lock:
+            e = self._entries.get(digest)
+            if e is not None: return e
+            path = self.path(digest)
+            if not os.path.exists(path): return None
+            if size is None:
+                with Image.open(path) as img: size = img.size
+            def load():
+                with open(path, "rb") as f: return f.read()
+            e = self._entries[digest] = LazyImage(digest, size, loader=load)
+            return e
+
+    def add(self, entry):
+        """
+        素材を元のデータのままライブラリに入れる (プロジェクトを保存するときに、そのプロジェクトが使う素材だけを入れる)。
+        戻り値は (置いた名前 = データのバイト列の sha256, 新しく置いたか)。
+        古いプロジェクトの素材は画素から求めたハッシュを持っていることがあるので、その場合はデータから求め直す
+        """
+        if os.path.exists(self.path(entry.digest)): return entry.digest, False
+        data = entry.source_bytes()
+        digest = hashlib.sha256(data).hexdigest()
+        created = self._store(digest, lambda: data)
+        if digest == entry.digest:
+            with self._lock: self._entries.setdefault(digest, entry)
+        return digest, created
+
+    def discard(self, digest):
+        """add() で置いたものを取り消す (保存の失敗・中止用)"""
+        with self._lock: self._entries.pop(digest, None)
+        try: os.remove(self.path(digest))
+        except OSError: pass
+
+    def _store(self, digest, data):
+        path = self.path(digest)
+        if os.path.exists(path): return False
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        blob = data(); atomic_write_file(path, lambda f: f.write(blob))
+        return True
+
+ASSET_LIBRARY = AssetLibrary(LIBRARY_DIR)
+
+def write_project_archive(path, manifest, blobs, strokes_data, task=None, library=()):
+    """
+    プロジェクトを zip で書き出す。画像 (blobs: 名前 -> PNG データ、またはそれを返す関数) は
+    圧縮済みなので無圧縮で格納する。task (BackgroundTask) があれば進捗を伝え、中止に応じる。
+    library ((LazyImage, manifest の参照) の並び) の素材は共有ライブラリに入れ、参照のハッシュを置いた名前に合わせる。
+    失敗・中止したときは、このとき新しく置いた素材を取り消す。
+    """
+    added = []
+    def write(f):
+        for i, (entry, info) in enumerate(library):
+            if task: task.check(); task.progress(i / len(library), "素材をライブラリに入れています...")
+            info["hash"], created = ASSET_LIBRARY.add(entry)
+            if created: added.append(info["hash"])
+        with zipfile.ZipFile(f, "w") as zf:
+            zf.writestr(PROJECT_MANIFEST, json.dumps(manifest, ensure_ascii=False), compress_type=zipfile.ZIP_DEFLATED)
+            zf.writestr(PROJECT_STROKES, strokes_data, compress_type=zipfile.ZIP_DEFLATED)
+            for i, (name, data) in enumerate(blobs.items()):
+                if task: task.check(); task.progress(i / len(blobs), "画像を書き込み中...")
+                zf.writestr(name, data() if callable(data) else data, compress_type=zipfile.ZIP_STORED)
+    try: atomic_write_file(path, write, task.check if task else None)
+    except BaseException:
+        for digest in added: ASSET_LIBRARY.discard(digest)
+        raise
+
+def read_project_archive(path, task=None, decode_background=True):
+    """
+    zip 形式のプロジェクトを読む。素材はまだデコードせず LazyImage で返す (サムネイルと、decode_background なら背景はデコード済み)。
+    戻り値: (manifest, 背景, 素材のリスト, サムネイル {ハッシュ: PIL}, StrokeStore)
+    素材ライブラリに無くなっていた素材は None にし、ハッシュを manifest["missing_assets"] に入れる
+    """
+    with zipfile.ZipFile(path) as zf:
+        manifest = json.loads(zf.read(PROJECT_MANIFEST).decode("utf-8"))
+        if manifest.get("format") != PROJECT_FORMAT: raise ValueError("ZMM形式ではありません")
+        if manifest.get("format_version", 0) > PROJECT_FORMAT_VERSION: raise ValueError("新しいバージョンで保存されたファイルです")
+        names = set(zf.namelist())
+        entries = {}; missing = []
+
+        def entry(info):
+            if info is None: return None
+            e = entries.get(info["hash"])
+            if e is None:
+                # ライブラリにある素材は、他のプロジェクトと同じ LazyImage を使う
+                e = ASSET_LIBRARY.entry(info["hash"], info["size"])
+                if e is not None: entries[info["hash"]] = e; return e
+                name = info.get("blob")
+                if name is None and info.get("library"):
+                    if info["hash"] not in missing: missing.append(info["hash"])
+                    return None
+                if name not in names: raise ValueError(f"画像がありません ({info['hash'][:12]})")
+                e = LazyImage(info["hash"], info["size"], loader=lambda n=name: _read_zip_member(path, n))
+                entries[info["hash"]] = e
+            return e
+
+        background = entry(manifest.get("background"))
+        if background is not None and decode_background:
+            if task: task.progress(0.0, "背景を読み込み中...")
+            background._encoded = zf.read(manifest["background"]["blob"]); background.image
+        assets = [entry(a) for a in manifest.get("assets", [])]
+        thumbs = {}
+        for i, a in enumerate(manifest.get("assets", [])):
+            if task: task.check(); task.progress(0.5 + 0.5 * i / len(assets), "素材を読み込み中...")
+            if a and a.get("thumb") in names and a["hash"] not in thumbs:
+                thumbs[a["hash"]] = Image.open(io.BytesIO(zf.read(a["thumb"]))).convert("RGBA")
+        strokes = StrokeStore.from_bytes(zf.read(PROJECT_STROKES)) if PROJECT_STROKES in names else StrokeStore()
+    if missing: manifest["missing_assets"] = missing
+    return manifest, background, assets, thumbs, strokes
+
+def missing_assets_message(hashes):
+    return f"素材ライブラリに無い画像が {len(hashes)} 個ありました。その画像は表示されません ({', '.join(h[:12] for h in hashes)})"
+
+def base64_to_entry(s):
+    """旧形式の base64 の画像を、埋め込まれていたデータのまま LazyImage にする (読めなければ None)"""
+    if not s: return None
+    try: return LazyImage.from_bytes(base64.b64decode(s))
+    except: return None
+
+def read_project_file(path, task=None, thumbnails=True, decode_background=True):
+    """
+    プロジェクトファイルを読む。zip 形式でなければ旧形式 (画像を base64 で埋め込んだ JSON) として読む。
+    UI には触らないので、ワーカースレッドや別プロセスから呼んでよい。戻り値は read_project_archive() と同じ
+    """
+    if zipfile.is_zipfile(path):
+        return read_project_archive(path, task, decode_background)
+    with open(path, 'r', encoding='utf-8') as f: d = json.load(f)
+    if task: task.progress(0.0, "背景を読み込み中...")
+    background = base64_to_entry(d.get("background_image"))
+    if background is not None and decode_background: background.image
+    assets = []; thumbs = {}
+    b64s = d.get("asset_images", [])
+    for i, b64 in enumerate(b64s):
+        if task: task.check(); task.progress(0.3 + 0.7 * i / len(b64s), "素材を読み込み中...")
+        entry = base64_to_entry(b64)
+        img = entry.image if entry is not None and thumbnails else None
+        if thumbnails and entry is not None and entry.digest not in thumbs: thumbs[entry.digest] = make_asset_thumbnail(img)
+        assets.append(entry)
+    if d.get("strokes_bin"): strokes = StrokeStore.from_bytes(base64.b64decode(d["strokes_bin"]))
+    else: strokes = StrokeStore.from_legacy(d.get("strokes", []), d.get("stroke_runs"))
+    return d, background, assets, thumbs, strokes
+
+# =========================================================
+#  自動保存ジャーナル
+# =========================================================
+
+class EditJournal:
+    """
+    編集操作の追記専用ジャーナル (自動保存とクラッシュからの復元用)。directory に次のものを置く。
+      journal.jsonl        操作を1行ずつ追記する。1行目はどのスナップショットに続くかを表すヘッダー
+      snapshot.json        最後に圧縮した時点のページ (プロジェクトの manifest と同じ形)
+      strokes-<世代>.bin   そのスナップショットの消しゴムデータ
+      blobs/<ハッシュ>     画像 (読み込んだファイルのままのデータ)。内容で名前を付けるので、一度書いた画像は書き直さない
+    1回の自動保存のコストは操作の大きさに比例し、異常終了しても失うのは最後の操作だけになる。
+    """
+    JOURNAL = "journal.jsonl"
+    SNAPSHOT = "snapshot.json"
+
+    def __init__(self, directory, compact_every=JOURNAL_COMPACT_OPS):
+        self.directory = directory
+        self.compact_every = compact_every
+        self.ops = 0
+        self.generation = 0
+        self._file = None
+        self._entries = {}      # 内容ハッシュ -> LazyImage (同じ画像を共有する)
+
+    def _path(self, *names):
+        return os.path.join(self.directory, *names)
+
+    @property
+    def active(self):
+        return self._file is not None
+
+    def has_data(self):
+        """前回のセッションの内容が残っているか"""
+        return os.path.exists(self._path(self.SNAPSHOT))
+
+    def blob_ref(self, entry, thumb=False):
+        """
+        画像を blobs/ に書き (既にあれば何もしない)、manifest 用の参照を返す (引数は _blob_collector() の blob_info と同じ)。
+        素材 (thumb) のうち素材ライブラリにあるものは内容ハッシュだけで参照する。背景はいつも blobs/ に書く
+        """
+        if thumb and SHARE_ASSET_LIBRARY and entry.digest in ASSET_LIBRARY: return {"hash": entry.digest, "size": list(entry.size), "library": True}
+        name = f"blobs/{entry.digest}"
+        path = self._path(name)
+        if not os.path.exists(path):
+            # UI スレッドで呼ばれるので、大きな JPEG の背景などを PNG にエンコードし直さず、元のデータをそのまま書く
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            data = entry.source_bytes(); atomic_write_file(path, lambda f: f.write(data))
+        return {"hash": entry.digest, "blob": name, "size": list(entry.size)}
+
+    def image_entry(self, info):
+        """blob_ref() の参照から、blobs/ を必要なときに読む LazyImage を作る (素材ライブラリに無くなっていたら None)"""
+        if info is None: return None
+        entry = self._entries.get(info["hash"])
+        if entry is None and info.get("library"): return ASSET_LIBRARY.entry(info["hash"], info["size"])
+        if entry is None:
+            path = self._path(info["blob"])
+            def load():
+                with open(path, "rb") as f: return f.read()
+            entry = self._entries[info["hash"]] = LazyImage(info["hash"], info["size"], loader=load)
+        return entry
+
+    def append(self, record):
+        if self._file is None: return
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n"); self._file.flush()
+        self.ops += 1
+
+    def needs_compaction(self):
+        return self.active and self.ops >= self.compact_every
+
+    def compact(self, manifest, strokes_data):
+        """
+        今のページをスナップショットに書き、ジャーナルを空にして書き始める。
+        スナップショットには世代番号を付け、古い世代のジャーナルが残っていても復元時に使わない。
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        self.close()
+        gen = self.generation + 1
+        strokes_name = f"strokes-{gen}.bin"
+        atomic_write_file(self._path(strokes_name), lambda f: f.write(strokes_data))
+        manifest = dict(manifest, generation=gen, strokes=strokes_name)
+        atomic_write_file(self._path(self.SNAPSHOT), lambda f: f.write(json.dumps(manifest, ensure_ascii=False).encode("utf-8")))
+        self.generation = gen
+        self._file = open(self._path(self.JOURNAL), "w", encoding="utf-8")
+        self._file.write(json.dumps({"op": "begin", "generation": gen, "time": time.time()}) + "\n"); self._file.flush()
+        self.ops = 0
+        # スナップショットから参照されなくなったデータを消す
+        # ライブラリの素材は blobs/ に無い
+        used = {a["blob"] for a in [manifest.get("background")] + manifest.get("assets", []) if a and a.get("blob")}
+        for path in glob.glob(self._path("blobs", "*")):
+            if "blobs/" + os.path.basename(path) not in used: os.remove(path)
+        for path in glob.glob(self._path("strokes-*.bin")):
+            if os.path.basename(path) != strokes_name: os.remove(path)
+
+    def load(self):
+        """
+        残っている内容を読む。戻り値: (manifest, 背景, 素材のリスト, StrokeStore, 操作のリスト)
+        画像はまだデコードせず LazyImage で返す
+        """
+        with open(self._path(self.SNAPSHOT), encoding="utf-8") as f: manifest = json.load(f)
+        background = self.image_entry(manifest.get("background"))
+        assets = [self.image_entry(a) for a in manifest.get("assets", [])]
+        missing = [a["hash"] for a, e in zip(manifest.get("assets", []), assets) if a and e is None]
+        if missing: manifest["missing_assets"] = missing
+        with open(self._path(manifest["strokes"]), "rb") as f: strokes = StrokeStore.from_bytes(f.read())
+        records = []
+        if os.path.exists(self._path(self.JOURNAL)):
+            with open(self._path(self.JOURNAL), encoding="utf-8") as f:
+                for line in f:
+                    try: rec = json.loads(line)
+                    except ValueError: break  # 書きかけの最後の行
+                    if rec.get("op") == "begin":
+                        # スナップショットより前の世代のジャーナルは使わない
+                        if rec.get("generation") != manifest.get("generation"): break
+                        continue
+                    records.append(rec)
+        self.generation = manifest.get("generation", 0)
+        return manifest, background, assets, strokes, records
+
+    def close(self):
+        if self._file is not None:
+            self._file.close(); self._file = None
+
+    def discard(self):
+        """ジャーナルとスナップショットを消す (正常終了時・復元しなかったとき)"""
+        self.close(); self.ops = 0
+        if os.path.isdir(self.directory): shutil.rmtree(self.directory, ignore_errors=True)
+
+# =========================================================
+#  バックグラウンド処理
+# =========================================================
+
+class TaskCancelled(Exception):
+    """バックグラウンド処理が中止された"""
+
+class BackgroundTask:
+    """
+    重い処理 (保存・読込・書き出し) を別スレッドで動かし、進捗ダイアログを出す。
+    work(task) はワーカースレッドで動き、task.progress() で進捗を伝え、task.check() で中止に応じる。
+    進捗と結果はキューに積み、メインスレッドが root.after で拾って反映する (Tk はメインスレッドからしか触らない)。
+    on_done(result) / on_error(exc) / on_cancel(None) はメインスレッドで呼ばれる。
+    """
+    POLL_MS = 50
+
+    def __init__(self, root, title, work, on_done, on_error=None, on_cancel=None):
+        self.root = root
+        self.work = work
+        self.on_done = on_done
+        self.on_error = on_error
+        self.on_cancel = on_cancel
+        self.cancel_event = threading.Event()
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+        self.dialog = tk.Toplevel(root); self.dialog.title(title); self.dialog.transient(root); self.dialog.resizable(False, False)
+        self.dialog.protocol("WM_DELETE_WINDOW", self.cancel)
+        self.lbl_message = tk.Label(self.dialog, text=title, anchor="w"); self.lbl_message.pack(fill=tk.X, padx=15, pady=(15, 5))
+        self.progressbar = ttk.Progressbar(self.dialog, length=320, maximum=1.0, mode="determinate"); self.progressbar.pack(padx=15, pady=5)
+        self.btn_cancel = tk.Button(self.dialog, text="中止", width=10, command=self.cancel); self.btn_cancel.pack(pady=(5, 15))
+        # 処理中にページを書き換えられないよう、ダイアログ以外の操作を止める
+        self.dialog.grab_set()
+
+    def start(self):
+        self._thread.start()
+        self.root.after(self.POLL_MS, self._poll)
+        return self
+
+    # --- ワーカースレッド側 ---
+    def progress(self, fraction, message=None):
+        self._queue.put(("progress", (fraction, message)))
+
+    def check(self):
+        if self.cancel_event.is_set(): raise TaskCancelled()
+
+    def _run(self):
+        try:
+            self._queue.put(("done", self.work(self)))
+        except TaskCancelled:
+            self._queue.put(("cancelled", None))
+        except Exception as e:
+            traceback.print_exc()
+            self._queue.put(("error", e))
+
+    # --- メインスレッド側 ---
+    def cancel(self):
+        self.cancel_event.set()
+        self.lbl_message.config(text="中止しています..."); self.btn_cancel.config(state=tk.DISABLED)
+
+    def _poll(self):
+        try:
+            while True:
+                kind, value = self._queue.get_nowait()
+                if kind == "progress":
+                    fraction, message = value
+                    self.progressbar["value"] = max(0.0, min(1.0, fraction))
+                    if message and not self.cancel_event.is_set(): self.lbl_message.config(text=message)
+                    continue
+                self.dialog.grab_release(); self.dialog.destroy()
+                if kind == "done": self.on_done(value)
+                elif kind == "error":
+                    if self.on_error: self.on_error(value)
+                    else: messagebox.showerror("エラー", f"{value}")
+                elif self.on_cancel: self.on_cancel(None)
+                return
+        except queue.Empty:
+            pass
+        self.root.after(self.POLL_MS, self._poll)
+
+class ThumbnailWorker:
+    """
+    素材のサムネイルを別スレッドで用意する (load_asset_thumbnail)。
+    できたものは (内容ハッシュ, PIL) で done に入れるので、メインスレッドで一覧に反映する。
+    """
+
+    def __init__(self):
+        self._jobs = queue.Queue()
+        self._thread = None
+        self._pending = set()
+        self.done = queue.Queue()
+
+    @property
+    def busy(self):
+        return self._jobs.unfinished_tasks > 0
+
+    def request(self, entry):
+        if entry.digest in self._pending: return
+        self._pending.add(entry.digest); self._jobs.put(entry)
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True); self._thread.start()
+
+    def _run(self):
+        while True:
+            entry = self._jobs.get()
+            try: self.done.put((entry.digest, load_asset_thumbnail(entry)))
+            except Exception: traceback.print_exc()
+            finally:
+                self._pending.discard(entry.digest); self._jobs.task_done()
+
+# =========================================================
+#  チャプター (複数ページ)
+# =========================================================
+
+class PageDocument:
+    """
+    チャプターの1ページ。テキスト・配置画像・消しゴム・履歴はページごとに常に持っておき、
+    重いもの (背景のデコード結果・消しゴムレイヤー・表示用の縮小背景) だけを PageCache の都合で捨てて作り直す。
+    旧形式のプロジェクトから読んだ背景は読み直せないので捨てない。
+    """
+
+    def __init__(self, background=None, source_path=None, project_path=None):
+        self.background = background     # 背景の LazyImage
+        self.source_path = source_path   # 元の画像 / プロジェクトファイル
+        self.project_path = project_path # 保存先 (.zmm)
+        self.text_objects = []
+        self.placed_images = []
+        self.strokes = StrokeStore()
+        self.history = EditHistory(HISTORY_MAX_BYTES)
+        self.stroke_layer = None
+        self.preview = None              # 表示サイズに縮小した背景 (消しゴムなし)
+        self.dirty = False
+        self.lock = threading.Lock()     # 先読みスレッドとの排他
+
+    @property
+    def title(self):
+        return os.path.basename(self.project_path or self.source_path or "")
+
+    @property
+    def nbytes(self):
+        n = self.background.nbytes if self.background is not None else 0
+        if self.stroke_layer is not None: n += self.stroke_layer.nbytes
+        if self.preview is not None: n += self.preview.width() * self.preview.height() * 4
+        return n
+
+    def preview_size(self, canvas_size):
+        """canvas_size に収めたときの表示サイズ (ZunComiApp.update_canvas_image と同じ計算)"""
+        iw, ih = self.background.size; cw, ch = canvas_size
+        sc = min(cw / iw, ch / ih)
+        return int(iw * sc), int(ih * sc)
+
+    def decode(self, canvas_size=None, pyramid=True):
+        """
+        背景をデコードしておく。どのスレッドから呼んでもよい。
+        pyramid なら背景の縮小画像の列も作る (すぐに表示したいときは後で別スレッドに作らせる)。
+        canvas_size を渡すと、消しゴムレイヤーとその大きさに収めた表示用の縮小背景も作る
+        """
+        with self.lock:
+            bg = self.background
+            if bg is None: return
+            if pyramid: bg.build_pyramid()
+            elif bg.pyramid is None: bg.image
+            if canvas_size is None: return
+            if self.strokes and self.stroke_layer is None:
+                layer = StrokeLayer(*bg.size); layer.replay(self.strokes); self.stroke_layer = layer
+            if min(canvas_size) < 10: return
+            size = self.preview_size(canvas_size)
+            if self.preview is None or (self.preview.width(), self.preview.height()) != size:
+                self.preview = pil_to_skia(bg.resized(size))
+            if self.stroke_layer is not None: self.stroke_layer.preview_image(size)
+
+    def unload(self):
+        """デコード結果を捨てる。先読み中のページや読み直せない背景はそのままにして False を返す"""
+        if not self.lock.acquire(blocking=False): return False
+        try:
+            self.stroke_layer = None; self.preview = None
+            return self.background is None or self.background.unload()
+        finally:
+            self.lock.release()
+
+class PageCache:
+    """
+    デコード済みのページを最近使った順に持っておき、合計が max_bytes を超えたら古いものから捨てる。
+    trim() の keep (表示中のページと前後のページ) は捨てない。メインスレッドからだけ使う。
+    """
+
+    def __init__(self, max_bytes=PAGE_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._pages = OrderedDict()  # id(page) -> PageDocument
+
+    def __len__(self):
+        return len(self._pages)
+
+    def __contains__(self, page):
+        return id(page) in self._pages
+
+    @property
+    def nbytes(self):
+        return sum(p.nbytes for p in self._pages.values())
+
+    def touch(self, page):
+        self._pages.pop(id(page), None); self._pages[id(page)] = page
+
+    def trim(self, keep=()):
+        keep_ids = {id(p) for p in keep}
+        total = self.nbytes
+        for key in list(self._pages):
+            if total <= self.max_bytes: break
+            if key in keep_ids: continue
+            page = self._pages[key]
+            before = page.nbytes
+            if page.unload():
+                del self._pages[key]
+            total -= before - page.nbytes
+
+    def clear(self):
+        self._pages.clear()
+
+class PagePrefetcher:
+    """
+    前後のページを別スレッドでデコードしておく。新しい依頼が来たら、まだ始めていない古い依頼は捨てる。
+    デコードし終えたページは done に入れるので、メインスレッドで PageCache に登録し直す。
+    """
+
+    def __init__(self):
+        self._jobs = queue.Queue()
+        self._thread = None
+        self.done = queue.Queue()
+
+    @property
+    def busy(self):
+        return self._jobs.unfinished_tasks > 0
+
+    def request(self, jobs):
+        """jobs: (PageDocument, PageDocument.decode に渡す canvas_size) のリスト"""
+        while True:
+            try: self._jobs.get_nowait()
+            except queue.Empty: break
+            self._jobs.task_done()
+        for job in jobs: self._jobs.put(job)
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True); self._thread.start()
+
+    def _run(self):
+        while True:
+            page, canvas_size = self._jobs.get()
+            try: page.decode(canvas_size); self.done.put(page)
+            except Exception: traceback.print_exc()
+            finally: self._jobs.task_done()
+
+# =========================================================
+#  書き出しプロファイル
+# =========================================================
+
+def normalize_export_profiles(profiles):
+    """プロジェクトに保存されていたプロファイルを、足りない項目を補って返す (無ければ既定の組)"""
+    if not profiles: return [dict(p) for p in DEFAULT_EXPORT_PROFILES]
+    result = []
+    for p in profiles:
+        q = dict(DEFAULT_EXPORT_PROFILES[0], name="", suffix=""); q.update(p)
+        if q["format"] not in EXPORT_FORMATS: q["format"] = "PNG"
+        if q["mode"] not in EXPORT_MODES: q["mode"] = "RGBA"
+        result.append(q)
+    return result
+
+def export_profile_path(path, profile):
+    """保存先 path に対するこのプロファイルの出力ファイル名"""
+    return os.path.splitext(path)[0] + profile["suffix"] + EXPORT_FORMATS[profile["format"]]
+
+def _export_size(size, max_size):
+    w, h = size
+    if not max_size or max(w, h) <= max_size: return size
+    r = max_size / max(w, h)
+    return (max(1, round(w * r)), max(1, round(h * r)))
+
+def encode_export(img, profile, f):
+    """img をプロファイルの色と形式で f に書き込む"""
+    fmt = profile["format"]; mode = profile["mode"]
+    if mode == "RGBA" and fmt == "JPEG": mode = "RGB"  # JPEG は透明を持てない
+    if mode != "RGBA" and img.mode == "RGBA":
+        flat = Image.new("RGB", img.size, (255, 255, 255)); flat.paste(img, mask=img.getchannel("A")); img = flat
+    if img.mode != mode: img = img.convert(mode)
+    if fmt == "PNG": img.save(f, format="PNG", compress_level=int(profile["compress_level"]))
+    else: img.save(f, format=fmt, quality=int(profile["quality"]))
+
+def write_exports(final, profiles, path, threads=1, check=None):
+    """
+    原寸の合成結果 final から、有効なプロファイルの画像をすべて書き出して出力ファイル名の一覧を返す。
+    縮小は大きい順に、それまでに作った一番小さい画像から行い、エンコードは threads 本のスレッドで並べて行う
+    """
+    import concurrent.futures
+    jobs = []; source = final
+    for p in sorted((p for p in profiles if p.get("enabled")), key=lambda p: -max(_export_size(final.size, p["max_size"]))):
+        size = _export_size(final.size, p["max_size"])
+        if size != source.size: source = source.resize(size, RESAMPLE_LANCZOS, reducing_gap=3.0)
+        jobs.append((export_profile_path(path, p), source, p))
+    if len({out for out, _, _ in jobs}) != len(jobs): raise ValueError("出力ファイル名が重複するプロファイルがあります")
+    def write(job):
+        out, img, p = job
+        atomic_write_file(out, lambda f: encode_export(img, p, f), check)
+        return out
+    if threads > 1 and len(jobs) > 1:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(threads, len(jobs))) as pool: return list(pool.map(write, jobs))
+    return [write(job) for job in jobs]
+
+# =========================================================
+#  ページの描画 (GUI なしでも使う部分)
+# =========================================================
+
+class PageRenderer:
+    """
+    1ページ分のデータ (背景・素材・テキスト・配置画像・消しゴム) と、それをSkiaで合成する処理。
+    エディタ本体 (ZunComiApp) と、GUI を使わない一括書き出し (render サブコマンド) の両方で使う。
+    """
+
+    def __init__(self):
+        self.background_source = None # 背景画像の LazyImage (原寸の画像は original_image で必要なときに読む)
+        self.asset_images = []       # 素材ごとの LazyImage (削除済みは None)
+        self.missing_assets = []     # 素材ライブラリに無くなっていた素材のハッシュ (open_project で読んだもの)
+        self.text_objects = [] 
+        self.placed_images = [] 
+        self.strokes = StrokeStore() 
+        self.stroke_layer = None     # 消しゴムの跡 (画像解像度のラスタ)
+        self.cache_bg_base = None    # 縮小しただけの背景 (消しゴムなし)
+        self.export_profiles = normalize_export_profiles(None)
+
+        # 描画キャッシュ (テキストのラスタ画像)
+        self.text_render_cache = RenderCache(TEXT_CACHE_MAX_BYTES)
+        # 描画キャッシュ (配置画像の拡大縮小・回転結果)
+        self.image_render_cache = RenderCache(IMAGE_CACHE_MAX_BYTES)
+
+        # フォントキャッシュ (Skia Typeface)
+        self.skia_typeface_cache = {}
+        self.text_layout = TextLayoutEngine()
+
+    def open_project(self, path):
+        """プロジェクトファイルを読んでこのページに設定する (GUI なし)"""
+        d, background, assets, _, strokes = read_project_file(path, thumbnails=False)
+        self.background_source = background
+        self.asset_images = assets
+        self.text_objects = d.get("text_objects", []); self.placed_images = d.get("placed_images", [])
+        self.strokes = strokes; self.missing_assets = d.get("missing_assets", [])
+        self.export_profiles = normalize_export_profiles(d.get("export_profiles"))
+        self.cache_bg_base = None; self.image_render_cache.clear(); self.text_render_cache.clear()
+        self._rebuild_stroke_layer()
+
+    def render_page(self, threads=1, band_height=EXPORT_BAND_HEIGHT, task=None):
+        """
+        ページ全体を原寸で合成した PIL 画像。
+        合成は横長の帯ごとに行うので、作業用のバッファは帯1本分で済む。アイテムは掛かり始める帯の1本手前で
+        threads 本のスレッドに描かせ (Skia と PIL の縮小は GIL を手放す)、最後に掛かる帯を合成したら手放すので、
+        同時に持つのは今の帯の近くにあるアイテムだけになる。結果は compose_page でページ全体を一度に合成したものと同じ。
+        task (BackgroundTask) があれば帯ごとに進捗を伝え、中止に応じる。
+        """
+        import concurrent.futures
+        w, h = self.background_source.size
+        bg = self.original_image
+        layer = self.stroke_layer.image() if (self.stroke_layer and not self.stroke_layer.empty) else None
+        # 各アイテムが掛かる縦の範囲を、描かずに求めておく (上端の順に並べる)
+        spans = []
+        for z, (kind, idx) in enumerate(self._z_items()):
+            size = self._item_size(kind, idx)
+            if size is None: continue
+            o = _item_list(self, kind)[idx]; top = int(o['y'] - size[1] / 2)
+            if top < h and top + size[1] > 0: spans.append((top, top + size[1], z, o['x'], kind, idx))
+        spans.sort()
+
+        def rasterize(kind, idx): return self._item_bitmap(kind, idx, 1.0, cached=False)[0]
+        def run_now(fn, *args):
+            fut = concurrent.futures.Future(); fut.set_result(fn(*args)); return fut
+        pool = concurrent.futures.ThreadPoolExecutor(max_workers=threads) if threads > 1 else None
+        submit = pool.submit if pool else run_now
+        final = Image.new("RGBA", (w, h))
+        compositor = SkiaCompositor()
+        live = []  # 描き始めたアイテム (上端, 下端, 重なり順, 中心の x, Future)
+        nxt = 0
+        try:
+            # 同じ素材を使うアイテムが同時にデコードしないよう、素材を先に読んでおく
+            for fut in [submit(self._asset_image, i) for i in sorted({o['src_id'] for o in self.placed_images})]: fut.result()
+            for y0 in range(0, h, band_height):
+                if task: task.check(); task.progress(y0 / h * 0.5, "合成中...")
+                y1 = min(h, y0 + band_height)
+                # この帯と次の帯に掛かり始めるアイテムを描き始める (それより下のアイテムはまだ描かない)
+                while nxt < len(spans) and spans[nxt][0] < y1 + band_height:
+                    top, bottom, z, x, kind, idx = spans[nxt]; nxt += 1
+                    live.append((top, bottom, z, x, submit(rasterize, kind, idx)))
+                canvas = compositor.begin(w, y1 - y0)
+                canvas.save(); canvas.translate(0, -y0)
+                canvas.drawImage(pil_to_skia(bg.crop((0, y0, w, y1))), 0, y0)
+                if layer: canvas.drawImage(layer, 0, 0)
+                for top, bottom, z, x, fut in sorted((e for e in live if e[0] < y1 and e[1] > y0), key=lambda e: e[2]):
+                    img = fut.result()
+                    if img is not None: canvas.drawImage(img, int(x - img.width() / 2), top)
+                canvas.restore()  # サーフェスは使い回すので座標の移動を戻しておく
+                final.paste(compositor.to_pil(), (0, y0))
+                # この帯より下に掛からないアイテムは手放す
+                live = [e for e in live if e[1] > y1]
+        finally:
+            if pool: pool.shutdown(cancel_futures=True)
+        return final
+
+    def _item_size(self, kind, idx, sc=1.0):
+        """sc 倍で描いたときのアイテムの画像の大きさ (描かずにレイアウトだけで求める)。描くものが無ければ None"""
+        if kind == 'text':
+            o = self.text_objects[idx]
+            if not o['text']: return None
+            try: geometry = self._text_geometry(o if sc == 1.0 else self._scaled_text_obj(o, sc))
+            except Exception: return None
+            return (geometry[2].width(), geometry[2].height()) if geometry else None
+        o = self.placed_images[idx]
+        entry = self.asset_images[o['src_id']] if 0 <= o['src_id'] < len(self.asset_images) else None
+        if entry is None: return None
+        w = int(entry.width * o['scale'] * sc); h = int(entry.height * o['scale'] * sc)
+        if w <= 0 or h <= 0: return None
+        if o['angle'] == 0: return (w, h)
+        dev = _rotation(w, h, o['angle'])[1]
+        return (dev.width(), dev.height())
+
+    @property
+    def original_image(self):
+        """原寸の背景 (PIL)。使うときにデコードするので、有無や大きさは background_source で調べる"""
+        return self.background_source.image if self.background_source is not None else None
+
+    def _get_skia_typeface(self, font_key):
+        if font_key in self.skia_typeface_cache:
+            return self.skia_typeface_cache[font_key]
+        typeface = make_typeface(font_key, FONT_MAP)
+        if font_key in FONT_MAP: FONT_INDEX.touch(font_key)
+        self.skia_typeface_cache[font_key] = typeface
+        return typeface
+
+    def missing_glyphs(self):
+        """テキストのうち、指定フォントに字形が無い文字を {フォント名: 文字} で返す (索引にあるフォントのみ)"""
+        missing = {}
+        for obj in self.text_objects:
+            key = obj.get('font_key', 'メイリオ')
+            if key not in FONT_MAP: continue
+            chars = FONT_INDEX.missing_chars(*FONT_MAP[key], obj['text'])
+            if chars: missing[key] = "".join(sorted(set(missing.get(key, "")) | set(chars)))
+        return missing
+
+    def _text_geometry(self, obj):
+        """テキストのレイアウトと、描くときの座標変換・画像の範囲 (回転後、整数に丸めたもの)。描くものが無ければ None"""
+        layout = self.text_layout.layout(obj, self._get_skia_typeface(obj.get('font_key', 'メイリオ')))
+        if layout.blob is None or layout.bounds is None: return None
+        # グリフの輪郭 + 縁取り + アンチエイリアス分だけの範囲を、回転後の大きさで確保する
+        outline_width = obj.get('outline_width', 0)
+        bounds = layout.bounds.makeOutset(outline_width + 1, outline_width + 1)
+        matrix = skia.Matrix()
+        angle_deg = obj.get('angle', 0)
+        if angle_deg != 0:
+            # PIL の rotate と同じく反時計回り・中心基準で回転
+            matrix.setRotate(-angle_deg, bounds.centerX(), bounds.centerY())
+        dev = matrix.mapRect(bounds).roundOut()
+        if dev.isEmpty(): return None
+        return layout, matrix, dev
+
+    @staticmethod
+    def _draw_text_blob(canvas, obj, layout, matrix):
+        """_text_geometry() のレイアウトを、canvas の今の座標系で matrix を掛けて描く (縁取りを全文字ぶん描いてから塗りを重ねる)"""
+        outline_width = obj.get('outline_width', 0)
+        paint_fill = skia.Paint(
+            AntiAlias=True,
+            Color=skia_color(obj['color'])
+        )
+        # 回転グリフ (RSXform) を含む blob は drawTextBlob の x, y が効かないため、
+        # キャンバスごと座標変換してから原点に描く
+        canvas.save(); canvas.concat(matrix)
+        if outline_width > 0:
+            paint_stroke = skia.Paint(
+                AntiAlias=True,
+                Style=skia.Paint.kStroke_Style,
+                StrokeWidth=outline_width * 2,
+                Color=skia_color(obj.get('outline_color', '#ffffff')),
+                StrokeJoin=skia.Paint.kRound_Join,
+                StrokeCap=skia.Paint.kRound_Cap
+            )
+            canvas.drawTextBlob(layout.blob, 0, 0, paint_stroke)
+        canvas.drawTextBlob(layout.blob, 0, 0, paint_fill)
+        canvas.restore()
+
+    def _render_text_skia(self, obj):
+        try:
+            text = obj['text']
+            if not text: return None
+            
+            geometry = self._text_geometry(obj)
+            if geometry is None: return None
+            layout, matrix, dev = geometry
+
+            surface = skia.Surface(dev.width(), dev.height())
+            
+            with surface as canvas:
+                canvas.translate(-dev.left(), -dev.top())
+                self._draw_text_blob(canvas, obj, layout, matrix)
+
+            return surface.makeImageSnapshot()
+        except Exception as e:
+            traceback.print_exc()
+            return None
+
+    def _text_cache_key(self, obj, disp_scale):
+        """描画結果に影響する項目だけを並べたキャッシュキー"""
+        return (
+            obj['text'], obj.get('font_key', 'メイリオ'), obj['size'],
+            obj['color'], obj.get('outline_color', '#ffffff'), obj.get('outline_width', 0),
+            obj.get('line_spacing', 20), obj.get('char_spacing', 0),
+            obj.get('angle', 0), obj['vertical'], round(disp_scale, 6)
+        )
+
+    @staticmethod
+    def _scaled_text_obj(obj, disp_scale):
+        """表示倍率に合わせて文字サイズと縁太さを縮めたコピー"""
+        p_obj = obj.copy()
+        p_obj['size'] = int(obj['size'] * disp_scale)
+        p_obj['outline_width'] = int(obj.get('outline_width', 0) * disp_scale)
+        return p_obj
+
+    def _get_text_bitmap(self, obj, disp_scale):
+        """表示倍率に合わせたテキスト画像をキャッシュ経由で取得"""
+        p_obj = self._scaled_text_obj(obj, disp_scale)
+        key = self._text_cache_key(p_obj, disp_scale)
+        img = self.text_render_cache.get(key, RenderCache.MISSING)
+        if img is not RenderCache.MISSING: return img
+        img = self._render_text_skia(p_obj)
+        self.text_render_cache.put(key, img)
+        return img
+
+    def _render_image_item(self, obj, disp_scale=1.0):
+        """配置画像を disp_scale 倍の解像度で一度にリサイズし、Skia で回転した画像を返す"""
+        try:
+            src = self._asset_image(obj['src_id'])
+            if not src: return None
+            w = int(src.width * obj['scale'] * disp_scale); h = int(src.height * obj['scale'] * disp_scale)
+            if w<=0 or h<=0: return None
+            angle = obj['angle']
+            img = pil_to_skia(src.resize((w, h), RESAMPLE_LANCZOS))
+            if angle != 0: img = rotate_skia_image(img, angle)
+            return img
+        except Exception:
+            return None
+
+    def _image_cache_key(self, obj, disp_scale):
+        return (obj['src_id'], obj['scale'], obj['angle'], round(disp_scale, 6))
+
+    def _get_image_bitmap(self, obj, disp_scale):
+        """表示倍率に合わせた配置画像をキャッシュ経由で取得"""
+        key = self._image_cache_key(obj, disp_scale)
+        img = self.image_render_cache.get(key, RenderCache.MISSING)
+        if img is not RenderCache.MISSING: return img
+        img = self._render_image_item(obj, disp_scale)
+        self.image_render_cache.put(key, img)
+        return img
+
+    def _asset_image(self, asset_id):
+        """素材の画像 (PIL)。初めて使うときにデコードする"""
+        entry = self.asset_images[asset_id] if 0 <= asset_id < len(self.asset_images) else None
+        return entry.image if entry is not None else None
+
+    def _z_items(self):
+        """重なり順 (下から) に並べたアイテム一覧。画像の上にテキストが乗る"""
+        return [('image', i) for i in range(len(self.placed_images))] + [('text', i) for i in range(len(self.text_objects))]
+
+    def _item_bitmap(self, kind, idx, sc, cached=True):
+        """アイテムの描画済み画像 (skia.Image) と、sc 倍のページ上での左上座標を返す"""
+        if kind == 'image':
+            o = self.placed_images[idx]
+            img = self._get_image_bitmap(o, sc) if cached else self._render_image_item(o, sc)
+        else:
+            o = self.text_objects[idx]
+            if cached: img = self._get_text_bitmap(o, sc)
+            else: img = self._render_text_skia(o) if sc == 1.0 else self._render_text_skia(self._scaled_text_obj(o, sc))
+        if not img: return None, None
+        return img, (int(o['x']*sc - img.width()/2), int(o['y']*sc - img.height()/2))
+
+    def _draw_item_clipped(self, canvas, kind, idx, sc, box):
+        """
+        アイテムを画像にせず、canvas の描ける範囲 (タイル) にかかる部分だけを sc 倍で直接描く。box は _item_extent() の範囲。
+        拡大表示の大きなアイテムは画像がキャッシュに収まらず、タイルごとに丸ごと描き直すことになるため
+        """
+        canvas.save(); canvas.translate(box[0], box[1])
+        try:
+            if kind == 'text':
+                o = self._scaled_text_obj(self.text_objects[idx], sc)
+                layout, matrix, dev = self._text_geometry(o)
+                canvas.translate(-dev.left(), -dev.top())
+                self._draw_text_blob(canvas, o, layout, matrix)
+            else:
+                # _render_image_item と同じ大きさ・回転で、元画像から直接描く
+                o = self.placed_images[idx]
+                src = self._asset_skia_image(o['src_id'])
+                w = int(src.width() * o['scale'] * sc); h = int(src.height() * o['scale'] * sc)
+                if o['angle'] != 0:
+                    matrix, dev = _rotation(w, h, o['angle'])
+                    canvas.translate(-dev.left(), -dev.top()); canvas.concat(matrix)
+                if w >= src.width(): sampling = skia.SamplingOptions(skia.CubicResampler.Mitchell())
+                else: sampling = skia.SamplingOptions(skia.FilterMode.kLinear, skia.MipmapMode.kLinear)
+                canvas.drawImageRect(src, skia.Rect.MakeWH(w, h), sampling)
+        except Exception:
+            traceback.print_exc()
+        finally:
+            canvas.restore()
+
+    def _asset_skia_image(self, asset_id):
+        """素材の原寸の Skia 画像 (配置画像のキャッシュに asset_id ごとに1枚置く)"""
+        key = (asset_id, 'source')
+        img = self.image_render_cache.get(key)
+        if img is None:
+            img = pil_to_skia(self._asset_image(asset_id))
+            self.image_render_cache.put(key, img)
+        return img
+
+    def _draw_items(self, canvas, items, sc, cached=True):
+        """items を重なり順に canvas へ描く"""
+        for kind, idx in items:
+            img, pos = self._item_bitmap(kind, idx, sc, cached)
+            if img is None: continue
+            canvas.drawImage(img, pos[0], pos[1])
+
+    def _rebuild_stroke_layer(self):
+        """strokes を入れ替えたとき (読込・元に戻す等) に消しゴムレイヤーを作り直す"""
+        if not self.strokes or self.background_source is None:
+            self.stroke_layer = None; return
+        iw, ih = self.background_source.size
+        if self.stroke_layer is None or (self.stroke_layer.width, self.stroke_layer.height) != (iw, ih):
+            self.stroke_layer = StrokeLayer(iw, ih)
+        self.stroke_layer.replay(self.strokes)
+
+    def _draw_background(self, canvas, sc, size):
+        """背景画像 (size に縮小) と消しゴムの跡を描く"""
+        layer = self.stroke_layer if (self.stroke_layer and not self.stroke_layer.empty) else None
+        if size == self.background_source.size:
+            canvas.drawImage(pil_to_skia(self.original_image), 0, 0)
+            if layer: canvas.drawImage(layer.image(), 0, 0)
+        else:
+            if self.cache_bg_base is None or (self.cache_bg_base.width(), self.cache_bg_base.height()) != size:
+                self.cache_bg_base = pil_to_skia(self.background_source.resized(size))
+            canvas.drawImage(self.cache_bg_base, 0, 0)
+            if layer: canvas.drawImage(layer.preview_image(size), 0, 0)
+
+    def compose_page(self, compositor, sc, size, clear_color=COLOR_TRANSPARENT):
+        """
+        ページ全体を sc 倍で compositor に合成する。プレビューの背景キャッシュ作りと書き出しで共用。
+        """
+        canvas = compositor.begin(size[0], size[1], clear_color)
+        self._draw_background(canvas, sc, size)
+        self._draw_items(canvas, self._z_items(), sc, cached=(sc != 1.0))
+        return canvas
+
 # =========================================================
 #  メインアプリケーションクラス
 # =========================================================
 
-class ZunComiApp:
+class ZunComiApp(PageRenderer):
     def __init__(self, root):
+        super().__init__()
         self.root = root
         self.root.title(f"{APP_NAME} v{APP_VERSION}")
         self.root.geometry("1400x950")
         
-        # --- フォント初期化 ---
-        self._init_fonts_dir()
-
         # --- データ管理 ---
-        self.original_image = None
         self.display_image = None
         self.img_scale = 1.0
         self.offset_x = 0
         self.offset_y = 0
+
+        # 表示範囲。zoom は画面に収める倍率 (fit_scale) に対する倍率、view_center は画面中央に来る画像座標 (None ならページ中央)
+        self.fit_scale = 1.0
+        self.zoom = 1.0
+        self.view_center = None
+        self.view_origin = (0, 0)     # 表示中の画像 (見えている範囲) の左上のキャンバス座標
+        self.tile_cache = RenderCache(TILE_CACHE_MAX_BYTES)
+        self.tile_signatures = {}     # タイルのキー -> 描いたときの中身 (アイテムのキャッシュキーと位置)
+        self._bg_level = None         # (背景, 縮小後の大きさ, タイルの背景を切り出す元画像)。同じ表示倍率の間は使い回す
+        self._space_held = False
+        self._pan_start = None        # スペース+ドラッグで動かし始めたときの (マウス位置, 表示位置)
         
         self.cache_bg_image = None
         self.cache_canvas_size = (0, 0)
-        self.hit_targets = [] 
+        # 当たり判定。アイテム (id) -> 画像座標の範囲の索引と、登録したときのキャッシュキー
+        self.hit_index = HitGrid()
+        self._hit_items = {}    # id(アイテム) -> (種類, アイテム, 登録したときの内容)
+        self._alpha_masks = OrderedDict()  # id(skia.Image) -> (画像, 不透明度の配列)
+        self.hover_item = None
+        self.frozen_layers = None
+        self.compositor = SkiaCompositor()
+
+        # 再描画スケジューラ
+        self._render_job = None
+        self._last_render_time = 0.0
+        self._last_canvas_size = (0, 0)
+        self.render_stats = {'requested': 0, 'performed': 0, 'reasons': {}}
         
         # ツール状態
         self.brush_active = False
@@ -125,32 +2360,73 @@ class ZunComiApp:
         self.text_outline_color = "#ffffff"
         self.dropper_active = False
         
-        # オブジェクトデータ
-        self.strokes = [] 
-        self.text_objects = [] 
-        self.placed_images = [] 
+        # 描画中の消しゴム
+        self._live_stroke_pos = None # 描画中の線のキャンバス上の直前位置
+        self._stroke_start = None    # 描画中の線の最初の点の番号 (履歴用)
         
         # アセット管理
-        self.asset_images = [] 
-        self.asset_thumbnails = [] 
-        self.asset_frames = []
+        self.asset_rows = []          # 一覧に並べる素材番号 (削除した素材は除く)
+        self.asset_row_widgets = {}   # 素材番号 -> (行の Frame, 画像ボタン, asset_canvas の window)。見えている行の分だけ
+        self.asset_photos = {}        # 内容ハッシュ -> 見えている行のサムネイル (PhotoImage)
+        self.asset_thumb_sources = {} # 内容ハッシュ -> サムネイル (PIL)。保存用
+        self.thumb_worker = ThumbnailWorker()
+        self._thumb_job = None
         
         # 選択・操作状態
         self.selected_item = None 
         self.placing_text_content = None 
         self.placing_image_id = None 
         self.drag_data = {"x": 0, "y": 0, "item": None}
+        self.drag_lift = None  # ドラッグ中に持ち上げたキャンバスアイテム
         
-        # フォントキャッシュ (Skia Typeface)
-        self.skia_typeface_cache = {}
+        # --- フォント初期化 ---
+        # fonts フォルダの走査は画面を出した後に別スレッドで行い、終わったら一覧に追加する
+        self.font_names = list(FONT_MAP.keys())
 
         # 履歴管理
-        self.history_stack = []
-        self.redo_stack = []
-        self.max_history = 20
+        self.history = EditHistory(HISTORY_MAX_BYTES)
+        self.active_task = None # 実行中の BackgroundTask (保存・読込・書き出し)
+        self.journal = EditJournal(AUTOSAVE_DIR) # 自動保存 (操作ごとの追記)
+        self.history.listener = self._on_edit
+
+        # チャプター (複数ページ)。表示中のページの内容は self.text_objects などに展開して編集する
+        self.pages = []
+        self.page_index = 0
+        self.page_cache = PageCache(PAGE_CACHE_MAX_BYTES)
+        self.prefetcher = PagePrefetcher()
+        self._prefetch_job = None
 
         self._setup_ui()
         self._bind_shortcuts()
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+        self.root.after_idle(self._on_first_paint)
+
+    def _on_first_paint(self):
+        STARTUP_PROFILE.mark("first paint")
+        self._start_font_scan()
+        self.root.after(200, self._offer_recovery)
+
+    def _start_font_scan(self):
+        """fontsフォルダの確認・作成と走査を別スレッドで行う"""
+        result = {}
+        def work():
+            t = time.perf_counter()
+            self._init_fonts_dir()
+            if not FONT_INDEX.loaded: FONT_INDEX.load()
+            font_map = scan_font_map(FONT_INDEX)
+            FONT_INDEX.save()
+            # 最近使ったフォントは先に開いておく
+            result['preload'] = {k: make_typeface(k, font_map) for k in FONT_INDEX.recent if k in font_map}
+            result['map'] = font_map
+            STARTUP_PROFILE.record("font scan (background)", time.perf_counter() - t)
+        thread = threading.Thread(target=work, daemon=True); thread.start()
+        def poll():
+            if thread.is_alive(): self.root.after(50, poll); return
+            if 'map' in result:
+                self._apply_font_map(result['map'])
+                for k, tf in result['preload'].items(): self.skia_typeface_cache.setdefault(k, tf)
+            STARTUP_PROFILE.mark("font list ready"); STARTUP_PROFILE.report()
+        self.root.after(50, poll)
 
     def _init_fonts_dir(self):
         """fontsフォルダを確認し、なければ作成"""
@@ -160,24 +2436,24 @@ class ZunComiApp:
             except Exception as e:
                 # エラー時も動作は継続する
                 print(f"Font dir creation failed: {e}")
-        self.refresh_font_list()
 
     def refresh_font_list(self):
         """ローカルのfontsフォルダを再スキャンしてリストを更新"""
+        self._apply_font_map(scan_font_map(FONT_INDEX)); FONT_INDEX.save()
+
+    def _apply_font_map(self, new_map):
         global FONT_MAP
-        FONT_MAP = SYSTEM_FONTS.copy()
-        
-        if os.path.exists(FONTS_DIR):
-            exts = ['*.ttf', '*.ttc', '*.otf', '*.TTF', '*.TTC', '*.OTF'] 
-            files = []
-            for ext in exts:
-                files.extend(glob.glob(os.path.join(FONTS_DIR, ext)))
-            
-            for f in files:
-                filename = os.path.basename(f)
-                FONT_MAP[filename] = f
+        # フォントの割り当てが変わったら、古いTypefaceと描画済みテキストを破棄
+        if new_map != FONT_MAP:
+            self.skia_typeface_cache.clear()
+            self.text_layout.clear()
+            self.text_render_cache.clear()
+            self.invalidate_tiles()
+            if self.background_source is not None: self.request_render("fonts")
+        FONT_MAP = new_map
         
         self.font_names = list(FONT_MAP.keys())
+        self.combo_font['values'] = self.font_names
 
     def open_fonts_folder(self):
         """OSのエクスプローラーでフォントフォルダを開く"""
@@ -191,6 +2467,10 @@ class ZunComiApp:
     def _bind_shortcuts(self):
         self.root.bind("<Control-z>", self.undo)
         self.root.bind("<Control-y>", self.redo)
+        self.root.bind("<Prior>", self.prev_page)
+        self.root.bind("<Next>", self.next_page)
+        self.root.bind("<KeyPress-space>", self.on_space_press)
+        self.root.bind("<KeyRelease-space>", self.on_space_release)
 
     # --- UI Helper ---
     def create_smart_slider(self, parent, label_text, from_, to, initial_val, callback):
@@ -253,7 +2533,15 @@ class ZunComiApp:
         tk.Button(btn_proj_frame, text="プロジェクト保存", command=self.save_project, bg="#ffdddd").pack(side=tk.RIGHT, fill=tk.X, expand=True, padx=(2, 0))
         btn_file_frame = tk.Frame(sidebar, bg="#f0f0f0"); btn_file_frame.pack(fill=tk.X, pady=2)
         tk.Button(btn_file_frame, text="画像を開く (新規)", command=self.load_image, bg="#add8e6").pack(side=tk.LEFT, fill=tk.X, expand=True, padx=(0, 2))
-        tk.Button(btn_file_frame, text="画像書出 (PNG)", command=self.save_image, bg="#90ee90").pack(side=tk.RIGHT, fill=tk.X, expand=True, padx=(2, 0))
+        tk.Button(btn_file_frame, text="⚙", width=2, command=self.edit_export_profiles, bg="#90ee90").pack(side=tk.RIGHT, padx=(2, 0))
+        tk.Button(btn_file_frame, text="画像書出", command=self.save_image, bg="#90ee90").pack(side=tk.RIGHT, fill=tk.X, expand=True, padx=(2, 0))
+        btn_chapter_frame = tk.Frame(sidebar, bg="#f0f0f0"); btn_chapter_frame.pack(fill=tk.X, pady=2)
+        tk.Button(btn_chapter_frame, text="チャプターを開く", command=self.open_chapter, bg="#add8e6").pack(side=tk.LEFT, fill=tk.X, expand=True, padx=(0, 2))
+        tk.Button(btn_chapter_frame, text="全ページ保存", command=self.save_chapter, bg="#ffdddd").pack(side=tk.RIGHT, fill=tk.X, expand=True, padx=(2, 0))
+        page_nav = tk.Frame(sidebar, bg="#f0f0f0"); page_nav.pack(fill=tk.X, pady=2)
+        tk.Button(page_nav, text="◀", width=3, command=self.prev_page, bg="white").pack(side=tk.LEFT)
+        tk.Button(page_nav, text="▶", width=3, command=self.next_page, bg="white").pack(side=tk.RIGHT)
+        self.lbl_page = tk.Label(page_nav, text="- / -", bg="#f0f0f0", anchor="center"); self.lbl_page.pack(side=tk.LEFT, fill=tk.X, expand=True)
         undo_frame = tk.Frame(sidebar, bg="#f0f0f0"); undo_frame.pack(fill=tk.X, pady=2)
         tk.Button(undo_frame, text="↶ 戻す (Ctrl+Z)", command=lambda: self.undo(None), bg="white").pack(side=tk.LEFT, fill=tk.X, expand=True)
         tk.Button(undo_frame, text="↷ 進む (Ctrl+Y)", command=lambda: self.redo(None), bg="white").pack(side=tk.RIGHT, fill=tk.X, expand=True)
@@ -328,272 +2616,359 @@ class ZunComiApp:
         tk.Button(right_header, text="＋ 画像を追加", command=self.add_asset_image, bg="white").pack(fill=tk.X, pady=5)
         self.asset_canvas = tk.Canvas(right_container, bg="#e0e0e0", highlightthickness=0)
         right_scrollbar = tk.Scrollbar(right_container, orient="vertical", command=self.asset_canvas.yview)
-        self.scrollable_frame = tk.Frame(self.asset_canvas, bg="#e0e0e0")
-        self.scrollable_frame.bind("<Configure>", lambda e: self.asset_canvas.configure(scrollregion=self.asset_canvas.bbox("all")))
-        self.asset_canvas.create_window((0, 0), window=self.scrollable_frame, anchor="nw", width=200)
-        self.asset_canvas.configure(yscrollcommand=right_scrollbar.set)
+        # スクロールや大きさの変更で見える範囲が変わるたびに、見えている行の部品だけを作り直す
+        def on_asset_scroll(first, last):
+            right_scrollbar.set(first, last); self._refresh_asset_rows()
+        self.asset_canvas.configure(yscrollcommand=on_asset_scroll, yscrollincrement=ASSET_ROW_HEIGHT // 4, scrollregion=(0, 0, 200, 0))
         self.asset_canvas.pack(side="left", fill="both", expand=True); right_scrollbar.pack(side="right", fill="y")
         self.setup_mouse_scroll(self.asset_canvas)
 
         self.canvas.bind("<Button-1>", self.on_canvas_click)
         self.canvas.bind("<B1-Motion>", self.on_canvas_drag)
         self.canvas.bind("<ButtonRelease-1>", self.on_canvas_release)
-        self.root.bind("<Configure>", self.on_resize_window)
+        self.canvas.bind("<Configure>", self.on_resize_window)
+        self.canvas.bind("<Motion>", self.on_canvas_motion)
+        self.canvas.bind("<MouseWheel>", self.on_canvas_wheel)
+        self.canvas.bind("<Button-4>", self.on_canvas_wheel)
+        self.canvas.bind("<Button-5>", self.on_canvas_wheel)
 
     # ---------------------------------------------------------
     # ロジック: Skiaフォント・描画
     # ---------------------------------------------------------
-    def _get_skia_typeface(self, font_key):
-        if font_key in self.skia_typeface_cache:
-            return self.skia_typeface_cache[font_key]
-        
-        path = FONT_MAP.get(font_key)
-        typeface = None
-        if path and os.path.exists(path):
-            try: typeface = skia.Typeface.MakeFromFile(path)
-            except: pass
-        
-        if not typeface:
-            try: typeface = skia.Typeface.MakeFromName(font_key, skia.FontStyle.Normal())
-            except: pass
-            
-        if not typeface:
-            try: typeface = skia.Typeface.MakeFromName("Meiryo", skia.FontStyle.Normal())
-            except: pass
-            if not typeface: typeface = skia.Typeface.MakeDefault()
-
-        self.skia_typeface_cache[font_key] = typeface
-        return typeface
-
-    def _render_text_skia(self, obj):
-        try:
-            text = obj['text']
-            if not text: return None
-            
-            size = obj['size']
-            color = obj['color']
-            outline_color = obj.get('outline_color', '#ffffff')
-            outline_width = obj.get('outline_width', 0)
-            
-            vertical = obj['vertical']
-            line_spacing_ratio = obj.get('line_spacing', 20) / 100.0
-            char_spacing_ratio = obj.get('char_spacing', 0) / 100.0
-            
-            angle_deg = obj.get('angle', 0)
-            
-            font_key = obj.get('font_key', 'メイリオ')
-            typeface = self._get_skia_typeface(font_key)
-            
-            paint_fill = skia.Paint(
-                AntiAlias=True,
-                Color=int(color.replace("#", "0xFF"), 16)
-            )
-            
-            paint_stroke = None
-            if outline_width > 0:
-                paint_stroke = skia.Paint(
-                    AntiAlias=True,
-                    Style=skia.Paint.kStroke_Style,
-                    StrokeWidth=outline_width * 2,
-                    Color=int(outline_color.replace("#", "0xFF"), 16),
-                    StrokeJoin=skia.Paint.kRound_Join,
-                    StrokeCap=skia.Paint.kRound_Cap
-                )
-            
-            font = skia.Font(typeface, size)
-            
-            if vertical:
-                text = text.replace("...", "…").replace("。。。", "…")
-            lines = text.split('\n')
-            
-            ls_px = size * line_spacing_ratio
-            cs_px = size * char_spacing_ratio
-            
-            max_len = max([len(l) for l in lines]) if lines else 0
-            padding = size * 2 + outline_width * 2
-            
-            content_w = len(lines) * (size + ls_px)
-            content_h = max_len * (size + cs_px)
-            
-            est_width = int(content_w + padding * 2)
-            est_height = int(content_h + padding * 2)
-            
-            if not vertical:
-                content_w_h = max_len * (size + cs_px)
-                content_h_h = len(lines) * (size + ls_px)
-                est_width = int(content_w_h + padding * 2)
-                est_height = int(content_h_h + padding * 2)
-            
-            surface = skia.Surface(est_width, est_height)
-            
-            with surface as canvas:
-                if vertical:
-                    # 縦書き
-                    cursor_x = est_width - padding - (size / 2)
-                    for line in lines:
-                        cursor_y = padding + (size / 2)
-                        for char in line:
-                            d_char = VERTICAL_CHAR_MAP.get(char, char)
-                            need_rotate = (char in ROTATE_CHARS)
-                            if need_rotate: d_char = char
-                            
-                            is_small = (char in SMALL_KANA)
-                            
-                            char_w = font.measureText(d_char)
-                            metrics = font.getMetrics()
-                            vertical_center_offset = (metrics.fAscent + metrics.fDescent) / 2
-                            
-                            canvas.save()
-                            canvas.translate(cursor_x, cursor_y)
-                            
-                            draw_x = -(char_w / 2)
-                            draw_y = -vertical_center_offset
-                            
-                            if is_small:
-                                draw_x += size * 0.12 
-                                draw_y -= size * 0.12 
-
-                            if need_rotate:
-                                canvas.rotate(90)
-                                if not is_small:
-                                    draw_x = -(char_w / 2)
-                                    draw_y = -vertical_center_offset
-
-                            if paint_stroke:
-                                canvas.drawString(d_char, draw_x, draw_y, font, paint_stroke)
-                            canvas.drawString(d_char, draw_x, draw_y, font, paint_fill)
-                            
-                            canvas.restore()
-                            cursor_y += size + cs_px
-                        cursor_x -= (size + ls_px)
-                else:
-                    # 横書き
-                    cursor_y = padding + (size / 2)
-                    for line in lines:
-                        cursor_x = padding + (size / 2)
-                        for char in line:
-                            char_w = font.measureText(char)
-                            metrics = font.getMetrics()
-                            vertical_center_offset = (metrics.fAscent + metrics.fDescent) / 2
-                            
-                            canvas.save()
-                            canvas.translate(cursor_x, cursor_y)
-                            draw_x = -(char_w / 2)
-                            draw_y = -vertical_center_offset
-                            
-                            if paint_stroke:
-                                canvas.drawString(char, draw_x, draw_y, font, paint_stroke)
-                            canvas.drawString(char, draw_x, draw_y, font, paint_fill)
-                            canvas.restore()
-                            cursor_x += char_w + cs_px + (outline_width/2)
-                        cursor_y += size + ls_px
-
-            # PIL変換
-            image = surface.makeImageSnapshot()
-            if image:
-                w, h = image.width(), image.height()
-                data = image.tobytes()
-                try:
-                    pil_img = Image.frombytes("RGBA", (w, h), data, "raw", "BGRA")
-                except:
-                    pil_img = Image.frombytes("RGBA", (w, h), data)
-
-                bbox = pil_img.getbbox()
-                if bbox:
-                    pil_img = pil_img.crop(bbox)
-                    if angle_deg != 0:
-                        pil_img = pil_img.rotate(angle_deg, expand=True, resample=Image.BICUBIC)
-                    return pil_img
-            return None
-        except Exception as e:
-            traceback.print_exc()
-            return None
-
-    def _render_image_item(self, obj):
-        try:
-            src = self.asset_images[obj['src_id']]
-            if not src: return None
-            w = int(src.width * obj['scale']); h = int(src.height * obj['scale'])
-            if w<=0 or h<=0: return None
-            angle = obj['angle']
-            img = src.resize((w, h), RESAMPLE_LANCZOS)
-            if angle != 0: img = img.rotate(angle, expand=True, resample=RESAMPLE_BICUBIC)
-            return img
-        except Exception:
-            return None
-
     # ---------------------------------------------------------
     # UI更新
     # ---------------------------------------------------------
+    def request_render(self, reason="update"):
+        """
+        再描画を予約する。すぐには描かず、アイドル時 (または前回の描画から
+        RENDER_FRAME_BUDGET 経過後) に1回だけ update_canvas_image を実行する。
+        """
+        st = self.render_stats
+        st['requested'] += 1
+        st['reasons'][reason] = st['reasons'].get(reason, 0) + 1
+        if self._render_job is not None: return
+        wait = self._last_render_time + RENDER_FRAME_BUDGET - time.perf_counter()
+        if wait > 0: self._render_job = self.root.after(int(wait * 1000) + 1, self._perform_render)
+        else: self._render_job = self.root.after_idle(self._perform_render)
+
+    def cancel_render(self):
+        """予約済みの再描画を取り消す"""
+        if self._render_job is not None:
+            self.root.after_cancel(self._render_job); self._render_job = None
+
+    def flush_render(self):
+        """予約済みの再描画があれば今すぐ実行する (当たり判定を最新にしたいとき用)"""
+        if self._render_job is not None:
+            self.cancel_render(); self._perform_render()
+
+    def _perform_render(self):
+        self._render_job = None
+        self._last_render_time = time.perf_counter()
+        self.render_stats['performed'] += 1
+        self.update_canvas_image()
+
+    def invalidate_layers(self):
+        """選択アイテム以外の内容が変わったときに、固定レイヤーを作り直させる"""
+        self.frozen_layers = None
+
+    def invalidate_tiles(self, rect=None):
+        """
+        背景 (消しゴム) が変わったタイルを捨てる。rect は画像座標の範囲で、省略すると全部。
+        アイテムの変更はタイルごとの中身の比較で分かるので、ここで捨てる必要はない
+        """
+        if rect is None:
+            self.tile_cache.clear(); self.tile_signatures.clear()
+        else:
+            x0, y0, x1, y1 = rect; T = TILE_SIZE
+            def hit(key):
+                sc, zr, tx, ty = key
+                return zr[0] == 0 and tx*T < x1*sc and (tx+1)*T > x0*sc and ty*T < y1*sc and (ty+1)*T > y0*sc
+            self.tile_cache.discard_where(hit)
+        self.invalidate_layers()
+
+    def _view_geometry(self, cw, ch):
+        """表示倍率・ページの左上のキャンバス座標・見えている範囲 (sc 倍のページ座標) を決める"""
+        iw, ih = self.background_source.size
+        fit = min(cw/iw, ch/ih); sc = fit * self.zoom
+        nw, nh = int(iw*sc), int(ih*sc)
+        cx, cy = self.view_center if self.view_center is not None else (iw/2, ih/2)
+        # ページが画面より小さい向きは中央に置き、大きい向きは画面の外に余白が出ないようにする
+        ox = (cw-nw)//2 if nw <= cw else min(0, max(cw-nw, int(round(cw/2 - cx*sc))))
+        oy = (ch-nh)//2 if nh <= ch else min(0, max(ch-nh, int(round(ch/2 - cy*sc))))
+        if self.view_center is not None: self.view_center = ((cw/2 - ox)/sc, (ch/2 - oy)/sc)
+        view = (max(0, -ox), max(0, -oy), min(nw, cw-ox), min(nh, ch-oy))
+        return fit, sc, (nw, nh), (ox, oy), view
+
+    def _item_extent(self, kind, idx, sc):
+        """
+        sc 倍で描いたときにアイテムの画像が置かれる範囲 (sc 倍のページ座標)。_item_bitmap() と同じ大きさ・位置を描かずに求め、
+        拡大表示で見えていないアイテムまで大きな倍率で描かずに済ませる
+        """
+        size = self._item_size(kind, idx, sc)
+        if size is None: return (float('-inf'), float('-inf'), float('inf'), float('inf'))
+        o = _item_list(self, kind)[idx]
+        x = int(o['x']*sc - size[0]/2); y = int(o['y']*sc - size[1]/2)
+        return (x, y, x + size[0], y + size[1])
+
+    def _item_signature(self, kind, idx, sc):
+        o = _item_list(self, kind)[idx]
+        key = self._text_cache_key(o, sc) if kind == 'text' else self._image_cache_key(o, sc)
+        return (kind, key, o['x'], o['y'])
+
+    def _draw_background_region(self, canvas, sc, rect):
+        """背景と消しゴムの跡の、sc 倍のページ座標で rect の範囲を描く (canvas はページ座標に合わせてある)"""
+        bg = self.background_source
+        iw, ih = bg.size; size = (int(iw*sc), int(ih*sc))
+        if size == self.cache_canvas_size:
+            # 画面に収める倍率なら、合成済みの縮小背景をそのまま使う (拡大用の元画像は手放す)
+            self._bg_level = None
+            canvas.drawImage(self.cache_bg_image, 0, 0); return
+        x0, y0, x1, y1 = rect
+        src = self._background_level(size)
+        fx = src.width / size[0]; fy = src.height / size[1]  # 全体を size に縮小したときと同じ対応にする
+        region = src.resize((x1-x0, y1-y0), RESAMPLE_BILINEAR, box=(x0*fx, y0*fy, min(x1*fx, src.width), min(y1*fy, src.height)))
+        canvas.drawImage(pil_to_skia(region), x0, y0)
+        if self.stroke_layer is not None: self.stroke_layer.draw_region(canvas, sc, rect)
+
+    def _background_level(self, size):
+        """
+        背景を size に縮小するときの元画像 (縮小画像の列に十分な大きさが無ければ原寸)。
+        原寸は省メモリ設定だと読むたびにデコードし直すので、タイルごとではなく表示倍率が変わったときだけ取り出す
+        """
+        bg = self.background_source; level = self._bg_level
+        if level is not None and level[0] is bg and level[1] == size: return level[2]
+        src = bg.pyramid.source_for(size) if bg.pyramid is not None else None
+        if src is None: src = bg.image
+        self._bg_level = (bg, size, src)
+        return src
+
+    def _get_tile(self, sc, zr, tx, ty, rect, entries):
+        """
+        タイル (sc 倍のページ座標で rect の範囲、重なり順 zr の範囲のアイテム) を返す。
+        中に入るアイテムのキャッシュキーと位置が前回と同じなら描き直さない
+        """
+        key = (round(sc, 6), zr, tx, ty)
+        sig = tuple(e[2] for e in entries)
+        tile = self.tile_cache.get(key, RenderCache.MISSING)
+        if tile is not RenderCache.MISSING and self.tile_signatures.get(key) == sig: return tile
+        x0, y0, x1, y1 = rect
+        surface = skia.Surface(x1-x0, y1-y0)
+        with surface as canvas:
+            canvas.clear(skia.ColorTRANSPARENT)
+            canvas.translate(-x0, -y0)
+            if zr[0] == 0: self._draw_background_region(canvas, sc, rect)
+            for kind, idx, _, e in entries:
+                # 大きなアイテムはタイルにかかる部分だけを描く (描くものが無いアイテムの範囲は無限大)
+                if e[0] != float('-inf') and (e[2]-e[0]) * (e[3]-e[1]) * 4 > TILE_ITEM_CLIP_BYTES: self._draw_item_clipped(canvas, kind, idx, sc, e)
+                else: self._draw_items(canvas, [(kind, idx)], sc)
+        tile = surface.makeImageSnapshot()
+        self.tile_cache.put(key, tile); self.tile_signatures[key] = sig
+        if len(self.tile_signatures) > 4 * len(self.tile_cache) + 64:
+            self.tile_signatures = {k: v for k, v in self.tile_signatures.items() if k in self.tile_cache}
+        return tile
+
+    def _compose_tiles(self, sc, page_size, view, items, start, end):
+        """
+        重なり順が start から end のアイテム (start が 0 なら背景も) を、見えている範囲のタイルから1枚にまとめる。
+        見えている範囲にかかるアイテムがあったかどうかも返す
+        """
+        vx0, vy0, vx1, vy1 = view; nw, nh = page_size; T = TILE_SIZE
+        entries = []
+        for kind, idx in items[start:end]:
+            entries.append((kind, idx, self._item_signature(kind, idx, sc), self._item_extent(kind, idx, sc)))
+        surface = skia.Surface(vx1-vx0, vy1-vy0)
+        with surface as canvas:
+            canvas.clear(skia.ColorTRANSPARENT)
+            for ty in range(vy0 // T, (vy1-1) // T + 1):
+                for tx in range(vx0 // T, (vx1-1) // T + 1):
+                    rect = (tx*T, ty*T, min((tx+1)*T, nw), min((ty+1)*T, nh))
+                    inside = [e for e in entries if e[3][0] < rect[2] and e[3][2] > rect[0] and e[3][1] < rect[3] and e[3][3] > rect[1]]
+                    canvas.drawImage(self._get_tile(sc, (start, end), tx, ty, rect, inside), rect[0]-vx0, rect[1]-vy0)
+        visible = any(e[0] < vx1 and e[2] > vx0 and e[1] < vy1 and e[3] > vy0 for _, _, _, e in entries)
+        return surface.makeImageSnapshot(), visible
+
+    def _get_frozen_layers(self, sc, page_size, view):
+        """
+        選択アイテムより下の全アイテムを背景ごと1枚に、上のアイテムを透明な1枚にまとめてキャッシュする (見えている範囲だけ)。
+        選択中は 下レイヤー + 選択アイテム + 上レイヤー の3枚を重ねるだけで済む。選択がなければ全部が下レイヤーに入る
+        """
+        sel = self.selected_item
+        key = (sel['type'] if sel else None, sel['index'] if sel else None, len(self.placed_images), len(self.text_objects), round(sc, 6), view)
+        layers = self.frozen_layers
+        if layers and layers['key'] == key and layers['bg'] is self.cache_bg_image: return layers
+
+        items = self._z_items()
+        self._sync_hit_index(items)
+        pos = items.index((sel['type'], sel['index'])) if sel else len(items)
+        below, _ = self._compose_tiles(sc, page_size, view, items, 0, pos)
+        above = None
+        if pos + 1 < len(items):
+            above, visible = self._compose_tiles(sc, page_size, view, items, pos+1, len(items))
+            if not visible: above = None
+        self.frozen_layers = {'key': key, 'bg': self.cache_bg_image, 'below': below, 'above': above}
+        return self.frozen_layers
+
     def update_canvas_image(self):
-        if not self.original_image: return
+        if self.background_source is None: return
         try:
             cw, ch = self.canvas.winfo_width(), self.canvas.winfo_height()
             if cw<10 or ch<10: return
-            iw, ih = self.original_image.size
-            sc = min(cw/iw, ch/ih)
-            self.img_scale = sc
-            nw, nh = int(iw*sc), int(ih*sc)
-            self.offset_x, self.offset_y = (cw-nw)//2, (ch-nh)//2
-            
-            self.hit_targets = []
-
-            if self.cache_bg_image is None or self.cache_canvas_size != (nw, nh):
-                self.cache_bg_image = self.original_image.resize((nw, nh), RESAMPLE_BILINEAR)
-                self.cache_canvas_size = (nw, nh)
-                if self.strokes:
-                    d = ImageDraw.Draw(self.cache_bg_image)
-                    for sx, sy, sz, c in self.strokes:
-                        rsx=sx*sc; rsy=sy*sc; rsz=sz*sc; r=rsz/2
-                        d.ellipse((rsx-r, rsy-r, rsx+r, rsy+r), fill=c)
-            
-            base = self.cache_bg_image.copy()
-
-            for i, o in enumerate(self.placed_images):
-                img_obj = self._render_image_item(o)
-                if img_obj:
-                    cx = o['x']*sc; cy = o['y']*sc
-                    px = int(cx - img_obj.width/2); py = int(cy - img_obj.height/2)
-                    base.paste(img_obj, (px, py), img_obj)
-                    c0 = px + self.offset_x; r0 = py + self.offset_y
-                    c1 = c0 + img_obj.width; r1 = r0 + img_obj.height
-                    self.hit_targets.append({'type': 'image', 'index': i, 'bbox': (c0, r0, c1, r1)})
-
-            for i, o in enumerate(self.text_objects):
-                p_obj = o.copy()
-                p_obj['size'] = int(o['size'] * sc)
-                p_obj['outline_width'] = int(o.get('outline_width', 0) * sc)
-                
-                img_obj = self._render_text_skia(p_obj)
-                
-                if img_obj:
-                    cx = o['x']*sc; cy = o['y']*sc
-                    px = int(cx - img_obj.width/2)
-                    py = int(cy - img_obj.height/2)
-                    base.paste(img_obj, (px, py), img_obj)
-                    c0 = px + self.offset_x; r0 = py + self.offset_y
-                    c1 = c0 + img_obj.width; r1 = r0 + img_obj.height
-                    self.hit_targets.append({'type': 'text', 'index': i, 'bbox': (c0, r0, c1, r1)})
-
-            self.display_pil = base
+            iw, ih = self.background_source.size
+            fit, sc, page_size, (ox, oy), view = self._view_geometry(cw, ch)
+            self.fit_scale = fit; self.img_scale = sc
+            self.offset_x, self.offset_y = ox, oy
+
+            # 画面に収める倍率の背景 (消しゴム込み)。拡大していないときのタイルはここから切り出す
+            fw, fh = int(iw*fit), int(ih*fit)
+            if self.cache_bg_image is None or self.cache_canvas_size != (fw, fh):
+                surface = skia.Surface(fw, fh)
+                with surface as canvas:
+                    canvas.clear(skia.ColorTRANSPARENT)
+                    self._draw_background(canvas, fit, (fw, fh))
+                self.cache_bg_image = surface.makeImageSnapshot()
+                self.cache_canvas_size = (fw, fh)
+
+            vx0, vy0, vx1, vy1 = view
+            self.view_origin = (ox+vx0, oy+vy0)
+            # キャンバスの背景色で塗ってから重ねるので、結果は常に不透明になる
+            canvas = self.compositor.begin(vx1-vx0, vy1-vy0, CANVAS_BG_COLOR)
+            layers = self._get_frozen_layers(sc, page_size, view)
+            canvas.drawImage(layers['below'], 0, 0)
+            if self.selected_item:
+                # 選択中は固定レイヤーに挟んで選択アイテムだけを描き直す (動かしている途中なので索引も更新する)
+                kind, idx = self.selected_item['type'], self.selected_item['index']
+                self._sync_hit_item(kind, idx)
+                canvas.save(); canvas.translate(-vx0, -vy0)
+                self._draw_items(canvas, [(kind, idx)], sc)
+                canvas.restore()
+            if layers['above'] is not None:
+                canvas.drawImage(layers['above'], 0, 0)
+
+            self.display_pil = self.compositor.to_pil(opaque=True)
             self.display_image = ImageTk.PhotoImage(self.display_pil)
+            self.drag_lift = None
             self.canvas.delete("all")
-            self.canvas.create_image(self.offset_x, self.offset_y, anchor=tk.NW, image=self.display_image)
+            self.canvas.create_image(self.view_origin[0], self.view_origin[1], anchor=tk.NW, image=self.display_image)
 
             if self.selected_item:
                 sel_idx = self.selected_item['index']; sel_type = self.selected_item['type']
-                for item in reversed(self.hit_targets):
-                    if item['type'] == sel_type and item['index'] == sel_idx:
-                        c0, r0, c1, r1 = item['bbox']
-                        self.canvas.create_rectangle(c0, r0, c1, r1, outline="cyan", dash=(4,4), width=2)
-                        if sel_type == 'text': obj=self.text_objects[sel_idx]
-                        else: obj=self.placed_images[sel_idx]
-                        ax = obj['x']*sc+self.offset_x; ay = obj['y']*sc+self.offset_y
-                        self.canvas.create_oval(ax-4, ay-4, ax+4, ay+4, fill="red", outline="white")
-                        break
+                img, pos = self._item_bitmap(sel_type, sel_idx, sc)
+                if img is not None:
+                    c0 = pos[0]+self.offset_x; r0 = pos[1]+self.offset_y
+                    self.canvas.create_rectangle(c0, r0, c0+img.width(), r0+img.height(), outline="cyan", dash=(4,4), width=2)
+                    obj = _item_list(self, sel_type)[sel_idx]
+                    ax = obj['x']*sc+self.offset_x; ay = obj['y']*sc+self.offset_y
+                    self.canvas.create_oval(ax-4, ay-4, ax+4, ay+4, fill="red", outline="white")
+            self._draw_hover()
         except Exception:
             traceback.print_exc()
 
+    # --- 当たり判定 ---
+    def _sync_hit_item(self, kind, idx):
+        """アイテムの範囲を索引に登録する。前回から見た目も位置も変わっていなければ何もしない"""
+        obj = _item_list(self, kind)[idx]; key = id(obj)
+        sig = self._item_signature(kind, idx, self.fit_scale)
+        entry = self._hit_items.get(key)
+        if entry is not None and entry[1] is obj and entry[2] == sig: return key
+        self._hit_items[key] = (kind, obj, sig)
+        # 画面に収める倍率で描いた画像の範囲を、縮小時の切り捨て分だけ広げて登録する (細かい判定は拾うときに行う)
+        f = self.fit_scale
+        img, pos = self._item_bitmap(kind, idx, f)
+        if img is None: self.hit_index.remove(key); return key
+        pad = (2 + HIT_ALPHA_RADIUS) / f
+        self.hit_index.update(key, (pos[0]/f - pad, pos[1]/f - pad, (pos[0]+img.width())/f + pad, (pos[1]+img.height())/f + pad))
+        return key
+
+    def _sync_hit_index(self, items):
+        """追加・削除・変更されたアイテムだけを索引に反映する"""
+        seen = {self._sync_hit_item(kind, idx) for kind, idx in items}
+        for key in [k for k in self._hit_items if k not in seen]:
+            del self._hit_items[key]; self.hit_index.remove(key)
+
+    def _alpha_mask(self, img):
+        """描画済み画像の不透明度の配列 (最近使ったものだけ覚えておく)"""
+        entry = self._alpha_masks.get(id(img))
+        if entry is not None and entry[0] is img:
+            self._alpha_masks.move_to_end(id(img)); return entry[1]
+        mask = img.toarray()[:, :, 3]
+        self._alpha_masks[id(img)] = (img, mask)
+        while len(self._alpha_masks) > 32: self._alpha_masks.popitem(last=False)
+        return mask
+
+    def pick_item(self, x, y):
+        """
+        キャンバス座標 (x, y) にある一番上のアイテム ({'type', 'index'} か None)。
+        索引で候補を絞り、表示中の画像の不透明な部分にかかっているかで決める
+        """
+        sc = self.img_scale
+        cands = []
+        for key in self.hit_index.query((x - self.offset_x) / sc, (y - self.offset_y) / sc):
+            kind, obj, _ = self._hit_items[key]
+            items = _item_list(self, kind)
+            idx = next((i for i, o in enumerate(items) if o is obj), None)
+            if idx is not None: cands.append((kind == 'text', idx, kind))
+        for _, idx, kind in sorted(cands, reverse=True):
+            img, pos = self._item_bitmap(kind, idx, sc)
+            if img is None: continue
+            # 文字は線の隙間 (字の内側) を押しても拾えるよう、文字の大きさに合わせて判定を広げる
+            r = HIT_ALPHA_RADIUS if kind == 'image' else max(HIT_ALPHA_RADIUS, int(self.text_objects[idx]['size'] * sc / 4))
+            px = int(x - self.offset_x - pos[0]); py = int(y - self.offset_y - pos[1])
+            if not (-r <= px < img.width() + r and -r <= py < img.height() + r): continue
+            mask = self._alpha_mask(img)
+            if mask[max(0, py-r):max(0, py+r+1), max(0, px-r):max(0, px+r+1)].max(initial=0) >= HIT_ALPHA_MIN:
+                return {'type': kind, 'index': idx}
+        return None
+
+    def on_canvas_motion(self, event):
+        """マウスの下にあるアイテムを枠で示す (描き直さずに枠だけを置き換える)"""
+        if self.background_source is None: return
+        busy = self.brush_active or self.dropper_active or self.placing_text_content or self.placing_image_id is not None or self._space_held
+        hover = None if busy else self.pick_item(event.x, event.y)
+        if hover == self.hover_item: return
+        self.hover_item = hover; self._draw_hover()
+
+    def _draw_hover(self):
+        self.canvas.delete("hover")
+        h = self.hover_item
+        if h is None or h == self.selected_item or h['index'] >= len(_item_list(self, h['type'])): return
+        img, pos = self._item_bitmap(h['type'], h['index'], self.img_scale)
+        if img is None: return
+        c0 = pos[0]+self.offset_x; r0 = pos[1]+self.offset_y
+        self.canvas.create_rectangle(c0, r0, c0+img.width(), r0+img.height(), outline="#ffd700", dash=(2,2), tags=("hover",))
+
+    # --- 拡大・スクロール ---
+    def on_canvas_wheel(self, event):
+        """ホイールでマウスの位置を中心に拡大・縮小する (画面に収める大きさより小さくはしない)"""
+        if self.background_source is None or self.drag_data["item"] or self._stroke_start is not None: return
+        up = event.num == 4 or (event.num != 5 and event.delta > 0)
+        zoom = self.zoom * (VIEW_ZOOM_STEP if up else 1 / VIEW_ZOOM_STEP)
+        zoom = min(max(zoom, 1.0), max(1.0, VIEW_MAX_SCALE / self.fit_scale))
+        if zoom == self.zoom: return
+        # マウスの下にある画像の点が、拡大後も同じ位置に来るようにする
+        ix = (event.x - self.offset_x) / self.img_scale; iy = (event.y - self.offset_y) / self.img_scale
+        sc = self.fit_scale * zoom
+        cw, ch = self.canvas.winfo_width(), self.canvas.winfo_height()
+        self.zoom = zoom
+        self.view_center = None if zoom == 1.0 else (ix - (event.x - cw/2) / sc, iy - (event.y - ch/2) / sc)
+        self.request_render("zoom")
+
+    def reset_view(self):
+        self.zoom = 1.0; self.view_center = None; self._pan_start = None
+
+    def on_space_press(self, event):
+        if isinstance(event.widget, (tk.Text, tk.Entry, ttk.Entry)) or self._space_held: return
+        self._space_held = True; self.canvas.config(cursor="fleur")
+
+    def on_space_release(self, event):
+        self._space_held = False; self.canvas.config(cursor="")
+
+    def _pan_to(self, event):
+        x, y, ox, oy = self._pan_start
+        sc = self.img_scale; cw, ch = self.canvas.winfo_width(), self.canvas.winfo_height()
+        nx = ox + event.x - x; ny = oy + event.y - y
+        self.view_center = ((cw/2 - nx) / sc, (ch/2 - ny) / sc)
+        self.request_render("pan")
+
     # ---------------------------------------------------------
     # 操作系
     # ---------------------------------------------------------
@@ -612,7 +2987,6 @@ class ZunComiApp:
         
         if imported_count > 0:
             self.refresh_font_list()
-            self.combo_font['values'] = self.font_names
             messagebox.showinfo("成功", f"{imported_count}個のフォントを追加しました。\nリストから選択可能です。")
         else:
             messagebox.showwarning("失敗", "フォントの追加に失敗しました。")
@@ -622,31 +2996,94 @@ class ZunComiApp:
         if not file_paths: return
         for path in file_paths:
             try:
-                img = Image.open(path).convert("RGBA")
-                self.asset_images.append(img)
+                # 原寸のデコードは初めて配置するときまで行わない (サムネイルは別スレッドで作る)
+                entry = LazyImage.from_file(path)
+                # ライブラリに既にある素材は共有の LazyImage を使う。新しい素材をライブラリに置くのは保存するとき
+                if SHARE_ASSET_LIBRARY: entry = ASSET_LIBRARY.entry(entry.digest, entry.size) or entry
+                # 同じ内容の素材は同じデータを共有する
+                for other in self.asset_images:
+                    if other is not None and other.digest == entry.digest: entry = other; break
+                self.asset_images.append(entry)
                 asset_id = len(self.asset_images) - 1
-                thumb_w = 140; aspect = img.height / img.width; thumb_h = int(thumb_w * aspect)
-                if thumb_h > 140: thumb_h = 140
-                thumb_pil = img.resize((thumb_w, thumb_h), RESAMPLE_LANCZOS)
-                thumb_tk = ImageTk.PhotoImage(thumb_pil)
-                self.asset_thumbnails.append(thumb_tk)
-                item_frame = tk.Frame(self.scrollable_frame, bg="#e0e0e0", bd=2, relief="flat")
-                item_frame.pack(pady=5, padx=5, fill=tk.X)
-                self.asset_frames.append(item_frame)
-                btn_del = tk.Button(item_frame, text="×", font=("Arial", 8), bg="#ffcccc", command=lambda i=asset_id, f=item_frame: self.remove_asset_image(i, f), width=2, relief="flat")
-                btn_del.pack(anchor="ne")
-                btn_img = tk.Button(item_frame, image=thumb_tk, command=lambda i=asset_id: self.select_asset_to_place(i), bg="white", relief="flat")
-                btn_img.pack(padx=2, pady=2)
+                self._add_asset_widget(asset_id, entry)
+                self._journal(lambda: {"op": "asset_add", "id": asset_id, "asset": self.journal.blob_ref(entry, thumb=True)})
             except Exception as e: print(f"Failed to load {path}: {e}")
 
-    def remove_asset_image(self, asset_id, frame_widget):
+    def _add_asset_widget(self, asset_id, entry, thumb_pil=None):
+        """素材を一覧の末尾に加える。サムネイルが無ければ別スレッドで用意する"""
+        if thumb_pil is not None: self.asset_thumb_sources[entry.digest] = thumb_pil
+        elif entry.digest not in self.asset_thumb_sources:
+            self.thumb_worker.request(entry)
+            if self._thumb_job is None: self._thumb_job = self.root.after(50, self._poll_thumbnails)
+        self.asset_rows.append(asset_id); self._layout_asset_rows()
+
+    def _poll_thumbnails(self):
+        """できあがったサムネイルを、見えている行に反映する"""
+        self._thumb_job = None
+        while True:
+            try: digest, thumb = self.thumb_worker.done.get_nowait()
+            except queue.Empty: break
+            self.asset_thumb_sources[digest] = thumb
+            for asset_id, (_, btn_img, _) in self.asset_row_widgets.items():
+                if self.asset_images[asset_id].digest == digest: btn_img.config(image=self._asset_photo(digest), text="")
+        if self.thumb_worker.busy: self._thumb_job = self.root.after(50, self._poll_thumbnails)
+
+    def _asset_photo(self, digest):
+        photo = self.asset_photos.get(digest)
+        if photo is None and digest in self.asset_thumb_sources:
+            photo = self.asset_photos[digest] = ImageTk.PhotoImage(self.asset_thumb_sources[digest])
+        return photo
+
+    def _layout_asset_rows(self):
+        """行の数や並びが変わったときに、スクロール範囲と見えている行の位置を合わせ直す"""
+        self.asset_canvas.configure(scrollregion=(0, 0, 200, len(self.asset_rows) * ASSET_ROW_HEIGHT))
+        for row, asset_id in enumerate(self.asset_rows):
+            if asset_id in self.asset_row_widgets: self.asset_canvas.coords(self.asset_row_widgets[asset_id][2], 5, row * ASSET_ROW_HEIGHT + 5)
+        self._refresh_asset_rows()
+
+    def _refresh_asset_rows(self):
+        """見えている行 (と前後1行) の部品だけを作り、見えなくなった行の部品は捨てる"""
+        top = self.asset_canvas.canvasy(0); height = max(self.asset_canvas.winfo_height(), ASSET_ROW_HEIGHT)
+        first = max(0, int(top // ASSET_ROW_HEIGHT) - 1); last = min(len(self.asset_rows), int((top + height) // ASSET_ROW_HEIGHT) + 2)
+        visible = set(self.asset_rows[first:last])
+        for asset_id in [i for i in self.asset_row_widgets if i not in visible]: self._drop_asset_row(asset_id)
+        for row in range(first, last):
+            if self.asset_rows[row] not in self.asset_row_widgets: self._make_asset_row(row, self.asset_rows[row])
+        shown = {self.asset_images[i].digest for i in self.asset_row_widgets}
+        for digest in [d for d in self.asset_photos if d not in shown]: del self.asset_photos[digest]
+
+    def _make_asset_row(self, row, asset_id):
+        digest = self.asset_images[asset_id].digest
+        item_frame = tk.Frame(self.asset_canvas, bg="#ff4500" if asset_id == self.placing_image_id else "#e0e0e0", bd=2, relief="flat")
+        btn_del = tk.Button(item_frame, text="×", font=("Arial", 8), bg="#ffcccc", command=lambda i=asset_id: self.remove_asset_image(i), width=2, relief="flat")
+        btn_del.pack(anchor="ne")
+        photo = self._asset_photo(digest)
+        if photo is not None: btn_img = tk.Button(item_frame, image=photo, command=lambda i=asset_id: self.select_asset_to_place(i), bg="white", relief="flat")
+        else: btn_img = tk.Button(item_frame, text="読み込み中...", width=18, height=6, command=lambda i=asset_id: self.select_asset_to_place(i), bg="white", relief="flat")
+        btn_img.pack(padx=2, pady=2)
+        window = self.asset_canvas.create_window(5, row * ASSET_ROW_HEIGHT + 5, window=item_frame, anchor="nw", width=190)
+        self.asset_row_widgets[asset_id] = (item_frame, btn_img, window)
+
+    def _drop_asset_row(self, asset_id):
+        widgets = self.asset_row_widgets.pop(asset_id, None)
+        if widgets: self.asset_canvas.delete(widgets[2]); widgets[0].destroy()
+
+    def _remove_asset_entry(self, asset_id):
+        """素材を削除済み (None) にして一覧から外す。素材番号は配置画像が参照しているので詰めない"""
+        self.asset_images[asset_id] = None
+        if asset_id in self.asset_rows: self.asset_rows.remove(asset_id)
+        self._drop_asset_row(asset_id); self._layout_asset_rows()
+
+    def remove_asset_image(self, asset_id):
         if 0 <= asset_id < len(self.asset_images):
-            self.asset_images[asset_id] = None; self.asset_frames[asset_id] = None
-            frame_widget.destroy(); self.update_canvas_image()
+            self._remove_asset_entry(asset_id)
+            self.image_render_cache.discard_where(lambda k: k[0] == asset_id); self.invalidate_tiles()
+            self.request_render("asset")
+            self._journal(lambda: {"op": "asset_remove", "id": asset_id})
 
     def update_asset_highlight(self, target_id):
-        for i, frame in enumerate(self.asset_frames):
-            if frame: frame.config(bg="#ff4500" if i == target_id else "#e0e0e0")
+        for i, (frame, _, _) in self.asset_row_widgets.items():
+            frame.config(bg="#ff4500" if i == target_id else "#e0e0e0")
 
     def select_asset_to_place(self, asset_id):
         if self.asset_images[asset_id] is None: return
@@ -660,37 +3097,43 @@ class ZunComiApp:
         self.root.config(cursor="")
 
     def deselect_all(self):
-        self.selected_item = None; self.btn_update.config(state=tk.DISABLED, bg="#ffebcd"); self.update_canvas_image()
+        self.selected_item = None; self.btn_update.config(state=tk.DISABLED, bg="#ffebcd"); self.request_render("selection")
 
     def delete_selected_item(self):
         if self.selected_item is None: return
-        self.save_history(); idx = self.selected_item['index']
-        if self.selected_item['type'] == 'text': del self.text_objects[idx]
-        elif self.selected_item['type'] == 'image': del self.placed_images[idx]
+        kind = self.selected_item['type']; idx = self.selected_item['index']
+        items = _item_list(self, kind); obj = items[idx]; del items[idx]
+        self.history.record(DeleteItemCommand(kind, idx, obj))
         self.deselect_all()
 
     def on_property_change(self, *args):
         if self.selected_item and self.selected_item['type'] == 'text':
             idx = self.selected_item['index']; obj = self.text_objects[idx]
-            obj['size'] = self.var_font_size.get()
-            obj['line_spacing'] = self.var_line_spacing.get()
-            obj['char_spacing'] = self.var_char_spacing.get()
-            obj['outline_width'] = self.var_outline_width.get()
-            obj['angle'] = self.var_text_angle.get()
-            obj['vertical'] = self.var_vertical.get()
-            
-            obj['font_key'] = self.combo_font.get()
-            
-            obj['align_h'] = self.combo_align_h.get() 
-            obj['align_v'] = self.combo_align_v.get() 
-            self.update_canvas_image()
+            values = {
+                'size': self.var_font_size.get(),
+                'line_spacing': self.var_line_spacing.get(),
+                'char_spacing': self.var_char_spacing.get(),
+                'outline_width': self.var_outline_width.get(),
+                'angle': self.var_text_angle.get(),
+                'vertical': self.var_vertical.get(),
+                'font_key': self.combo_font.get(),
+                'align_h': self.combo_align_h.get(),
+                'align_v': self.combo_align_v.get(),
+            }
+            # 実際に変わった項目だけを履歴に積む (スライダーの連続操作は1手にまとまる)
+            cmd = PropertyCommand.diff('text', idx, obj, values)
+            if cmd is None: return
+            obj.update(cmd.after); self.history.record(cmd)
+            self.request_render("text_property")
 
     def on_image_property_change(self, *args):
         if self.selected_item and self.selected_item['type'] == 'image':
             idx = self.selected_item['index']; obj = self.placed_images[idx]
-            obj['scale'] = self.var_img_scale.get() / 100.0
-            obj['angle'] = self.var_img_angle.get()
-            self.update_canvas_image()
+            cmd = PropertyCommand.diff('image', idx, obj, {'scale': self.var_img_scale.get() / 100.0, 'angle': self.var_img_angle.get()})
+            if cmd is None: return
+            self.image_render_cache.discard(self._image_cache_key(obj, self.img_scale))
+            obj.update(cmd.after); self.history.record(cmd)
+            self.request_render("image_property")
 
     def reflect_selection_to_ui(self):
         if self.selected_item is None: return
@@ -732,9 +3175,11 @@ class ZunComiApp:
         self.brush_color = hex_color; self.lbl_eraser_preview.config(bg=hex_color)
 
     def pick_color_from_image(self, x, y):
-        if self.original_image:
+        bg = self.background_source
+        if bg is not None:
             try:
-                p = self.original_image.getpixel((int(x), int(y)))
+                # 消しゴムの色は正確でないといけないので、縮小画像 (周りの画素と平均した色) ではなく原寸の画素から拾う
+                p = bg.image.getpixel((min(max(int(x), 0), bg.width - 1), min(max(int(y), 0), bg.height - 1)))
                 self.set_brush_color('#{:02x}{:02x}{:02x}'.format(p[0],p[1],p[2]))
                 self.toggle_brush_mode()
             except: pass
@@ -742,16 +3187,16 @@ class ZunComiApp:
     def choose_text_color(self):
         c = colorchooser.askcolor(color=self.text_color)[1]
         if c:
-            self.save_history(); self.text_color = c; self.lbl_text_color_preview.config(bg=c)
+            self.text_color = c; self.lbl_text_color_preview.config(bg=c)
             if self.selected_item and self.selected_item['type'] == 'text':
-                self.text_objects[self.selected_item['index']]['color'] = c; self.update_canvas_image()
+                self._set_text_props({'color': c}, "text_color")
 
     def choose_outline_color(self):
         c = colorchooser.askcolor(color=self.text_outline_color)[1]
         if c:
-            self.save_history(); self.text_outline_color = c; self.lbl_outline_color_preview.config(bg=c)
+            self.text_outline_color = c; self.lbl_outline_color_preview.config(bg=c)
             if self.selected_item and self.selected_item['type'] == 'text':
-                self.text_objects[self.selected_item['index']]['outline_color'] = c; self.update_canvas_image()
+                self._set_text_props({'outline_color': c}, "outline_color")
 
     def register_text(self):
         text = self.input_text_box.get("1.0", "end-1c")
@@ -769,8 +3214,16 @@ class ZunComiApp:
 
     def update_placed_object_text(self):
         if self.selected_item and self.selected_item['type'] == 'text':
-            self.save_history(); text = self.input_text_box.get("1.0", "end-1c")
-            if text.strip(): self.text_objects[self.selected_item['index']]['text'] = text; self.update_canvas_image()
+            text = self.input_text_box.get("1.0", "end-1c")
+            if text.strip(): self._set_text_props({'text': text}, "text_content")
+
+    def _set_text_props(self, values, reason):
+        """選択中のテキストの属性を書き換えて履歴に積む"""
+        idx = self.selected_item['index']; obj = self.text_objects[idx]
+        cmd = PropertyCommand.diff('text', idx, obj, values)
+        if cmd is None: return
+        obj.update(cmd.after); self.history.record(cmd); self.history.seal()
+        self.request_render(reason)
 
     def on_list_select(self, event):
         sel = self.text_listbox.curselection()
@@ -784,98 +3237,352 @@ class ZunComiApp:
         path = filedialog.askopenfilename(filetypes=[("Image", "*.jpg;*.png;*.jpeg")])
         if not path: return
         try:
-            self.original_image = Image.open(path).convert("RGBA")
-            self.cache_bg_image = None; self.strokes = []; self.text_objects = []; self.placed_images = []; self.history_stack = []; self.redo_stack = []; self._reset_modes(); self.hit_targets = []; self.update_canvas_image()
+            self._set_pages([PageDocument(LazyImage.from_file(path), source_path=path)])
+            self._compact_journal()
         except Exception as e: messagebox.showerror("Err", str(e))
 
-    def img_to_base64(self, img):
-        if img is None: return None
-        b = io.BytesIO(); img.save(b, format="PNG"); return base64.b64encode(b.getvalue()).decode('utf-8')
-
-    def base64_to_img(self, s):
-        if not s: return None
-        try: return Image.open(io.BytesIO(base64.b64decode(s))).convert("RGBA")
-        except: return None
+    def run_task(self, title, work, on_done):
+        """work を別スレッドで動かす。同時に動かすのは1つだけ"""
+        if self.active_task is not None: return
+        def finished(callback):
+            def f(value):
+                self.active_task = None
+                if callback: callback(value)
+            return f
+        error = lambda e: messagebox.showerror("エラー", f"{e}")
+        self.active_task = BackgroundTask(self.root, title, work, finished(on_done), finished(error), finished(None)).start()
+
+    def _blob_collector(self, blobs, library):
+        """
+        保存用の blob_info。使う画像を blobs に、ライブラリに入れる素材を library に登録し、
+        エンコードやライブラリへの書き込みは書き込むとき (ワーカー) に行う
+        """
+        def blob_info(entry, thumb=False):
+            if thumb and SHARE_ASSET_LIBRARY:
+                # 素材はライブラリに置いて内容ハッシュだけを書く (サムネイルも THUMB_CACHE_DIR から読み直せる)
+                info = {"hash": entry.digest, "size": list(entry.size), "library": True}
+                library.append((entry, info)); return info
+            name = f"images/{entry.digest}.png"
+            blobs.setdefault(name, entry.encoded)
+            info = {"hash": entry.digest, "blob": name, "size": list(entry.size)}
+            if thumb and entry.digest in self.asset_thumb_sources:
+                info["thumb"] = f"thumbs/{entry.digest}.png"
+                blobs.setdefault(info["thumb"], lambda t=self.asset_thumb_sources[entry.digest]: encode_png(t))
+            return info
+        return blob_info
 
     def save_project(self):
-        if self.original_image is None: messagebox.showwarning("警告", "データなし"); return
-        path = filedialog.asksaveasfilename(defaultextension=".zmm", filetypes=[("ZMM Project", "*.zmm")])
+        if self.background_source is None: messagebox.showwarning("警告", "データなし"); return
+        page = self.pages[self.page_index]
+        initial = os.path.splitext(page.title)[0] + ".zmm" if page.title else ""
+        path = filedialog.asksaveasfilename(defaultextension=".zmm", filetypes=[("ZMM Project", "*.zmm")], initialfile=initial)
         if not path: return
-        data = {
-            "version": APP_VERSION, "background_image": self.img_to_base64(self.original_image),
-            "asset_images": [self.img_to_base64(i) for i in self.asset_images],
-            "registered_texts": self.text_listbox.get(0, tk.END),
-            "text_objects": self.text_objects, "placed_images": self.placed_images, "strokes": self.strokes,
-            "brush_color": self.brush_color, "text_color": self.text_color, "text_outline_color": self.text_outline_color
-        }
-        try:
-            with open(path, 'w', encoding='utf-8') as f: json.dump(data, f, ensure_ascii=False, indent=2)
+        blobs = {}; library = []
+        manifest = self._build_manifest(self._blob_collector(blobs, library))
+        strokes_data = self.strokes.to_bytes()
+        # 一時ファイルに書いてから置き換えるので、途中で中止・失敗しても元のファイルは残る
+        work = lambda task: write_project_archive(path, manifest, blobs, strokes_data, task, library)
+        def done(_):
+            page.project_path = path; page.dirty = False; self._update_page_label()
             messagebox.showinfo("完了", "保存しました")
-        except Exception as e: messagebox.showerror("エラー", f"{e}")
+        self.run_task("保存中...", work, done)
+
+    def _build_manifest(self, blob_info, page=None):
+        """
+        プロジェクト/自動保存用の manifest。画像の参照は blob_info(LazyImage, thumb) で作る。
+        page (PageDocument) を渡すとそのページ、省略すると表示中のページの manifest になる。
+        チャプター (複数ページ) では素材をチャプター全体で共有しているので、そのページが配置している素材だけを書き、src_id を付け直す
+        """
+        if page is None:
+            background, text_objects, placed_images = self.background_source, self.text_objects, self.placed_images
+        else:
+            background, text_objects, placed_images = page.background, page.text_objects, page.placed_images
+        assets = self.asset_images
+        if len(self.pages) > 1:
+            used = sorted({o['src_id'] for o in placed_images if 0 <= o['src_id'] < len(assets) and assets[o['src_id']] is not None})
+            remap = {old: new for new, old in enumerate(used)}
+            assets = [assets[i] for i in used]
+            placed_images = [dict(o, src_id=remap.get(o['src_id'], -1)) for o in placed_images]
+        return {
+            "format": PROJECT_FORMAT, "format_version": PROJECT_FORMAT_VERSION, "version": APP_VERSION,
+            "background": blob_info(background) if background is not None else None,
+            "assets": [blob_info(e, thumb=True) if e is not None else None for e in assets],
+            "registered_texts": list(self.text_listbox.get(0, tk.END)),
+            "text_objects": text_objects, "placed_images": placed_images, "strokes": PROJECT_STROKES,
+            "brush_color": self.brush_color, "text_color": self.text_color, "text_outline_color": self.text_outline_color,
+            "export_profiles": self.export_profiles
+        }
 
     def load_project(self):
         path = filedialog.askopenfilename(filetypes=[("ZMM Project", "*.zmm")])
         if not path: return
+        self.run_task("読み込み中...", lambda task: read_project_file(path, task), lambda loaded: self._apply_project(loaded, project_path=path))
+
+    def _clear_assets(self):
+        for asset_id in list(self.asset_row_widgets): self._drop_asset_row(asset_id)
+        self.asset_images = []; self.asset_rows = []; self.asset_photos = {}; self.asset_thumb_sources = {}
+        self.image_render_cache.clear()
+        self._layout_asset_rows()
+
+    def _apply_settings(self, d):
+        self.export_profiles = normalize_export_profiles(d.get("export_profiles"))
+        self.brush_color = d.get("brush_color", "#ffffff"); self.text_color = d.get("text_color", "#000000"); self.text_outline_color = d.get("text_outline_color", "#ffffff")
+        self.lbl_eraser_preview.config(bg=self.brush_color); self.lbl_text_color_preview.config(bg=self.text_color); self.lbl_outline_color_preview.config(bg=self.text_outline_color)
+
+    def _apply_project(self, loaded, records=None, project_path=None):
+        """読み込んだ内容をページに反映する。records (自動保存ジャーナルの操作) があれば続けて再生する"""
+        d, background, assets, thumbs, strokes = loaded
+        self._reset_modes(); self._clear_assets()
+        for entry in assets:
+            self.asset_images.append(entry)
+            if entry is None: continue
+            self._add_asset_widget(len(self.asset_images) - 1, entry, thumbs.get(entry.digest))
+        self.text_listbox.delete(0, tk.END)
+        for t in d.get("registered_texts", []): self.text_listbox.insert(tk.END, t)
+        self._apply_settings(d)
+        page = PageDocument(background, source_path=project_path, project_path=project_path)
+        page.text_objects = d.get("text_objects", []); page.placed_images = d.get("placed_images", []); page.strokes = strokes
+        self._set_pages([page])
+        failed = False
+        for rec in records or []:
+            try: self._apply_journal_record(rec)
+            except Exception:
+                traceback.print_exc(); failed = True; break
+        self._rebuild_stroke_layer(); self.invalidate_tiles()
+        self._compact_journal()
+        self.request_render("load_project")
+        if d.get("missing_assets"): messagebox.showwarning("警告", missing_assets_message(d["missing_assets"]))
+        if records is None: messagebox.showinfo("完了", "読み込みました")
+        elif failed: messagebox.showwarning("警告", "一部の操作を復元できませんでした")
+
+    # --- チャプター (複数ページ) ---
+    def open_chapter(self):
+        paths = filedialog.askopenfilenames(filetypes=[("Image / ZMM Project", "*.jpg;*.png;*.jpeg;*.zmm")])
+        if not paths: return
+        paths = sorted(paths, key=lambda p: os.path.basename(p).lower())
+        def work(task):
+            loaded = []
+            for i, path in enumerate(paths):
+                task.check(); task.progress(i / len(paths), f"{os.path.basename(path)} を読み込み中...")
+                # 背景はまだデコードしない (表示するページと前後のページだけをデコードする)
+                if path.lower().endswith(".zmm"): loaded.append((path, read_project_file(path, thumbnails=True, decode_background=False)))
+                else: loaded.append((path, LazyImage.from_file(path)))
+            return loaded
+        self.run_task("チャプターを読み込み中...", work, self._apply_chapter)
+
+    def _apply_chapter(self, loaded):
+        """open_chapter で読んだページを並べる。素材は内容ハッシュでまとめてチャプター全体で1つの一覧にする"""
+        self._reset_modes(); self._clear_assets(); self.text_listbox.delete(0, tk.END)
+        asset_ids = {}; texts = []; pages = []; missing = []
+        def asset_id(entry, thumbs):
+            if entry.digest not in asset_ids:
+                self.asset_images.append(entry); asset_ids[entry.digest] = len(self.asset_images) - 1
+                self._add_asset_widget(asset_ids[entry.digest], entry, thumbs.get(entry.digest))
+            return asset_ids[entry.digest]
+        for path, item in loaded:
+            if isinstance(item, LazyImage):
+                pages.append(PageDocument(item, source_path=path)); continue
+            d, background, assets, thumbs, strokes = item
+            missing.extend(h for h in d.get("missing_assets", []) if h not in missing)
+            ids = [asset_id(e, thumbs) if e is not None else -1 for e in assets]
+            page = PageDocument(background, source_path=path, project_path=path)
+            page.text_objects = d.get("text_objects", []); page.strokes = strokes
+            page.placed_images = [dict(obj, src_id=ids[obj['src_id']] if 0 <= obj['src_id'] < len(ids) else -1) for obj in d.get("placed_images", [])]
+            if not any(p.project_path for p in pages): self._apply_settings(d)
+            texts.extend(t for t in d.get("registered_texts", []) if t not in texts)
+            pages.append(page)
+        for t in texts: self.text_listbox.insert(tk.END, t)
+        try: self._set_pages(pages)
+        except Exception as e:
+            traceback.print_exc(); messagebox.showerror("エラー", f"ページを開けませんでした: {e}"); return
+        self._compact_journal()
+        if missing: messagebox.showwarning("警告", missing_assets_message(missing))
+
+    def save_chapter(self):
+        """変更したページと、まだプロジェクトとして保存していないページを、それぞれ .zmm に保存する"""
+        if self.background_source is None: messagebox.showwarning("警告", "データなし"); return
+        self.history.seal(); self._stash_page()
+        targets = [(p, p.project_path or os.path.splitext(p.source_path)[0] + ".zmm") for p in self.pages
+                   if (p.dirty or not p.project_path) and (p.project_path or p.source_path)]
+        if not targets: messagebox.showinfo("完了", "保存が必要なページはありません"); return
+        existing = [path for p, path in targets if p.project_path != path and os.path.exists(path)]
+        if existing and not messagebox.askyesno("確認", f"{len(existing)}個のファイルを上書きします。よろしいですか？"): return
+        jobs = []
+        for page, path in targets:
+            blobs = {}; library = []
+            jobs.append((page, path, self._build_manifest(self._blob_collector(blobs, library), page), blobs, page.strokes.to_bytes(), library))
+        def work(task):
+            for i, (page, path, manifest, blobs, strokes_data, library) in enumerate(jobs):
+                task.check(); task.progress(i / len(jobs), f"{os.path.basename(path)} を保存中...")
+                write_project_archive(path, manifest, blobs, strokes_data, library=library)
+        def done(_):
+            for page, path, *_ in jobs: page.project_path = path; page.dirty = False
+            self._update_page_label(); messagebox.showinfo("完了", f"{len(jobs)}ページ保存しました")
+        self.run_task("保存中...", work, done)
+
+    def _set_pages(self, pages):
+        """ページの一覧を入れ替えて最初のページを表示する"""
+        for page in pages: page.history.listener = self._on_edit
+        self.page_cache.clear(); self.pages = pages
+        # 自動保存ジャーナルは1ページ分しか持たないので、複数ページのときは使わない
+        if len(pages) > 1: self.journal.discard()
+        self._show_page(0)
+
+    def _stash_page(self):
+        """表示中のページの内容を PageDocument に戻す"""
+        if not self.pages: return
+        page = self.pages[self.page_index]
+        page.background = self.background_source; page.text_objects = self.text_objects; page.placed_images = self.placed_images
+        page.strokes = self.strokes; page.history = self.history; page.stroke_layer = self.stroke_layer; page.preview = self.cache_bg_base
+
+    def _show_page(self, index):
+        """index のページを表示する。先読み済みならデコードを待たずに切り替わる"""
+        page = self.pages[index]
+        page.decode((self.canvas.winfo_width(), self.canvas.winfo_height()), pyramid=False)
+        self.page_index = index
+        self.background_source = page.background
+        self.text_objects = page.text_objects; self.placed_images = page.placed_images; self.strokes = page.strokes
+        self.history = page.history; self.stroke_layer = page.stroke_layer; self.cache_bg_base = page.preview
+        self.cache_bg_image = None; self.hover_item = None; self._hit_items.clear(); self.hit_index.clear()
+        self.invalidate_tiles(); self.reset_view()
+        self._reset_modes(); self.deselect_all(); self.input_text_box.delete("1.0", tk.END)
+        self._update_page_label(); self._schedule_prefetch()
+        self.request_render("page")
+
+    def _turn_page(self, step, event):
+        if event is not None and isinstance(event.widget, (tk.Text, tk.Entry, ttk.Entry)): return
+        if self.active_task is not None or not self.pages: return
+        index = self.page_index + step
+        if not 0 <= index < len(self.pages): return "break"
+        self.history.seal(); self._stash_page()
+        try: self._show_page(index)
+        except Exception as e:
+            traceback.print_exc(); messagebox.showerror("エラー", f"ページを開けませんでした: {e}")
+        return "break"
+
+    def next_page(self, e=None): return self._turn_page(1, e)
+
+    def prev_page(self, e=None): return self._turn_page(-1, e)
+
+    def _update_page_label(self):
+        if not self.pages: self.lbl_page.config(text="- / -"); return
+        page = self.pages[self.page_index]
+        title = page.title if len(page.title) <= 24 else page.title[:23] + "…"
+        self.lbl_page.config(text=f"{self.page_index + 1} / {len(self.pages)}  {title}{' *' if page.dirty else ''}")
+
+    def _neighbour_pages(self):
+        """先読みするページ (次のページを優先する)"""
+        i = self.page_index
+        order = [i + d for k in range(1, PAGE_PREFETCH_RADIUS + 1) for d in (k, -k)]
+        return [self.pages[j] for j in order if 0 <= j < len(self.pages)]
+
+    def _schedule_prefetch(self):
+        page = self.pages[self.page_index]; neighbours = self._neighbour_pages()
+        for p in neighbours + [page]: self.page_cache.touch(p)
+        self.page_cache.trim([page] + neighbours)
+        # 表示中のページは背景の縮小画像の列を作るだけ。前後のページは表示用の縮小背景まで作っておく
+        canvas_size = (self.canvas.winfo_width(), self.canvas.winfo_height())
+        self.prefetcher.request([(page, None)] + [(p, canvas_size) for p in neighbours])
+        if self._prefetch_job is None: self._prefetch_job = self.root.after(100, self._poll_prefetch)
+
+    def _poll_prefetch(self):
+        """先読みが終わったページを PageCache に登録し直し、上限を超えた分を捨てる"""
+        self._prefetch_job = None
+        while True:
+            try: page = self.prefetcher.done.get_nowait()
+            except queue.Empty: break
+            if page not in self.page_cache and any(p is page for p in self.pages): self.page_cache.touch(page)
+        if self.pages: self.page_cache.trim([self.pages[self.page_index]] + self._neighbour_pages())
+        if self.prefetcher.busy: self._prefetch_job = self.root.after(100, self._poll_prefetch)
+
+    # --- 自動保存 ---
+    def _journal(self, make_record):
+        """make_record() の操作をジャーナルに追記する。自動保存の失敗で編集を止めない"""
+        if not self.journal.active: return
         try:
-            with open(path, 'r', encoding='utf-8') as f: d = json.load(f)
-            self._reset_modes(); self.history_stack = []; self.redo_stack = []
-            self.original_image = self.base64_to_img(d.get("background_image"))
-            self.cache_bg_image = None; self.asset_images = []; self.asset_thumbnails = []; self.asset_frames = []
-            for w in self.scrollable_frame.winfo_children(): w.destroy()
-            for b64 in d.get("asset_images", []):
-                img = self.base64_to_img(b64)
-                if img:
-                    self.asset_images.append(img); aid = len(self.asset_images)-1
-                    tw=140; aspect=img.height/img.width; th=int(tw*aspect); th=140 if th>140 else th
-                    tk_img = ImageTk.PhotoImage(img.resize((tw, th), RESAMPLE_LANCZOS))
-                    self.asset_thumbnails.append(tk_img)
-                    fr = tk.Frame(self.scrollable_frame, bg="#e0e0e0", bd=2, relief="flat"); fr.pack(pady=5, padx=5, fill=tk.X)
-                    self.asset_frames.append(fr)
-                    tk.Button(fr, text="×", font=("Arial", 8), bg="#ffcccc", command=lambda i=aid, f=fr: self.remove_asset_image(i, f), width=2, relief="flat").pack(anchor="ne")
-                    tk.Button(fr, image=tk_img, command=lambda i=aid: self.select_asset_to_place(i), bg="white", relief="flat").pack(padx=2, pady=2)
-                else: self.asset_images.append(None); self.asset_frames.append(None)
-            self.text_listbox.delete(0, tk.END)
-            for t in d.get("registered_texts", []): self.text_listbox.insert(tk.END, t)
-            self.text_objects = d.get("text_objects", []); self.placed_images = d.get("placed_images", []); self.strokes = d.get("strokes", [])
-            self.brush_color = d.get("brush_color", "#ffffff"); self.text_color = d.get("text_color", "#000000"); self.text_outline_color = d.get("text_outline_color", "#ffffff")
-            self.lbl_eraser_preview.config(bg=self.brush_color); self.lbl_text_color_preview.config(bg=self.text_color); self.lbl_outline_color_preview.config(bg=self.text_outline_color)
-            self.update_canvas_image(); messagebox.showinfo("完了", "読み込みました")
-        except Exception as e: messagebox.showerror("エラー", f"{e}")
-
-    def save_history(self):
-        if not self.original_image: return
-        st = {
-            'text_objects': copy.deepcopy(self.text_objects),
-            'placed_images': copy.deepcopy(self.placed_images), 
-            'strokes': copy.deepcopy(self.strokes)
-        }
-        self.history_stack.append(st)
-        if len(self.history_stack) > self.max_history: self.history_stack.pop(0)
-        self.redo_stack.clear()
+            self.journal.append(make_record())
+            if self.journal.needs_compaction(): self._compact_journal()
+        except Exception:
+            traceback.print_exc(); self.journal.close()
+
+    def _journal_command(self, cmd, forward):
+        self._journal(lambda: cmd.to_record(self, forward))
+
+    def _on_edit(self, cmd, forward):
+        """履歴に操作が記録された・戻された。ページに変更の印を付けて自動保存する"""
+        if self.pages and not self.pages[self.page_index].dirty:
+            self.pages[self.page_index].dirty = True; self._update_page_label()
+        self._journal_command(cmd, forward)
+
+    def _compact_journal(self):
+        """今のページを自動保存のスナップショットに書き、ジャーナルを空にする"""
+        if self.background_source is None or len(self.pages) > 1: return
+        try:
+            manifest = self._build_manifest(self.journal.blob_ref)
+            self.journal.compact(manifest, self.strokes.to_bytes())
+        except Exception:
+            traceback.print_exc(); self.journal.close()
+
+    def _apply_journal_record(self, rec):
+        op = rec["op"]
+        if op in ("add", "delete", "move", "props"): items = _item_list(self, rec["kind"])
+        if op == "add": items.insert(rec["index"], rec["obj"])
+        elif op == "delete": del items[rec["index"]]
+        elif op == "move":
+            obj = items[rec["index"]]; obj['x'], obj['y'] = rec["pos"]
+        elif op == "props":
+            obj = items[rec["index"]]; obj.update(rec["set"])
+            for k in rec["unset"]: obj.pop(k, None)
+        elif op == "strokes":
+            self.strokes.truncate(rec["start"]); self.strokes.extend(StrokeStore.from_bytes(base64.b64decode(rec["data"])))
+        elif op == "truncate": self.strokes.truncate(rec["count"])
+        elif op == "asset_add":
+            entry = self.journal.image_entry(rec["asset"])
+            self.asset_images.append(entry)
+            if entry is not None: self._add_asset_widget(len(self.asset_images) - 1, entry)
+        elif op == "asset_remove":
+            self._remove_asset_entry(rec["id"])
+        elif op == "settings":
+            self.export_profiles = normalize_export_profiles(rec["export_profiles"])
+
+    def _offer_recovery(self):
+        if not self.journal.has_data(): return
+        if not messagebox.askyesno("復元", "前回、保存せずに終了した編集内容が残っています。\n復元しますか？"):
+            self.journal.discard(); return
+        try:
+            manifest, background, assets, strokes, records = self.journal.load()
+            self._apply_project((manifest, background, assets, {}, strokes), records)
+        except Exception as e:
+            traceback.print_exc(); messagebox.showerror("エラー", f"復元できませんでした: {e}")
+
+    def on_close(self):
+        if len(self.pages) > 1 and any(p.dirty for p in self.pages):
+            if not messagebox.askyesno("確認", "保存していないページがあります。終了しますか？"): return
+        # 正常に終了するときは自動保存を残さない
+        self.journal.discard(); FONT_INDEX.save(); self.root.destroy()
 
     def undo(self, e=None):
-        if not self.history_stack: return
-        cur = {'text_objects': copy.deepcopy(self.text_objects), 'placed_images': copy.deepcopy(self.placed_images), 'strokes': copy.deepcopy(self.strokes)}
-        self.redo_stack.append(cur); self._restore_state(self.history_stack.pop())
+        if self.active_task is None: self._after_history(self.history.undo(self))
 
     def redo(self, e=None):
-        if not self.redo_stack: return
-        cur = {'text_objects': copy.deepcopy(self.text_objects), 'placed_images': copy.deepcopy(self.placed_images), 'strokes': copy.deepcopy(self.strokes)}
-        self.history_stack.append(cur); self._restore_state(self.redo_stack.pop())
+        if self.active_task is None: self._after_history(self.history.redo(self))
 
-    def _restore_state(self, s):
-        self.text_objects = s['text_objects']; self.placed_images = s['placed_images']; self.strokes = s['strokes']
-        self.cache_bg_image = None
-        self.selected_item = None; self.update_canvas_image(); self.input_text_box.delete("1.0", tk.END); self.btn_update.config(state=tk.DISABLED, bg="#ffebcd")
+    def _after_history(self, cmd):
+        if cmd is None: return
+        if cmd.touches_strokes: self.cache_bg_image = None; self._rebuild_stroke_layer(); self.invalidate_tiles()
+        self.invalidate_layers()
+        self.selected_item = None; self.request_render("history"); self.input_text_box.delete("1.0", tk.END); self.btn_update.config(state=tk.DISABLED, bg="#ffebcd")
 
     def on_canvas_click(self, event):
-        if not self.original_image: return
+        if self.background_source is None: return
+        if self._space_held: self._pan_start = (event.x, event.y, self.offset_x, self.offset_y); return
+        self.flush_render()
         ix = (event.x - self.offset_x) / self.img_scale; iy = (event.y - self.offset_y) / self.img_scale
         if self.dropper_active: self.pick_color_from_image(ix, iy); return
-        if self.placing_text_content or self.placing_image_id is not None or self.brush_active: self.save_history()
+        self.history.seal()
 
         if self.placing_text_content:
-            self.text_objects.append({
+            obj = {
                 'text': self.placing_text_content, 'x': ix, 'y': iy,
                 'size': self.var_font_size.get(), 'line_spacing': self.var_line_spacing.get(), 'char_spacing': self.var_char_spacing.get(),
                 'outline_width': self.var_outline_width.get(), 'outline_color': self.text_outline_color,
@@ -884,89 +3591,262 @@ class ZunComiApp:
                 'font_key': self.combo_font.get(),
                 'use_custom': False, 
                 'align_h': self.combo_align_h.get(), 'align_v': self.combo_align_v.get()
-            })
+            }
+            self.text_objects.append(obj); self.history.record(AddItemCommand('text', len(self.text_objects)-1, obj))
             self.placing_text_content = None; self.text_listbox.selection_clear(0, tk.END); self.btn_list_update.config(state=tk.DISABLED, bg="#ffebcd"); self.root.config(cursor="")
             self.selected_item = {'type': 'text', 'index': len(self.text_objects)-1}
-            self.reflect_selection_to_ui(); self.update_canvas_image(); return
+            self.reflect_selection_to_ui(); self.request_render("place_text"); return
 
         if self.placing_image_id is not None:
             if self.asset_images[self.placing_image_id] is None: return
-            self.placed_images.append({'src_id': self.placing_image_id, 'x': ix, 'y': iy, 'scale': 1.0, 'angle': 0.0})
+            obj = {'src_id': self.placing_image_id, 'x': ix, 'y': iy, 'scale': 1.0, 'angle': 0.0}
+            self.placed_images.append(obj); self.history.record(AddItemCommand('image', len(self.placed_images)-1, obj))
             self.placing_image_id = None; self.update_asset_highlight(None); self.root.config(cursor="")
             self.selected_item = {'type': 'image', 'index': len(self.placed_images)-1}
-            self.reflect_selection_to_ui(); self.update_canvas_image(); return
+            self.reflect_selection_to_ui(); self.request_render("place_image"); return
 
-        if self.brush_active: self._add_stroke(ix, iy); return
+        if self.brush_active: self._begin_stroke(); self._add_stroke(ix, iy); return
 
-        found = None
-        for item in reversed(self.hit_targets):
-            x0, y0, x1, y1 = item['bbox']
-            if x0 <= event.x <= x1 and y0 <= event.y <= y1:
-                found = {'type': item['type'], 'index': item['index']}
-                break
-        
+        found = self.pick_item(event.x, event.y)
         self.selected_item = found
         if self.selected_item:
-            self.save_history()
             self.drag_data["item"] = self.selected_item; self.drag_data["x"] = event.x; self.drag_data["y"] = event.y; self.reflect_selection_to_ui()
         else: self.deselect_all()
-        self.update_canvas_image()
+        self.request_render("selection")
 
     def on_canvas_drag(self, event):
-        if not self.original_image: return
+        if self.background_source is None: return
+        if self._pan_start is not None: self._pan_to(event); return
         ix = (event.x - self.offset_x) / self.img_scale; iy = (event.y - self.offset_y) / self.img_scale
         if self.brush_active: self._add_stroke(ix, iy)
         elif self.drag_data["item"]:
             sel = self.drag_data["item"]; idx = sel['index']
             dx = event.x - self.drag_data["x"]; dy = event.y - self.drag_data["y"]
-            if sel['type'] == 'text':
-                self.text_objects[idx]['x'] += dx / self.img_scale
-                self.text_objects[idx]['y'] += dy / self.img_scale
-            elif sel['type'] == 'image':
-                self.placed_images[idx]['x'] += dx / self.img_scale
-                self.placed_images[idx]['y'] += dy / self.img_scale
+            if self.drag_lift is None: self._begin_drag_lift()
+            obj = _item_list(self, sel['type'])[idx]; old = (obj['x'], obj['y'])
+            obj['x'] += dx / self.img_scale
+            obj['y'] += dy / self.img_scale
+            self.history.record(MoveItemCommand(sel['type'], idx, old, (obj['x'], obj['y'])))
             self.drag_data["x"] = event.x; self.drag_data["y"] = event.y
-            self.update_canvas_image()
+            if self.drag_lift is not None: self.canvas.move("drag_lift", dx, dy)
+            else: self.request_render("drag")
 
     def on_canvas_release(self, event):
-        self.drag_data["item"] = None; 
+        if self._pan_start is not None: self._pan_start = None; return
+        self.drag_data["item"] = None; self.history.seal()
         if self.brush_active:
-            self.cache_bg_image = None; self.update_canvas_image()
+            # 消しゴムレイヤーには描き足し済みなので、背景の合成と線が通ったタイルだけやり直す
+            self._live_stroke_pos = None
+            if self._stroke_start is not None and self._stroke_start < len(self.strokes):
+                self.invalidate_tiles(self.strokes.bounds(self._stroke_start))
+                self.history.record(StrokeCommand(self._stroke_start, len(self.strokes))); self.history.seal()
+            self._stroke_start = None
+            self.cache_bg_image = None; self.request_render("stroke")
+        elif self.drag_lift is not None:
+            # ドラッグ終了時に一度だけ全体を合成し直す
+            self.request_render("drag_end")
+
+    def _begin_drag_lift(self):
+        """
+        選択アイテムを専用のキャンバス画像として持ち上げる。
+        以降のドラッグは canvas.move だけで追従し、ページの複雑さに関係なく軽く動く。
+        """
+        if not self.selected_item: return
+        try:
+            self.flush_render()  # 固定レイヤー (見えている範囲) を今の選択で作っておく
+            sc = self.img_scale
+            layers = self.frozen_layers
+            if layers is None: return
+            img, pos = self._item_bitmap(self.selected_item['type'], self.selected_item['index'], sc)
+            if img is None: return
+            lift = {'below': ImageTk.PhotoImage(skia_to_pil(layers['below'])), 'sprite': ImageTk.PhotoImage(skia_to_pil(img)), 'above': None}
+            if layers['above'] is not None: lift['above'] = ImageTk.PhotoImage(skia_to_pil(layers['above']))
+
+            vx, vy = self.view_origin
+            self.canvas.delete("all")
+            self.canvas.create_image(vx, vy, anchor=tk.NW, image=lift['below'])
+            c0 = pos[0] + self.offset_x; r0 = pos[1] + self.offset_y
+            self.canvas.create_image(c0, r0, anchor=tk.NW, image=lift['sprite'], tags=("drag_lift",))
+            if lift['above'] is not None:
+                self.canvas.create_image(vx, vy, anchor=tk.NW, image=lift['above'])
+            self.canvas.create_rectangle(c0, r0, c0+img.width(), r0+img.height(), outline="cyan", dash=(4,4), width=2, tags=("drag_lift",))
+            obj = self.text_objects[self.selected_item['index']] if self.selected_item['type'] == 'text' else self.placed_images[self.selected_item['index']]
+            ax = obj['x']*sc+self.offset_x; ay = obj['y']*sc+self.offset_y
+            self.canvas.create_oval(ax-4, ay-4, ax+4, ay+4, fill="red", outline="white", tags=("drag_lift",))
+            self.drag_lift = lift
+            self.cancel_render()  # 持ち上げた状態を予約済みの再描画で消さない
+        except Exception:
+            traceback.print_exc()
+            self.drag_lift = None
+
+    def _begin_stroke(self):
+        if self.stroke_layer is None:
+            self.stroke_layer = StrokeLayer(*self.background_source.size)
+        self.strokes.begin_run(); self.stroke_layer.begin_run(); self._live_stroke_pos = None
+        self._stroke_start = len(self.strokes)
 
     def _add_stroke(self, x, y):
-        sz = self.var_brush_size.get(); self.strokes.append((x, y, sz, self.brush_color))
-        sx = x*self.img_scale+self.offset_x; sy = y*self.img_scale+self.offset_y; r = (sz*self.img_scale)/2
-        self.canvas.create_oval(sx-r, sy-r, sx+r, sy+r, fill=self.brush_color, outline=self.brush_color)
+        sz = self.var_brush_size.get(); self.strokes.append(x, y, sz, self.brush_color)
+        # 保存される精度 (float32) の値で描き、読み直したときと同じ結果にする
+        self.stroke_layer.add_dab(*self.strokes.dab(-1))
+        # 画面には離すまでの仮表示として、直前の点からの線分を置く
+        sx = x*self.img_scale+self.offset_x; sy = y*self.img_scale+self.offset_y; w = sz*self.img_scale
+        if self._live_stroke_pos is None:
+            r = w/2; self.canvas.create_oval(sx-r, sy-r, sx+r, sy+r, fill=self.brush_color, outline=self.brush_color)
+        else:
+            px, py = self._live_stroke_pos
+            self.canvas.create_line(px, py, sx, sy, fill=self.brush_color, width=w, capstyle=tk.ROUND)
+        self._live_stroke_pos = (sx, sy)
 
     def on_resize_window(self, event):
-        if self.original_image: self.update_canvas_image()
+        # キャンバスの大きさが実際に変わったときだけ描き直す
+        size = (event.width, event.height)
+        if size == self._last_canvas_size: return
+        self._last_canvas_size = size
+        if self.background_source is not None: self.request_render("resize")
 
     def save_image(self):
-        if not self.original_image: return
-        path = filedialog.asksaveasfilename(defaultextension=".png", filetypes=[("PNG", "*.png")])
+        if self.background_source is None: return
+        profiles = [p for p in self.export_profiles if p["enabled"]]
+        if not profiles: messagebox.showwarning("警告", "有効な書き出し設定がありません"); return
+        first = profiles[0]; ext = EXPORT_FORMATS[first["format"]]
+        path = filedialog.asksaveasfilename(defaultextension=ext, filetypes=[(first["format"], "*" + ext)])
         if not path: return
-        final = self.original_image.copy(); d = ImageDraw.Draw(final)
-        for sx, sy, sz, c in self.strokes: r=sz/2; d.ellipse((sx-r, sy-r, sx+r, sy+r), fill=c)
-        
-        for o in self.placed_images:
-            img_obj = self._render_image_item(o)
-            if img_obj:
-                dx = int(o['x']-img_obj.width/2); dy = int(o['y']-img_obj.height/2)
-                final.paste(img_obj, (dx, dy), img_obj)
-        
-        for o in self.text_objects:
-            img_obj = self._render_text_skia(o)
-            if img_obj:
-                final_x = int(o['x'] - img_obj.width/2); final_y = int(o['y'] - img_obj.height/2)
-                final.paste(img_obj, (final_x, final_y), img_obj)
-        
-        final.save(path); messagebox.showinfo("OK", "保存しました")
+        # 選んだ名前は先頭のプロファイルの出力になるので、その suffix を外して元の名前にする
+        base = os.path.splitext(path)[0]
+        if first["suffix"] and base.endswith(first["suffix"]): base = base[:-len(first["suffix"])]
+        def work(task):
+            # 書き出し中はダイアログで操作を止めているので、ページの内容はワーカーから読んでよい
+            final = self.render_page(threads=EXPORT_THREADS, task=task)
+            task.check(); task.progress(0.5, "画像を書き込み中...")
+            return write_exports(final, profiles, base, EXPORT_THREADS, task.check)
+        self.run_task("書き出し中...", work, lambda outs: messagebox.showinfo("OK", "保存しました\n" + "\n".join(os.path.basename(o) for o in outs)))
+
+    def edit_export_profiles(self):
+        """書き出しプロファイルを編集するダイアログ (OK でプロジェクトの設定に反映する)"""
+        dlg = tk.Toplevel(self.root); dlg.title("書き出し設定"); dlg.transient(self.root); dlg.resizable(False, False)
+        for col, head in enumerate(["", "名前", "形式", "長辺(0=原寸)", "画質", "PNG圧縮", "色", "末尾"]):
+            tk.Label(dlg, text=head).grid(row=0, column=col, padx=3, pady=(10, 2))
+        rows = []
+        for r, p in enumerate(self.export_profiles, 1):
+            v = {"enabled": tk.BooleanVar(value=p["enabled"]), "name": tk.StringVar(value=p["name"]), "format": tk.StringVar(value=p["format"]),
+                 "max_size": tk.IntVar(value=p["max_size"]), "quality": tk.IntVar(value=p["quality"]), "compress_level": tk.IntVar(value=p["compress_level"]),
+                 "mode": tk.StringVar(value=p["mode"]), "suffix": tk.StringVar(value=p["suffix"])}
+            tk.Checkbutton(dlg, variable=v["enabled"]).grid(row=r, column=0, padx=3)
+            tk.Entry(dlg, textvariable=v["name"], width=10).grid(row=r, column=1, padx=3)
+            ttk.Combobox(dlg, textvariable=v["format"], values=list(EXPORT_FORMATS), state="readonly", width=6).grid(row=r, column=2, padx=3)
+            tk.Spinbox(dlg, textvariable=v["max_size"], from_=0, to=20000, increment=100, width=7).grid(row=r, column=3, padx=3)
+            tk.Spinbox(dlg, textvariable=v["quality"], from_=1, to=100, width=4).grid(row=r, column=4, padx=3)
+            tk.Spinbox(dlg, textvariable=v["compress_level"], from_=0, to=9, width=3).grid(row=r, column=5, padx=3)
+            ttk.Combobox(dlg, textvariable=v["mode"], values=EXPORT_MODES, state="readonly", width=5).grid(row=r, column=6, padx=3)
+            tk.Entry(dlg, textvariable=v["suffix"], width=8).grid(row=r, column=7, padx=3)
+            rows.append(v)
+        def ok():
+            try: profiles = [{k: var.get() for k, var in v.items()} for v in rows]
+            except tk.TclError:
+                messagebox.showerror("エラー", "数値の欄に数字以外が入っています", parent=dlg); return
+            used = [p["suffix"] + EXPORT_FORMATS[p["format"]] for p in profiles if p["enabled"]]
+            if len(set(used)) != len(used):
+                messagebox.showerror("エラー", "形式と末尾が同じプロファイルは同時に有効にできません", parent=dlg); return
+            profiles = normalize_export_profiles(profiles); dlg.destroy()
+            if profiles == self.export_profiles: return
+            self.export_profiles = profiles
+            # 設定はページごとの .zmm に保存されるので、どのページも保存し直しが必要になる
+            for page in self.pages: page.dirty = True
+            self._update_page_label()
+            self._journal(lambda: {"op": "settings", "export_profiles": profiles})
+        btns = tk.Frame(dlg); btns.grid(row=len(rows)+1, column=0, columnspan=8, pady=10)
+        tk.Button(btns, text="OK", width=10, command=ok).pack(side=tk.LEFT, padx=5)
+        tk.Button(btns, text="キャンセル", width=10, command=dlg.destroy).pack(side=tk.LEFT, padx=5)
+        dlg.grab_set()
+
+# =========================================================
+#  一括書き出し (GUI なし)
+# =========================================================
+
+_batch_renderer = None  # ワーカープロセスごとの PageRenderer (フォントのキャッシュをページ間で使い回す)
+
+def _batch_worker_init(font_map):
+    global FONT_MAP, _batch_renderer
+    FONT_MAP = font_map
+    FONT_INDEX.load()
+    _batch_renderer = PageRenderer()
+
+def _batch_render_one(src, dst):
+    """1ファイルを書き出す。戻り値は (エラーメッセージ, 字形が無い文字の警告, 素材ライブラリに無かった画像のハッシュのリスト)"""
+    try:
+        _batch_renderer.open_project(src)
+        if _batch_renderer.background_source is None: return "背景画像がありません", None, []
+        if not any(p["enabled"] for p in _batch_renderer.export_profiles): return "有効な書き出し設定がありません", None, []
+        final = _batch_renderer.render_page()
+        if not write_exports(final, _batch_renderer.export_profiles, dst): return "何も書き出されませんでした", None, []
+        missing = _batch_renderer.missing_glyphs()
+        return None, ", ".join(f"{k}: {v}" for k, v in missing.items()) or None, _batch_renderer.missing_assets
+    except Exception as e:
+        return f"{type(e).__name__}: {e}", None, []
+
+def batch_render(argv):
+    """
+    python ZunkeyComicEditor.py render ページ/*.zmm -o 出力先 -j 並列数
+    .zmm を GUI なしで PNG に書き出す。ページごとにプロセスを分けて並列に処理する。
+    """
+    import argparse
+    import concurrent.futures
+    parser = argparse.ArgumentParser(prog="ZunkeyComicEditor render", description=".zmm プロジェクトを PNG に一括で書き出す")
+    parser.add_argument("files", nargs="+", help=".zmm ファイル (ワイルドカード可)")
+    parser.add_argument("-o", "--output-dir", help="出力先フォルダ (省略時は各 .zmm と同じフォルダ)")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1, help="並列に処理するプロセス数")
+    args = parser.parse_args(argv)
+
+    sources = []
+    for pattern in args.files:
+        matches = sorted(glob.glob(pattern)) or ([pattern] if os.path.exists(pattern) else [])
+        if not matches: print(f"見つかりません: {pattern}", file=sys.stderr)
+        for m in matches:
+            if m not in sources: sources.append(m)
+    if not sources: return 1
+    if args.output_dir: os.makedirs(args.output_dir, exist_ok=True)
+    jobs = []
+    for src in sources:
+        out_dir = args.output_dir or os.path.dirname(os.path.abspath(src))
+        jobs.append((src, os.path.join(out_dir, os.path.splitext(os.path.basename(src))[0] + ".png")))
+
+    # フォントの走査は1回だけ行い、結果を各ワーカーに渡す
+    FONT_INDEX.load()
+    font_map = scan_font_map(FONT_INDEX)
+    FONT_INDEX.save()
+
+    failed = 0
+    def report(i, src, dst, result):
+        nonlocal failed
+        err, warning, missing_assets = result
+        if err: failed += 1; print(f"[{i}/{len(jobs)}] 失敗 {src}: {err}", file=sys.stderr)
+        else: print(f"[{i}/{len(jobs)}] {src} -> {dst}")
+        if warning: print(f"    字形が無い文字 {warning}", file=sys.stderr)
+        if missing_assets: print(f"    素材ライブラリに無い画像 (描かずに書き出しました) {', '.join(h[:12] for h in missing_assets)}", file=sys.stderr)
+
+    workers = max(1, min(args.jobs, len(jobs)))
+    if workers == 1:
+        _batch_worker_init(font_map)
+        for i, (src, dst) in enumerate(jobs, 1): report(i, src, dst, _batch_render_one(src, dst))
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=_batch_worker_init, initargs=(font_map,)) as pool:
+            futures = {pool.submit(_batch_render_one, src, dst): (src, dst) for src, dst in jobs}
+            for i, fut in enumerate(concurrent.futures.as_completed(futures), 1):
+                report(i, *futures[fut], fut.result())
+    return 1 if failed else 0
 
 if __name__ == "__main__":
+    # 配布用 EXE で一括書き出しのワーカープロセスとして起動されたときは、ここで処理が終わる
+    import multiprocessing
+    multiprocessing.freeze_support()
+    if len(sys.argv) > 1 and sys.argv[1] == "render":
+        sys.exit(batch_render(sys.argv[2:]))
     try:
+        STARTUP_PROFILE.mark("module import")
         root = tk.Tk()
         app = ZunComiApp(root)
+        STARTUP_PROFILE.mark("ZunComiApp.__init__")
         root.mainloop()
     except Exception:
         traceback.print_exc()
-        
\ No newline at end of file
@@ -0,0 +1,47 @@
+import io
+import os
+import sys
+
+import pytest
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ZunkeyComicEditor as zce  # noqa: E402
+
+
+@pytest.fixture
+def library(tmp_path, monkeypatch):
+    """テスト用の空の素材ライブラリ (ユーザーのライブラリには書かない)"""
+    lib = zce.AssetLibrary(str(tmp_path / "library"))
+    monkeypatch.setattr(zce, "ASSET_LIBRARY", lib)
+    return lib
+
+
+def png_bytes(size=(30, 20), color=(255, 0, 0, 255)):
+    buf = io.BytesIO()
+    Image.new("RGBA", size, color).save(buf, "PNG")
+    return buf.getvalue()
+
+
+def write_project(path, background=None, assets=(), **fields):
+    """
+    テスト用の .zmm を書く。background と assets は PNG などのデータ (assets の None は削除済み、
+    ("library", ハッシュ, 大きさ) は素材ライブラリの参照)。fields は manifest にそのまま入れる
+    """
+    blobs = {}
+
+    def ref(data):
+        if data is None: return None
+        if isinstance(data, tuple): return {"hash": data[1], "size": list(data[2]), "library": True}
+        e = zce.LazyImage.from_bytes(data)
+        name = f"images/{e.digest}.png"
+        blobs[name] = data
+        return {"hash": e.digest, "blob": name, "size": list(e.size)}
+
+    manifest = {"format": zce.PROJECT_FORMAT, "format_version": zce.PROJECT_FORMAT_VERSION,
+                "background": ref(background), "assets": [ref(a) for a in assets],
+                "text_objects": [], "placed_images": [], "strokes": zce.PROJECT_STROKES}
+    manifest.update(fields)
+    zce.write_project_archive(str(path), manifest, blobs, zce.StrokeStore().to_bytes())
+    return manifest
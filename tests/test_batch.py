@@ -0,0 +1,22 @@
+import ZunkeyComicEditor as zce
+from conftest import png_bytes, write_project
+
+
+def test_missing_library_asset_is_reported_separately(tmp_path, library, monkeypatch):
+    monkeypatch.setattr(zce, "_batch_renderer", zce.PageRenderer())
+    src = tmp_path / "p1.zmm"
+    write_project(src, png_bytes((40, 30), (255, 255, 255, 255)), [png_bytes(), ("library", "ab" * 32, (10, 10))],
+                  placed_images=[{'src_id': 1, 'x': 20, 'y': 15, 'scale': 1.0, 'angle': 0}])
+    err, glyphs, missing = zce._batch_render_one(str(src), str(tmp_path / "p1.png"))
+    assert err is None and glyphs is None
+    assert missing == ["ab" * 32]
+    assert (tmp_path / "p1.png").exists()
+
+
+def test_no_enabled_profile_fails(tmp_path, monkeypatch):
+    monkeypatch.setattr(zce, "_batch_renderer", zce.PageRenderer())
+    src = tmp_path / "p1.zmm"
+    profiles = [dict(p, enabled=False) for p in zce.normalize_export_profiles(None)]
+    write_project(src, png_bytes(), export_profiles=profiles)
+    err, _, _ = zce._batch_render_one(str(src), str(tmp_path / "p1.png"))
+    assert err == "有効な書き出し設定がありません"
@@ -0,0 +1,40 @@
+import pytest
+from PIL import Image
+
+import ZunkeyComicEditor as zce
+
+
+@pytest.fixture
+def final():
+    img = Image.new("RGBA", (2000, 1000), (0, 0, 0, 0))
+    img.paste((255, 0, 0, 255), (0, 0, 1000, 1000))
+    return img
+
+
+@pytest.mark.parametrize("threads", [1, 3])
+def test_writes_every_enabled_profile(tmp_path, final, threads):
+    profiles = [dict(p, enabled=True) for p in zce.normalize_export_profiles(None)]
+    outs = zce.write_exports(final, profiles, str(tmp_path / "page.png"), threads=threads)
+    assert sorted(outs) == sorted(str(tmp_path / n) for n in ("page.png", "page_web.webp", "page_thumb.jpg"))
+    with Image.open(tmp_path / "page.png") as img: assert (img.size, img.mode) == ((2000, 1000), "RGBA")
+    with Image.open(tmp_path / "page_web.webp") as img: assert (img.size, img.mode) == ((1600, 800), "RGB")
+    with Image.open(tmp_path / "page_thumb.jpg") as img:
+        assert (img.size, img.mode) == ((320, 160), "RGB")
+        # 透明な部分は白にする
+        assert img.getpixel((300, 80))[0] > 240 and img.getpixel((10, 80))[1] < 30
+
+
+def test_disabled_profiles_write_nothing(tmp_path, final):
+    assert zce.write_exports(final, zce.normalize_export_profiles(None)[1:], str(tmp_path / "page.png")) == []
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_duplicate_output_names_are_rejected(tmp_path, final):
+    profile = dict(zce.DEFAULT_EXPORT_PROFILES[0])
+    with pytest.raises(ValueError):
+        zce.write_exports(final, [profile, dict(profile, max_size=100)], str(tmp_path / "page.png"))
+
+
+def test_normalize_fills_missing_fields():
+    (p,) = zce.normalize_export_profiles([{"format": "TIFF", "mode": "CMYK", "max_size": 50}])
+    assert p["format"] == "PNG" and p["mode"] == "RGBA" and p["max_size"] == 50 and p["suffix"] == ""
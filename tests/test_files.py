@@ -0,0 +1,37 @@
+import os
+import stat
+
+import pytest
+
+import ZunkeyComicEditor as zce
+
+
+def _mode(path):
+    return stat.S_IMODE(os.stat(path).st_mode)
+
+
+@pytest.mark.skipif(os.name != "posix", reason="POSIX のパーミッション")
+def test_atomic_write_uses_umask_and_keeps_existing_mode(tmp_path):
+    path = tmp_path / "out.png"
+    zce.atomic_write_file(str(path), lambda f: f.write(b"1"))
+    assert path.read_bytes() == b"1" and _mode(path) == 0o666 & ~zce._UMASK
+    os.chmod(path, 0o640)
+    zce.atomic_write_file(str(path), lambda f: f.write(b"2"))
+    assert path.read_bytes() == b"2" and _mode(path) == 0o640
+
+
+def test_failed_write_keeps_original(tmp_path):
+    path = tmp_path / "p.zmm"
+    path.write_bytes(b"original")
+
+    def fail(f):
+        f.write(b"partial"); raise RuntimeError("disk full")
+
+    def cancel():
+        raise KeyboardInterrupt
+
+    with pytest.raises(RuntimeError):
+        zce.atomic_write_file(str(path), fail)
+    with pytest.raises(KeyboardInterrupt):
+        zce.atomic_write_file(str(path), lambda f: f.write(b"new"), check=cancel)
+    assert path.read_bytes() == b"original" and os.listdir(tmp_path) == ["p.zmm"]
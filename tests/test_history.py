@@ -0,0 +1,66 @@
+import types
+
+import pytest
+
+import ZunkeyComicEditor as zce
+
+
+def _page():
+    return types.SimpleNamespace(text_objects=[], placed_images=[], strokes=zce.StrokeStore())
+
+
+def test_edit_command_requires_overrides():
+    class Incomplete(zce.EditCommand):
+        def apply(self, app): pass
+
+    with pytest.raises(TypeError):
+        Incomplete()
+
+
+def test_add_undo_redo():
+    page = _page(); history = zce.EditHistory()
+    obj = {'text': 'a', 'x': 1, 'y': 2}
+    cmd = zce.AddItemCommand('text', 0, obj); cmd.apply(page); history.record(cmd)
+    assert history.undo(page) is cmd and page.text_objects == []
+    assert history.redo(page) is cmd and page.text_objects == [obj]
+    assert history.redo(page) is None
+
+
+def test_drag_moves_merge_until_sealed():
+    page = _page(); page.text_objects.append({'x': 0, 'y': 0}); history = zce.EditHistory()
+    for i in range(1, 4):
+        cmd = zce.MoveItemCommand('text', 0, (i - 1, 0), (i, 0)); cmd.apply(page); history.record(cmd)
+    assert len(history.undo_stack) == 1
+    history.seal()
+    cmd = zce.MoveItemCommand('text', 0, (3, 0), (9, 0)); cmd.apply(page); history.record(cmd)
+    assert len(history.undo_stack) == 2
+    history.undo(page); assert (page.text_objects[0]['x'], page.text_objects[0]['y']) == (3, 0)
+    history.undo(page); assert (page.text_objects[0]['x'], page.text_objects[0]['y']) == (0, 0)
+
+
+def test_property_merge_respects_window():
+    page = _page(); page.text_objects.append({'size': 10}); history = zce.EditHistory()
+    first = zce.PropertyCommand.diff('text', 0, page.text_objects[0], {'size': 11}); first.apply(page); history.record(first)
+    late = zce.PropertyCommand.diff('text', 0, page.text_objects[0], {'size': 12})
+    late.time = first.time + zce.HISTORY_MERGE_WINDOW + 1; late.apply(page); history.record(late)
+    assert len(history.undo_stack) == 2
+    assert zce.PropertyCommand.diff('text', 0, page.text_objects[0], {'size': 12}) is None
+
+
+def test_trim_drops_oldest_by_bytes():
+    page = _page(); history = zce.EditHistory(max_bytes=1)
+    for i in range(3):
+        cmd = zce.AddItemCommand('text', i, {'text': 'x' * 100}); cmd.apply(page); history.record(cmd); history.seal()
+    # 上限を超えても最後の1手は残す
+    assert len(history.undo_stack) == 1 and history.undo_stack[0].index == 2
+
+
+
+def test_listener_sees_merged_drag_once():
+    page = _page(); page.text_objects.append({'x': 0, 'y': 0}); history = zce.EditHistory()
+    seen = []; history.listener = lambda cmd, forward: seen.append(cmd.to_record(page, forward))
+    for i in range(1, 50):
+        cmd = zce.MoveItemCommand('text', 0, (i - 1, 0), (i, 0)); cmd.apply(page); history.record(cmd)
+    history.seal()
+    assert seen == [{"op": "move", "kind": "text", "index": 0, "pos": [1, 0]},
+                    {"op": "move", "kind": "text", "index": 0, "pos": [49, 0]}]
@@ -0,0 +1,26 @@
+import random
+
+import ZunkeyComicEditor as zce
+
+
+def test_query_matches_brute_force():
+    rng = random.Random(1)
+    grid = zce.HitGrid(cell=64)
+    boxes = {}
+    for i in range(200):
+        x, y = rng.uniform(-100, 2000), rng.uniform(-100, 3000)
+        boxes[('text', i)] = (x, y, x + rng.uniform(1, 400), y + rng.uniform(1, 400))
+        grid.update(('text', i), boxes[('text', i)])
+    for _ in range(500):
+        x, y = rng.uniform(-150, 2500), rng.uniform(-150, 3500)
+        expected = {k for k, b in boxes.items() if b[0] <= x < b[2] and b[1] <= y < b[3]}
+        assert set(grid.query(x, y)) == expected
+
+
+def test_update_moves_and_remove_forgets():
+    grid = zce.HitGrid(cell=10)
+    grid.update('a', (0, 0, 5, 5))
+    grid.update('a', (100, 100, 105, 105))
+    assert grid.query(2, 2) == [] and grid.query(101, 101) == ['a']
+    grid.remove('a'); grid.remove('missing')
+    assert len(grid) == 0 and grid.query(101, 101) == [] and grid._cells == {}
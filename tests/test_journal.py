@@ -0,0 +1,77 @@
+from PIL import Image
+
+import ZunkeyComicEditor as zce
+from conftest import png_bytes
+
+
+def _manifest(journal, background, assets):
+    return {"background": journal.blob_ref(background),
+            "assets": [journal.blob_ref(e, thumb=True) if e else None for e in assets],
+            "text_objects": [], "placed_images": []}
+
+
+def test_compact_and_load_with_library_assets(tmp_path, library):
+    path = tmp_path / "a.png"
+    path.write_bytes(png_bytes())
+    asset = zce.LazyImage.from_file(str(path))
+    library.add(asset)
+    # 背景が素材と同じ画像でも、背景は blobs/ に書く
+    background = zce.LazyImage.from_bytes(png_bytes())
+    assert background.digest == asset.digest
+    journal = zce.EditJournal(str(tmp_path / "autosave"))
+    manifest = _manifest(journal, background, [asset, None])
+    assert manifest["assets"][0] == {"hash": asset.digest, "size": [30, 20], "library": True}
+    assert "blob" in manifest["background"]
+
+    journal.compact(manifest, zce.StrokeStore().to_bytes())
+    assert journal.active
+    _, loaded_bg, assets, _, _ = journal.load()
+    assert loaded_bg.source_bytes() == png_bytes()
+    assert assets[0].digest == asset.digest and assets[1] is None
+
+
+def test_missing_library_asset_loads_as_none(tmp_path, library):
+    journal = zce.EditJournal(str(tmp_path / "autosave"))
+    assert journal.image_entry({"hash": "ab" * 32, "size": [1, 1], "library": True}) is None
+
+
+def test_blob_ref_keeps_original_file_bytes(tmp_path, library):
+    # 背景の JPEG は PNG にエンコードし直さずにそのまま書く
+    path = tmp_path / "page.jpg"
+    Image.new("RGB", (64, 48), (200, 100, 50)).save(path, "JPEG")
+    background = zce.LazyImage.from_file(str(path))
+    journal = zce.EditJournal(str(tmp_path / "autosave"))
+    ref = journal.blob_ref(background)
+    assert (tmp_path / "autosave" / ref["blob"]).read_bytes() == path.read_bytes()
+    assert background._image is None
+    journal.compact(_manifest(journal, background, []), zce.StrokeStore().to_bytes())
+    _, loaded, _, _, _ = journal.load()
+    assert loaded.size == (64, 48) and loaded.image.size == (64, 48)
+
+
+def test_records_after_snapshot_are_replayed(tmp_path, library):
+    journal = zce.EditJournal(str(tmp_path / "autosave"), compact_every=3)
+    background = zce.LazyImage.from_bytes(png_bytes())
+    journal.compact(_manifest(journal, background, []), zce.StrokeStore().to_bytes())
+    journal.append({"op": "move", "kind": "text", "index": 0, "pos": [1, 2]})
+    journal.append({"op": "truncate", "count": 0})
+    assert not journal.needs_compaction()
+    journal.close()
+    # 書きかけの最後の行は捨てる
+    with open(tmp_path / "autosave" / zce.EditJournal.JOURNAL, "a", encoding="utf-8") as f: f.write('{"op": "mo')
+    _, _, _, _, records = journal.load()
+    assert [r["op"] for r in records] == ["move", "truncate"]
+
+
+def test_journal_from_older_snapshot_is_ignored(tmp_path, library):
+    journal = zce.EditJournal(str(tmp_path / "autosave"))
+    manifest = _manifest(journal, zce.LazyImage.from_bytes(png_bytes()), [])
+    journal.compact(manifest, zce.StrokeStore().to_bytes())
+    journal.append({"op": "truncate", "count": 0})
+    journal.close()
+    stale = (tmp_path / "autosave" / zce.EditJournal.JOURNAL).read_text(encoding="utf-8")
+    journal.compact(manifest, zce.StrokeStore().to_bytes())
+    journal.close()
+    # 新しいスナップショットの後に、古い世代のジャーナルが残っていた場合
+    (tmp_path / "autosave" / zce.EditJournal.JOURNAL).write_text(stale, encoding="utf-8")
+    assert journal.load()[4] == []
@@ -0,0 +1,47 @@
+import os
+
+import pytest
+
+import ZunkeyComicEditor as zce
+from conftest import png_bytes
+
+
+def _library_files(library):
+    return sorted(name for _, _, names in os.walk(library.directory) for name in names)
+
+
+def test_save_stores_assets_and_shares_them(tmp_path, library):
+    entry = zce.LazyImage.from_bytes(png_bytes())
+    info = {"hash": entry.digest, "size": list(entry.size), "library": True}
+    assert _library_files(library) == []
+    zce.write_project_archive(str(tmp_path / "a.zmm"), {"format": zce.PROJECT_FORMAT, "assets": [info]}, {}, b"",
+                              library=[(entry, info)])
+    assert _library_files(library) == [entry.digest]
+    assert library.entry(entry.digest) is entry
+    with open(library.path(entry.digest), "rb") as f: assert f.read() == png_bytes()
+
+
+def test_stale_digest_is_rekeyed_from_bytes(library):
+    data = png_bytes()
+    stale = zce.LazyImage("0" * 64, (30, 20), loader=lambda: data)
+    digest, created = library.add(stale)
+    assert created and digest == zce.LazyImage.from_bytes(data).digest
+    assert library.add(zce.LazyImage.from_bytes(data)) == (digest, False)
+
+
+def test_cancelled_save_removes_new_library_files(tmp_path, library):
+    class Cancel(Exception): pass
+
+    class Task:
+        calls = 0
+        def check(self):
+            Task.calls += 1
+            if Task.calls > 1: raise Cancel
+        def progress(self, *args): pass
+
+    entry = zce.LazyImage.from_bytes(png_bytes())
+    info = {"hash": entry.digest, "size": list(entry.size), "library": True}
+    with pytest.raises(Cancel):
+        zce.write_project_archive(str(tmp_path / "a.zmm"), {}, {}, b"", Task(), [(entry, info)])
+    assert _library_files(library) == []
+    assert not (tmp_path / "a.zmm").exists()
@@ -0,0 +1,61 @@
+import base64
+import json
+import zipfile
+
+import pytest
+
+import ZunkeyComicEditor as zce
+from conftest import png_bytes, write_project
+
+
+def test_archive_round_trip_is_lazy(tmp_path, library):
+    path = tmp_path / "p.zmm"
+    bg = png_bytes((40, 30), (255, 255, 255, 255)); asset = png_bytes((8, 6), (0, 0, 255, 255))
+    texts = [{'text': 'あ', 'x': 1, 'y': 2, 'size': 20, 'color': '#000000', 'vertical': True}]
+    write_project(path, bg, [asset, None, asset], text_objects=texts)
+    with zipfile.ZipFile(path) as zf:
+        # 同じ素材は1つだけ、画像は無圧縮で入れる
+        images = [i for i in zf.infolist() if i.filename.startswith("images/")]
+        assert len(images) == 2 and all(i.compress_type == zipfile.ZIP_STORED for i in images)
+
+    manifest, background, assets, thumbs, strokes = zce.read_project_file(str(path), decode_background=False)
+    assert manifest["text_objects"] == texts
+    assert background.size == (40, 30) and background._image is None
+    assert assets[1] is None and assets[0] is assets[2] and assets[0]._image is None
+    assert assets[0].source_bytes() == asset and assets[0].image.size == (8, 6)
+    assert len(strokes) == 0 and thumbs == {}
+
+
+def test_archive_rejects_newer_or_foreign_files(tmp_path, library):
+    newer = tmp_path / "newer.zmm"
+    write_project(newer, png_bytes(), format_version=zce.PROJECT_FORMAT_VERSION + 1)
+    with pytest.raises(ValueError):
+        zce.read_project_file(str(newer))
+    foreign = tmp_path / "foreign.zmm"
+    write_project(foreign, png_bytes(), format="something-else")
+    with pytest.raises(ValueError):
+        zce.read_project_file(str(foreign))
+
+
+def test_missing_embedded_image_is_an_error(tmp_path, library):
+    path = tmp_path / "p.zmm"
+    manifest = write_project(path, png_bytes())
+    with zipfile.ZipFile(path, "w") as zf:
+        zf.writestr(zce.PROJECT_MANIFEST, json.dumps(manifest))
+    with pytest.raises(ValueError):
+        zce.read_project_file(str(path))
+
+
+def test_legacy_json_project(tmp_path, library):
+    path = tmp_path / "old.zmm"
+    bg = png_bytes((40, 30)); asset = png_bytes((8, 6))
+    strokes = [[1, 2, 10, '#ffffff'], [3, 4, 10, '#ffffff']]
+    path.write_text(json.dumps({
+        "background_image": base64.b64encode(bg).decode(), "asset_images": [base64.b64encode(asset).decode(), "broken"],
+        "text_objects": [], "placed_images": [], "strokes": strokes, "stroke_runs": [0]}), encoding="utf-8")
+    manifest, background, assets, thumbs, st = zce.read_project_file(str(path))
+    # 埋め込まれていたデータのまま、そのバイト列のハッシュで扱う
+    assert background.source_bytes() == bg and background.image.size == (40, 30)
+    assert assets[0].digest == zce.LazyImage.from_bytes(asset).digest and assets[1] is None
+    assert set(thumbs) == {assets[0].digest}
+    assert [list(d) for d in st] == strokes and list(st.iter_runs()) == [(0, 2)]
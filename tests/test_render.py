@@ -0,0 +1,86 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+import ZunkeyComicEditor as zce
+from conftest import png_bytes
+
+
+@pytest.fixture
+def app():
+    """Tk を使わずに描画まわりだけを使う ZunComiApp"""
+    app = zce.ZunComiApp.__new__(zce.ZunComiApp)
+    zce.PageRenderer.__init__(app)
+    return app
+
+
+def _bitmap_box(app, kind, idx, sc):
+    img, pos = app._item_bitmap(kind, idx, sc, cached=False)
+    return (pos[0], pos[1], pos[0] + img.width(), pos[1] + img.height())
+
+
+@pytest.mark.parametrize("vertical", [True, False])
+@pytest.mark.parametrize("size,outline_width,angle", [(15, 0, 0), (20, 0, 0), (20, 3, 17), (64, 2, 0)])
+def test_text_extent_matches_bitmap(app, vertical, size, outline_width, angle):
+    app.text_objects = [{'text': 'あいうえおかきくけこさしすせそたちつてと', 'x': 1000.3, 'y': 1000.7, 'size': size,
+                         'color': '#000000', 'outline_color': '#ffffff', 'outline_width': outline_width,
+                         'vertical': vertical, 'line_spacing': 20, 'char_spacing': 0, 'angle': angle}]
+    for sc in (0.09, 0.13, 0.5, 1.0, 2.0, 8.0):
+        assert app._item_extent('text', 0, sc) == _bitmap_box(app, 'text', 0, sc)
+
+
+@pytest.mark.parametrize("scale,angle", [(0.3, 0), (0.77, 33), (1.5, 90)])
+def test_image_extent_matches_bitmap(app, scale, angle):
+    app.asset_images = [zce.LazyImage.from_bytes(png_bytes((333, 211)))]
+    app.placed_images = [{'src_id': 0, 'x': 500.5, 'y': 700.2, 'scale': scale, 'angle': angle}]
+    for sc in (0.09, 0.5, 1.0, 2.3, 8.0):
+        assert app._item_extent('image', 0, sc) == _bitmap_box(app, 'image', 0, sc)
+
+
+def _draw_region(app, draw, rect):
+    x0, y0, x1, y1 = rect
+    surface = zce.skia.Surface(x1 - x0, y1 - y0)
+    with surface as canvas:
+        canvas.clear(zce.skia.ColorTRANSPARENT)
+        canvas.translate(-x0, -y0)
+        draw(canvas)
+    return surface.makeImageSnapshot().toarray(alphaType=zce.skia.kPremul_AlphaType).astype(int)
+
+
+@pytest.mark.parametrize("kind", ['text', 'image'])
+def test_clipped_item_matches_bitmap(app, kind):
+    app.asset_images = [zce.LazyImage.from_bytes(png_bytes((120, 80), (30, 60, 90, 200)))]
+    app.placed_images = [{'src_id': 0, 'x': 300, 'y': 200, 'scale': 1.5, 'angle': 30}]
+    app.text_objects = [{'text': 'ドドドド', 'x': 300, 'y': 200, 'size': 90, 'color': '#ff0000',
+                         'outline_color': '#ffffff', 'outline_width': 6, 'vertical': True, 'angle': 12}]
+    sc = 4.0
+    box = app._item_extent(kind, 0, sc)
+    # アイテムの中ほどにかかるタイル
+    rect = (int(box[0]) + 300, int(box[1]) + 300, int(box[0]) + 556, int(box[1]) + 556)
+    clipped = _draw_region(app, lambda c: app._draw_item_clipped(c, kind, 0, sc, box), rect)
+    whole = _draw_region(app, lambda c: app._draw_items(c, [(kind, 0)], sc, cached=False), rect)
+    assert whole[..., 3].max() > 0
+    # 回転した輪郭のアンチエイリアスと、画像の縮小・回転の補間だけが違う
+    assert abs(clipped - whole).max() <= (16 if kind == 'text' else 64)
+    assert abs(clipped - whole).mean() < 0.5
+
+
+@pytest.mark.parametrize("threads,band_height", [(1, 64), (3, 37), (2, 10000)])
+def test_banded_export_matches_full_composite(threads, band_height):
+    page = zce.PageRenderer()
+    bg = Image.fromarray(np.random.default_rng(1).integers(0, 255, (300, 200, 3), np.uint8)).convert("RGBA")
+    page.background_source = zce.LazyImage.from_bytes(zce.encode_png(bg))
+    page.asset_images = [zce.LazyImage.from_bytes(png_bytes((50, 40), (0, 0, 255, 180)))]
+    # 帯の境目・ページの端にかかるアイテムと、ページの外のアイテム
+    page.placed_images = [{'src_id': 0, 'x': 100, 'y': y, 'scale': 1.2, 'angle': a} for y, a in ((60, 0), (130, 25), (295, 0), (500, 0))]
+    page.text_objects = [{'text': 'テスト', 'x': 60 + 20 * i, 'y': 40 + 90 * i, 'size': 24, 'color': '#ff0000',
+                          'outline_color': '#ffffff', 'outline_width': 2, 'vertical': bool(i % 2), 'angle': 10 * i} for i in range(4)]
+    page.strokes.begin_run()
+    for i in range(20): page.strokes.append(10 + 9 * i, 150, 12, '#00ff00')
+    page._rebuild_stroke_layer()
+
+    compositor = zce.SkiaCompositor()
+    page.compose_page(compositor, 1.0, page.background_source.size)
+    expected = np.asarray(compositor.to_pil())
+    actual = np.asarray(page.render_page(threads=threads, band_height=band_height))
+    assert np.array_equal(actual, expected)
@@ -0,0 +1,39 @@
+import ZunkeyComicEditor as zce
+
+
+def _image(w, h):
+    return zce.skia.Surface(w, h).makeImageSnapshot()
+
+
+def test_evicts_least_recently_used_by_bytes():
+    cache = zce.RenderCache(max_bytes=3 * 10 * 10 * 4)
+    for key in "abc": cache.put(key, _image(10, 10))
+    assert cache.get("a") is not None  # a を新しくする
+    cache.put("d", _image(10, 10))
+    assert "b" not in cache and all(k in cache for k in "acd")
+    assert cache.current_bytes == 3 * 10 * 10 * 4
+
+
+def test_none_results_are_cached():
+    cache = zce.RenderCache(max_bytes=100)
+    assert cache.get("x", zce.RenderCache.MISSING) is zce.RenderCache.MISSING
+    cache.put("x", None)
+    assert cache.get("x", zce.RenderCache.MISSING) is None
+    assert cache.current_bytes == 0 and cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+
+def test_oversized_image_is_not_kept():
+    cache = zce.RenderCache(max_bytes=10 * 10 * 4)
+    cache.put("small", _image(10, 10))
+    cache.put("big", _image(20, 20))
+    assert "big" not in cache and "small" in cache
+
+
+def test_replace_and_discard_keep_byte_count():
+    cache = zce.RenderCache(max_bytes=10 ** 6)
+    cache.put(("t", 1), _image(10, 10)); cache.put(("t", 1), _image(5, 5)); cache.put(("i", 2), _image(4, 4))
+    assert cache.current_bytes == (25 + 16) * 4
+    cache.discard_where(lambda k: k[0] == "t")
+    assert len(cache) == 1 and cache.current_bytes == 16 * 4
+    cache.clear()
+    assert len(cache) == 0 and cache.current_bytes == 0
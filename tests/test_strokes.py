@@ -0,0 +1,60 @@
+import pytest
+
+import ZunkeyComicEditor as zce
+
+
+def _store(runs):
+    """runs: 線ごとの [(x, y, 太さ, 色), ...]"""
+    st = zce.StrokeStore(capacity=2)
+    for run in runs:
+        st.begin_run()
+        for dab in run: st.append(*dab)
+    return st
+
+
+RUNS = [[(1.5, 2.0, 10.0, '#ffffff'), (3.0, 4.0, 10.0, '#ffffff')],
+        [(5.0, 6.0, 20.0, '#000000')],
+        [(7.0, 8.0, 5.0, '#ffffff'), (9.0, 10.0, 5.0, '#ff0000'), (11.0, 12.0, 5.0, '#ff0000')]]
+
+
+def test_bytes_round_trip():
+    st = _store(RUNS)
+    back = zce.StrokeStore.from_bytes(st.to_bytes())
+    assert list(back) == list(st)
+    assert list(back.iter_runs()) == list(st.iter_runs()) == [(0, 2), (2, 3), (3, 6)]
+    assert len(zce.StrokeStore.from_bytes(zce.StrokeStore().to_bytes())) == 0
+
+
+def test_from_bytes_rejects_other_data():
+    with pytest.raises(ValueError):
+        zce.StrokeStore.from_bytes(b"not strokes")
+
+
+def test_slice_keeps_run_boundaries():
+    st = _store(RUNS)
+    part = st.slice(1, 4)
+    assert list(part) == list(st)[1:4]
+    # 線の途中から切り出した分も1本の線として始まる
+    assert list(part.iter_runs()) == [(0, 1), (1, 2), (2, 3)]
+
+
+def test_truncate_then_extend_restores_strokes():
+    st = _store(RUNS)
+    before = list(st); runs = list(st.iter_runs())
+    removed = st.slice(2, len(st)); st.truncate(2)
+    assert list(st) == before[:2] and list(st.iter_runs()) == [(0, 2)]
+    st.extend(removed)
+    assert list(st) == before and list(st.iter_runs()) == runs
+
+
+def test_extend_remaps_palette():
+    st = _store([[(0, 0, 1, '#00ff00')]])
+    st.extend(_store([[(1, 1, 1, '#ff0000'), (2, 2, 1, '#00ff00')]]))
+    assert [d[3] for d in st] == ['#00ff00', '#ff0000', '#00ff00']
+    assert st.palette == ['#00ff00', '#ff0000']
+
+
+def test_legacy_list_without_runs_is_one_run_per_dab():
+    st = zce.StrokeStore.from_legacy([[1, 2, 3, '#ffffff'], [4, 5, 6, '#ffffff']])
+    assert list(st.iter_runs()) == [(0, 1), (1, 2)]
+    assert st.bounds() == (1 - 2.5, 2 - 2.5, 4 + 4.0, 5 + 4.0)